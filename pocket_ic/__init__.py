@@ -3,11 +3,49 @@
 of this package.
 
 Instances are running on a PocketIC server, which is represented
-by `PocketICServer`.
+by `PocketICServer`, or on a group of servers, `PocketICServerCluster`.
 
 `SubnetConfig` is used to configure the subnets of a PocketIC instance.
+
+The submodules are loaded lazily on first attribute access, so that
+`import pocket_ic` stays cheap for tools that never touch the heavy
+dependencies (ic-py and its Candid parser).
 """
 
-from .pocket_ic import *
-from .pocket_ic_server import *
-from .subnet_config import *
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .install_mode import InstallMode, UpgradeOptions, WasmMemoryPersistence
+    from .pocket_ic import CanisterSnapshot, Checkpoint, PocketIC
+    from .pocket_ic_server import PocketICServer, PocketICServerCluster
+    from .subnet_config import InstructionConfig, SubnetConfig, SubnetKind
+
+_EXPORTS = {
+    "InstallMode": ".install_mode",
+    "UpgradeOptions": ".install_mode",
+    "WasmMemoryPersistence": ".install_mode",
+    "CanisterSnapshot": ".pocket_ic",
+    "Checkpoint": ".pocket_ic",
+    "PocketIC": ".pocket_ic",
+    "PocketICServer": ".pocket_ic_server",
+    "PocketICServerCluster": ".pocket_ic_server",
+    "InstructionConfig": ".subnet_config",
+    "SubnetConfig": ".subnet_config",
+    "SubnetKind": ".subnet_config",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
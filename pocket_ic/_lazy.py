@@ -0,0 +1,33 @@
+"""
+This module contains helpers to defer the import of heavy dependencies.
+"""
+
+import importlib.util
+import sys
+from types import ModuleType
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Returns the module `name` without executing it. The module is executed on
+    first attribute access. If the module was already imported, it is returned as is.
+
+    Args:
+        name (str): the absolute name of a top-level module
+
+    Raises:
+        ModuleNotFoundError: if the module cannot be found
+
+    Returns:
+        ModuleType: the (lazy) module
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,23 @@
+"""
+This module contains small statistics helpers shared by the measurement tools.
+"""
+
+import math
+from typing import Sequence
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    """Returns the `p`-th percentile of `values` using the nearest-rank method.
+
+    Args:
+        values (Sequence[float]): the values, in any order
+        p (float): the percentile, between 0 and 100
+
+    Returns:
+        float: the percentile, or 0 if `values` is empty
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
@@ -0,0 +1,136 @@
+"""
+This module contains `AutoProgress`, a background driver that executes rounds on a
+`PocketIC` instance and completes the futures of submitted update calls. Use
+`PocketIC.start_auto_progress` to start one.
+"""
+
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, List, Optional
+
+if TYPE_CHECKING:
+    from pocket_ic.pocket_ic import PocketIC
+
+
+class _Pending:
+    def __init__(self, message_id: dict) -> None:
+        self.message_id = message_id
+        self.future: Future = Future()
+        self.rounds = 0
+
+
+class AutoProgress:
+    """
+    Executes a round on a `PocketIC` instance every `interval` seconds on a background
+    thread. After every round, the status of all pending update calls is swept and the
+    futures of completed calls are resolved, so any number of calls submitted from any
+    thread share the same rounds.
+    """
+
+    def __init__(self, pic: PocketIC, interval: float = 0.01, max_rounds: int = 100):
+        """
+        Args:
+            pic (PocketIC): the instance to execute rounds on
+            interval (float, optional): the seconds to wait between rounds, defaults to 0.01
+            max_rounds (int, optional): the number of rounds after which a pending call
+                fails, defaults to 100
+        """
+        self.pic = pic
+        self.interval = interval
+        self.max_rounds = max_rounds
+        self.rounds = 0
+        self._pending: List[_Pending] = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        """Whether the driver is executing rounds."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Starts executing rounds. Calling this method while running has no effect."""
+        if self.running:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="pocket-ic-auto-progress", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops executing rounds once the current round is done. Calls that are still
+        pending fail with a `RuntimeError`."""
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for call in pending:
+            if not call.future.done():
+                call.future.set_exception(
+                    RuntimeError(
+                        "Auto-progress stopped before the update call completed"
+                    )
+                )
+
+    def watch(self, message_id: dict) -> Future:
+        """Returns a future for the result of a submitted update call, which is resolved
+        by the following rounds.
+
+        Args:
+            message_id (dict): the message ID returned by `PocketIC.submit_call`
+
+        Raises:
+            RuntimeError: if the driver is not running
+
+        Returns:
+            Future: a future resolving to the result, like `PocketIC.await_call`
+        """
+        if not self.running:
+            raise RuntimeError("Auto-progress is not running")
+        call = _Pending(message_id)
+        with self._lock:
+            self._pending.append(call)
+        return call.future
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.pic.tick()
+                self.rounds += 1
+                self._sweep()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                # Fail the calls waiting on this round rather than the driver.
+                with self._lock:
+                    pending, self._pending = self._pending, []
+                for call in pending:
+                    if not call.future.done():
+                        call.future.set_exception(e)
+            self._stopped.wait(self.interval)
+
+    def _sweep(self) -> None:
+        """Checks the status of all pending calls and resolves the completed ones. A call
+        whose status cannot be read fails on its own, without affecting the others."""
+        with self._lock:
+            pending = list(self._pending)
+        for call in pending:
+            call.rounds += 1
+            try:
+                result = self.pic.call_result(call.message_id)
+                if result is not None:
+                    call.future.set_result(result)
+                elif call.rounds >= self.max_rounds:
+                    msg = f"PocketIC did not complete the update call within {self.max_rounds} rounds"
+                    call.future.set_exception(ValueError(msg))
+                else:
+                    continue
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                call.future.set_exception(e)
+            with self._lock:
+                if call in self._pending:
+                    self._pending.remove(call)
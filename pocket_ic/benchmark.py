@@ -0,0 +1,493 @@
+"""
+This module contains helpers to benchmark canister methods and upgrades on a PocketIC
+instance, reporting the cycles and estimated instructions every call costs.
+
+Instructions are not reported by the IC; they are estimated from the cycles a call cost,
+using the fees below scaled to the size of the canister's subnet. The estimates drift
+if the fees change, and they include any cycles the canister burns for its storage
+while the call executes. For update calls, they also include the reception fee of the
+ingress bytes that are not accounted for, see `measure_call`.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+from typing import TYPE_CHECKING, Callable, List, Optional, Sequence
+from pocket_ic._stats import percentile
+from pocket_ic.install_mode import InstallMode, UpgradeOptions
+
+if TYPE_CHECKING:
+    import ic
+    from pocket_ic.pocket_ic import Checkpoint, PocketIC
+
+# Fees charged on a subnet of `REFERENCE_SUBNET_SIZE` nodes, see
+# https://internetcomputer.org/docs/current/developer-docs/gas-cost
+# Application subnets of other sizes charge proportionally more or less.
+REFERENCE_SUBNET_SIZE = 13
+UPDATE_MESSAGE_EXECUTION_FEE = 5_000_000
+TEN_UPDATE_INSTRUCTIONS_EXECUTION_FEE = 4
+INGRESS_MESSAGE_RECEPTION_FEE = 1_200_000
+INGRESS_BYTE_RECEPTION_FEE = 2_000
+# The instructions a single ingress byte's reception fee amounts to.
+INSTRUCTIONS_PER_INGRESS_BYTE = (
+    INGRESS_BYTE_RECEPTION_FEE * 10 // TEN_UPDATE_INSTRUCTIONS_EXECUTION_FEE
+)
+
+
+def _instructions(execution_cycles: int, subnet_size: int) -> int:
+    """Converts the cycles charged for execution on a subnet into instructions."""
+    reference_cycles = execution_cycles * REFERENCE_SUBNET_SIZE // subnet_size
+    return max(0, reference_cycles * 10 // TEN_UPDATE_INSTRUCTIONS_EXECUTION_FEE)
+
+
+def estimate_instructions(
+    cycles: int, ingress_bytes: int = 0, subnet_size: int = REFERENCE_SUBNET_SIZE
+) -> int:
+    """Estimates the number of instructions an ingress message executed from the cycles
+    it cost, by subtracting the fixed fees. This is only meaningful on application
+    subnets; system subnets do not charge cycles.
+
+    Args:
+        cycles (int): the cycles the message cost
+        ingress_bytes (int, optional): the size of the message, defaults to 0
+        subnet_size (int, optional): the number of nodes of the canister's subnet, see
+            `PocketIC.get_subnet_size`, defaults to 13
+
+    Returns:
+        int: the estimated number of instructions
+    """
+    fixed = (
+        UPDATE_MESSAGE_EXECUTION_FEE
+        + INGRESS_MESSAGE_RECEPTION_FEE
+        + INGRESS_BYTE_RECEPTION_FEE * ingress_bytes
+    )
+    return _instructions(
+        cycles - fixed * subnet_size // REFERENCE_SUBNET_SIZE, subnet_size
+    )
+
+
+def estimate_install_instructions(
+    cycles: int, subnet_size: int = REFERENCE_SUBNET_SIZE
+) -> int:
+    """Estimates the number of instructions an `install_code` call executed on the target
+    canister from the cycles it cost. Unlike ingress messages to the canister, the call
+    is not charged reception fees; see `estimate_instructions`.
+
+    Args:
+        cycles (int): the cycles the call cost
+        subnet_size (int, optional): the number of nodes of the canister's subnet,
+            defaults to 13
+
+    Returns:
+        int: the estimated number of instructions
+    """
+    fixed = UPDATE_MESSAGE_EXECUTION_FEE * subnet_size // REFERENCE_SUBNET_SIZE
+    return _instructions(cycles - fixed, subnet_size)
+
+
+def canister_subnet_size(pic: PocketIC, canister_id: ic.Principal) -> int:
+    """Returns the number of nodes of the subnet that hosts a canister.
+
+    Args:
+        pic (PocketIC): the instance the canister is installed on
+        canister_id (ic.Principal): the canister
+
+    Raises:
+        ValueError: if the canister does not exist
+
+    Returns:
+        int: the number of nodes
+    """
+    subnet_id = pic.get_subnet(canister_id)
+    if subnet_id is None:
+        raise ValueError(f"Canister {canister_id.to_str()} does not exist.")
+    return pic.get_subnet_size(subnet_id)
+
+
+class CallCost:
+    """The cost of a single benchmarked call.
+
+    `estimated_instructions` is estimated from the cycles, see `estimate_instructions`,
+    after subtracting the reception fee of `ingress_bytes`. Unless the caller passes the
+    actual size of the ingress message, `ingress_bytes` is only the size of the method
+    name and payload, a lower bound: the message the IC charges for also contains the
+    sender, the canister ID and the envelope. The estimate is then an upper bound, too
+    high by `INSTRUCTIONS_PER_INGRESS_BYTE` for every byte not accounted for.
+    """
+
+    def __init__(
+        self,
+        cycles: int,
+        estimated_instructions: int,
+        wall_seconds: float,
+        ingress_bytes: int = 0,
+    ) -> None:
+        self.cycles = cycles
+        self.estimated_instructions = estimated_instructions
+        self.wall_seconds = wall_seconds
+        self.ingress_bytes = ingress_bytes
+
+    def __repr__(self) -> str:
+        return f"CallCost(cycles={self.cycles}, estimated_instructions={self.estimated_instructions}, ingress_bytes={self.ingress_bytes}, wall_seconds={self.wall_seconds:.4f})"
+
+
+class BenchmarkResult:
+    """The costs of all calls of a benchmark, on a subnet of `subnet_size` nodes."""
+
+    def __init__(
+        self,
+        name: str,
+        costs: List[CallCost],
+        subnet_size: int = REFERENCE_SUBNET_SIZE,
+    ) -> None:
+        self.name = name
+        self.costs = costs
+        self.subnet_size = subnet_size
+
+    def __repr__(self) -> str:
+        return f"BenchmarkResult(name={self.name!r}, calls={len(self.costs)}, subnet_size={self.subnet_size})"
+
+    def _summary(self, values: list) -> dict:
+        return {
+            "min": min(values, default=0),
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "max": max(values, default=0),
+        }
+
+    def as_dict(self) -> dict:
+        """Returns the summary of the benchmark, e.g. to be stored per commit."""
+        return {
+            "name": self.name,
+            "calls": len(self.costs),
+            "subnet_size": self.subnet_size,
+            "cycles": self._summary([c.cycles for c in self.costs]),
+            "estimated_instructions": self._summary(
+                [c.estimated_instructions for c in self.costs]
+            ),
+            "wall_seconds": self._summary([c.wall_seconds for c in self.costs]),
+        }
+
+    def save(self, path: str) -> None:
+        """Writes the summary of the benchmark to a JSON file.
+
+        Args:
+            path (str): the path of the file
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def __str__(self) -> str:
+        summary = self.as_dict()
+        lines = [
+            f"{self.name}: {summary['calls']} calls on a {self.subnet_size}-node subnet"
+        ]
+        for metric, label in [
+            ("cycles", "cycles"),
+            ("estimated_instructions", "instructions*"),
+        ]:
+            s = summary[metric]
+            lines.append(
+                f"  {label:<13} min {s['min']:>16} p50 {s['p50']:>16} p90 {s['p90']:>16} max {s['max']:>16}"
+            )
+        s = summary["wall_seconds"]
+        lines.append(
+            f"  {'wall seconds':<13} min {s['min']:>16.4f} p50 {s['p50']:>16.4f} p90 {s['p90']:>16.4f} max {s['max']:>16.4f}"
+        )
+        lines.append("  * estimated from the cycles, see pocket_ic.benchmark")
+        return "\n".join(lines)
+
+
+def measure_call(
+    pic: PocketIC,
+    canister_id: ic.Principal,
+    method: str,
+    payload: bytes,
+    subnet_size: Optional[int] = None,
+    ingress_bytes: Optional[int] = None,
+) -> CallCost:
+    """Makes one update call and measures its cost.
+
+    Args:
+        pic (PocketIC): the instance to call
+        canister_id (ic.Principal): the canister to call
+        method (str): the method to call; query methods are executed as update calls,
+            since non-replicated queries are free
+        payload (bytes): the candid encoded payload
+        subnet_size (Optional[int], optional): the number of nodes of the canister's
+            subnet, defaults to reading it from the topology
+        ingress_bytes (Optional[int], optional): the size of the ingress message the IC
+            charges the reception fee for, defaults to the size of the method name and
+            payload, a lower bound, see `CallCost`
+
+    Returns:
+        CallCost: the cost of the call
+    """
+    if subnet_size is None:
+        subnet_size = canister_subnet_size(pic, canister_id)
+    before = pic.get_cycles_balance(canister_id)
+    start = time.perf_counter()
+    pic.update_call(canister_id, method, payload)
+    wall_seconds = time.perf_counter() - start
+    cycles = before - pic.get_cycles_balance(canister_id)
+    if ingress_bytes is None:
+        ingress_bytes = len(method) + len(payload)
+    instructions = estimate_instructions(cycles, ingress_bytes, subnet_size)
+    return CallCost(cycles, instructions, wall_seconds, ingress_bytes)
+
+
+def benchmark_method(
+    pic: PocketIC,
+    canister_id: ic.Principal,
+    method: str,
+    payload: bytes,
+    repetitions: int = 10,
+    checkpoint: Optional[Checkpoint] = None,
+    ingress_bytes: Optional[int] = None,
+) -> BenchmarkResult:
+    """Calls a canister method repeatedly and reports the cost of every call.
+
+    Without a checkpoint, all calls run one after another on `pic`, so each call sees the
+    state left by the previous one. With a checkpoint, every call runs on a fresh instance
+    forked from it, so all calls start from the same state.
+
+    Create the subnets with `InstructionConfig.BENCHMARKING` to measure workloads that
+    exceed the production instruction limits.
+
+    Args:
+        pic (PocketIC): the instance to call, or to fork from the checkpoint's server
+        canister_id (ic.Principal): the canister to call
+        method (str): the method to call
+        payload (bytes): the candid encoded payload
+        repetitions (int, optional): the number of calls, defaults to 10
+        checkpoint (Optional[Checkpoint], optional): the state to start every call from,
+            defaults to `None`
+        ingress_bytes (Optional[int], optional): see `measure_call`
+
+    Returns:
+        BenchmarkResult: the cost of every call
+    """
+    costs = []
+    size = None
+    for _ in range(repetitions):
+        if checkpoint is None:
+            size = size if size else canister_subnet_size(pic, canister_id)
+            costs.append(
+                measure_call(pic, canister_id, method, payload, size, ingress_bytes)
+            )
+            continue
+        with pic.fork(checkpoint, server=pic.server) as fork:
+            size = size if size else canister_subnet_size(fork, canister_id)
+            costs.append(
+                measure_call(fork, canister_id, method, payload, size, ingress_bytes)
+            )
+    return BenchmarkResult(
+        f"{canister_id} {method}", costs, size if size else REFERENCE_SUBNET_SIZE
+    )
+
+
+class UpgradeCost:
+    """The cost of upgrading a canister with a given amount of stable memory.
+
+    `pre_upgrade_cycles` and `estimated_pre_upgrade_instructions` are the part of the
+    cost spent in the `pre_upgrade` hook, measured as the difference to an upgrade from
+    the same state that skips the hook; the rest is spent in `post_upgrade` and
+    installing the module. `estimated_instructions` is estimated from the cycles, see
+    `estimate_install_instructions`.
+
+    `wall_seconds` is the wall time of the whole upgrade, i.e. the time the state migration
+    through `pre_upgrade` and `post_upgrade` takes together with installing the module;
+    the migration time is not measured separately.
+    """
+
+    def __init__(
+        self,
+        stable_memory_size: int,
+        cycles: int,
+        wall_seconds: float,
+        pre_upgrade_cycles: Optional[int] = None,
+        subnet_size: int = REFERENCE_SUBNET_SIZE,
+    ) -> None:
+        self.stable_memory_size = stable_memory_size
+        self.cycles = cycles
+        self.subnet_size = subnet_size
+        self.estimated_instructions = estimate_install_instructions(cycles, subnet_size)
+        self.wall_seconds = wall_seconds
+        self.pre_upgrade_cycles = pre_upgrade_cycles
+
+    @property
+    def estimated_pre_upgrade_instructions(self) -> Optional[int]:
+        """The estimated instructions of the `pre_upgrade` hook, if measured."""
+        if self.pre_upgrade_cycles is None:
+            return None
+        return _instructions(self.pre_upgrade_cycles, self.subnet_size)
+
+    def __repr__(self) -> str:
+        return f"UpgradeCost(stable_memory_size={self.stable_memory_size}, cycles={self.cycles}, estimated_instructions={self.estimated_instructions}, wall_seconds={self.wall_seconds:.4f})"
+
+    def as_dict(self) -> dict:
+        """Returns the cost as a dict."""
+        return {
+            "stable_memory_size": self.stable_memory_size,
+            "cycles": self.cycles,
+            "estimated_instructions": self.estimated_instructions,
+            "pre_upgrade_cycles": self.pre_upgrade_cycles,
+            "estimated_pre_upgrade_instructions": self.estimated_pre_upgrade_instructions,
+            "wall_seconds": self.wall_seconds,
+        }
+
+
+class UpgradeBenchmarkResult:
+    """The costs of upgrading a canister across stable memory sizes."""
+
+    def __init__(self, name: str, costs: List[UpgradeCost]) -> None:
+        self.name = name
+        self.costs = costs
+
+    def as_dict(self) -> dict:
+        """Returns the costs of the benchmark, e.g. to be stored per commit."""
+        return {"name": self.name, "upgrades": [c.as_dict() for c in self.costs]}
+
+    def save(self, path: str) -> None:
+        """Writes the costs of the benchmark to a JSON file.
+
+        Args:
+            path (str): the path of the file
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def __str__(self) -> str:
+        lines = [
+            f"{self.name}: {len(self.costs)} upgrades",
+            f"  {'stable memory':>16} {'instructions*':>16} {'pre_upgrade*':>16} {'cycles':>16} {'wall seconds':>12}",
+        ]
+        for c in self.costs:
+            pre_upgrade = (
+                "-"
+                if c.estimated_pre_upgrade_instructions is None
+                else c.estimated_pre_upgrade_instructions
+            )
+            lines.append(
+                f"  {c.stable_memory_size:>16} {c.estimated_instructions:>16} {pre_upgrade:>16} {c.cycles:>16} {c.wall_seconds:>12.4f}"
+            )
+        lines.append("  * estimated from the cycles, see pocket_ic.benchmark")
+        return "\n".join(lines)
+
+
+def measure_upgrade(
+    pic: PocketIC,
+    canister_id: ic.Principal,
+    wasm_module: bytes,
+    arg: list,
+    upgrade_options: Optional[UpgradeOptions] = None,
+    stable_memory_size: Optional[int] = None,
+    subnet_size: Optional[int] = None,
+) -> UpgradeCost:
+    """Upgrades a canister once and measures the cost.
+
+    Args:
+        pic (PocketIC): the instance the canister is installed on
+        canister_id (ic.Principal): the canister to upgrade
+        wasm_module (bytes): the module to upgrade to
+        arg (list): list of upgrade arguments
+        upgrade_options (Optional[UpgradeOptions], optional): the options of the upgrade,
+            defaults to `None`
+        stable_memory_size (Optional[int], optional): the size of the stable memory to
+            report, defaults to reading it from the canister
+        subnet_size (Optional[int], optional): the number of nodes of the canister's
+            subnet, defaults to reading it from the topology
+
+    Returns:
+        UpgradeCost: the cost of the upgrade
+    """
+    if subnet_size is None:
+        subnet_size = canister_subnet_size(pic, canister_id)
+    size = stable_memory_size
+    if size is None:
+        size = len(pic.get_stable_memory(canister_id))
+    before = pic.get_cycles_balance(canister_id)
+    start = time.perf_counter()
+    pic.install_code(
+        canister_id, wasm_module, arg, InstallMode.UPGRADE, upgrade_options
+    )
+    wall_seconds = time.perf_counter() - start
+    cycles = before - pic.get_cycles_balance(canister_id)
+    return UpgradeCost(size, cycles, wall_seconds, subnet_size=subnet_size)
+
+
+def benchmark_upgrade(
+    pic: PocketIC,
+    canister_id: ic.Principal,
+    wasm_module: bytes,
+    arg: list,
+    stable_memory_sizes: Sequence[int] = (0, 1 << 20, 16 << 20, 64 << 20),
+    prepare: Optional[Callable[[PocketIC, ic.Principal, int], None]] = None,
+    upgrade_options: Optional[UpgradeOptions] = None,
+    split_pre_upgrade: bool = True,
+) -> UpgradeBenchmarkResult:
+    """Upgrades a canister with growing amounts of stable memory and reports the cost of
+    every upgrade.
+
+    Before every upgrade, `prepare` is called with the instance, the canister and the
+    size, and is expected to fill the canister's stable memory with a state of about that
+    many bytes, e.g. by calling canister methods. It defaults to setting the stable memory
+    to that many zero bytes, which suits canisters that treat stable memory as raw bytes.
+
+    With `split_pre_upgrade`, the canister state is saved in a canister snapshot before
+    every upgrade, and an upgrade that skips the `pre_upgrade` hook is measured first.
+    The snapshot is then restored and the reported upgrade runs last, so the canister
+    always ends up in the state of a regular upgrade. The difference between both
+    upgrades is reported as the cost of the hook.
+
+    Create the subnets with `InstructionConfig.BENCHMARKING` to measure upgrades that
+    exceed the production instruction limits.
+
+    Args:
+        pic (PocketIC): the instance the canister is installed on
+        canister_id (ic.Principal): the canister to upgrade
+        wasm_module (bytes): the module to upgrade to
+        arg (list): list of upgrade arguments
+        stable_memory_sizes (Sequence[int], optional): the stable memory sizes in bytes,
+            defaults to 0, 1 MiB, 16 MiB and 64 MiB
+        prepare (Optional[Callable[[PocketIC, ic.Principal, int], None]], optional):
+            builds the state before every upgrade, defaults to `None`
+        upgrade_options (Optional[UpgradeOptions], optional): the options of the upgrades,
+            defaults to `None`
+        split_pre_upgrade (bool, optional): whether to measure the cost of the
+            `pre_upgrade` hook separately, defaults to `True`
+
+    Returns:
+        UpgradeBenchmarkResult: the cost of every upgrade
+    """
+    options = upgrade_options if upgrade_options else UpgradeOptions()
+    skip_pre_upgrade = UpgradeOptions(True, options.wasm_memory_persistence)
+    subnet_size = canister_subnet_size(pic, canister_id)
+    costs = []
+    for size in stable_memory_sizes:
+        if prepare is None:
+            pic.set_stable_memory(canister_id, bytes(size))
+        else:
+            prepare(pic, canister_id, size)
+        if not split_pre_upgrade:
+            costs.append(
+                measure_upgrade(
+                    pic, canister_id, wasm_module, arg, options, size, subnet_size
+                )
+            )
+            continue
+        snapshot = pic.take_canister_snapshot(canister_id)
+        try:
+            skipped = measure_upgrade(
+                pic, canister_id, wasm_module, arg, skip_pre_upgrade, size, subnet_size
+            )
+            pic.restore_canister(canister_id, snapshot)
+            cost = measure_upgrade(
+                pic, canister_id, wasm_module, arg, options, size, subnet_size
+            )
+            cost.pre_upgrade_cycles = max(0, cost.cycles - skipped.cycles)
+        finally:
+            pic.delete_canister_snapshot(canister_id, snapshot)
+        costs.append(cost)
+    return UpgradeBenchmarkResult(f"{canister_id} upgrade", costs)
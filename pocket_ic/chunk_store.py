@@ -0,0 +1,75 @@
+"""
+This module contains helpers to upload wasm modules to the chunk store of a canister,
+see `PocketIC.install_chunked_code`.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterator, Union
+from pocket_ic._lazy import lazy_import
+from pocket_ic.prepared_call import candid_header
+
+if TYPE_CHECKING:
+    import ic
+    import leb128
+else:
+    ic = lazy_import("ic")
+    leb128 = lazy_import("leb128")
+
+# The maximum size of a chunk accepted by `upload_chunk`.
+CHUNK_SIZE = 1024 * 1024
+
+WasmSource = Union[bytes, bytearray, memoryview, mmap.mmap, str, os.PathLike]
+
+
+@contextmanager
+def open_wasm_module(wasm_module: WasmSource) -> Iterator[Union[bytes, mmap.mmap]]:
+    """Provides a wasm module given as bytes, a memory map or a file path as a buffer.
+    Files are memory-mapped rather than read, so only the pages that are accessed are
+    loaded.
+
+    Args:
+        wasm_module (WasmSource): the module, or the path of a file containing it
+    """
+    if isinstance(wasm_module, (str, os.PathLike)):
+        with open(wasm_module, "rb") as wasm_file:
+            with mmap.mmap(wasm_file.fileno(), 0, access=mmap.ACCESS_READ) as module:
+                yield module
+    else:
+        yield wasm_module
+
+
+@lru_cache(maxsize=None)
+def _upload_chunk_arg():
+    types = ic.candid.Types
+
+    arg_type = types.Record(
+        {"canister_id": types.Principal, "chunk": types.Vec(types.Nat8)}
+    )
+    return arg_type, candid_header([arg_type])
+
+
+def encode_upload_chunk(canister_id: ic.Principal, chunk: bytes) -> bytes:
+    """Encodes the argument of an `upload_chunk` call. The chunk is copied into the message
+    as is, rather than encoded byte by byte as `ic.encode` does.
+
+    Args:
+        canister_id (ic.Principal): the canister whose chunk store to upload to
+        chunk (bytes): the chunk
+
+    Returns:
+        bytes: the Candid encoded argument
+    """
+    arg_type, header = _upload_chunk_arg()
+    values = []
+    # Record fields are encoded in the order of their label hashes.
+    for name, field_type in arg_type._fields.items():
+        if name == "chunk":
+            values.append(leb128.u.encode(len(chunk)) + bytes(chunk))
+        else:
+            values.append(field_type.encodeValue(canister_id.bytes))
+    return header + b"".join(values)
@@ -0,0 +1,91 @@
+"""
+This module contains `PayloadCompressor`, which gzip-compresses large wasm modules and
+blobs before they are sent to the PocketIC server.
+"""
+
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Tuple
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class PayloadCompressor:
+    """
+    Compresses payloads above a size threshold with gzip on worker threads, so that the
+    compression overlaps with other work on the calling thread. Compressed payloads are
+    cached by content hash, so the same wasm module is only compressed once per process,
+    and concurrent requests for the same payload share a single compression.
+    """
+
+    def __init__(
+        self,
+        threshold: int = 64 * 1024,
+        level: int = 6,
+        cache_size: int = 32,
+        max_workers: Optional[int] = None,
+    ) -> None:
+        """Creates a new compressor.
+
+        Args:
+            threshold (int, optional): payloads smaller than this many bytes are sent
+                uncompressed, defaults to 64 KiB
+            level (int, optional): the gzip compression level, defaults to 6
+            cache_size (int, optional): the number of compressed payloads to keep,
+                defaults to 32
+            max_workers (Optional[int], optional): the number of worker threads,
+                defaults to `min(4, os.cpu_count())`
+        """
+        self.threshold = threshold
+        self.level = level
+        self.cache_size = cache_size
+        self._max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compress(self, data: bytes) -> Future:
+        """Starts compressing `data` unless it is small or already compressed.
+
+        Args:
+            data (bytes): the payload
+
+        Returns:
+            Future: resolves to a tuple `(payload, compression)`, where `compression`
+                is "gzip" or `None` if the payload is returned unchanged
+        """
+        if len(data) < self.threshold or data.startswith(GZIP_MAGIC):
+            future: Future = Future()
+            future.set_result((data, None))
+            return future
+
+        key = hashlib.sha256(data).digest()
+        with self._lock:
+            future = self._cache.get(key)
+            if future is not None:
+                self._cache.move_to_end(key)
+                return future
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._max_workers,
+                    thread_name_prefix="pocket_ic_compression",
+                )
+            future = self._executor.submit(self._gzip, data)
+            self._cache[key] = future
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return future
+
+    def _gzip(self, data: bytes) -> Tuple[bytes, Optional[str]]:
+        compressed = gzip.compress(data, compresslevel=self.level, mtime=0)
+        if len(compressed) >= len(data):
+            return data, None
+        return compressed, "gzip"
+
+
+# Shared by all `PocketIC` instances, so that the cache spans a whole test suite.
+DEFAULT_COMPRESSOR = PayloadCompressor()
@@ -0,0 +1,434 @@
+"""
+This module contains `Fuzzer`, a harness that calls canister methods with random
+Candid-typed arguments generated from the canister's interface, and
+`CandidValueGenerator`, which generates the arguments.
+"""
+
+from __future__ import annotations
+
+import enum
+import math
+import random
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set, Union
+from pocket_ic._lazy import lazy_import
+from pocket_ic.lazy_result import LazyCandidResult
+from pocket_ic.prepared_call import candid_header
+
+if TYPE_CHECKING:
+    import ic
+    from pocket_ic.pocket_ic import PocketIC
+    from pocket_ic.pocket_ic import CanisterSnapshot
+    from pocket_ic.stable_memory import StableMemorySnapshot
+else:
+    ic = lazy_import("ic")
+
+
+class CandidValueGenerator:
+    """
+    Generates random values of Candid types, as accepted by `ic.encode`. Numbers are
+    drawn from the boundaries of their type as often as from the rest of the range.
+    Vectors and texts have at most `max_size` elements, and values nest at most
+    `max_depth` levels deep; beyond that, vectors are empty and options are `null`.
+    No values are generated for `empty`, `func` and `service`, see `supports`.
+    """
+
+    # ic-py keeps the bit widths and component types of Candid types in protected
+    # attributes.
+    # pylint: disable=protected-access
+
+    def __init__(
+        self, seed: Optional[int] = None, max_size: int = 8, max_depth: int = 4
+    ) -> None:
+        self.max_size = max_size
+        self.max_depth = max_depth
+        self._rng = random.Random(seed)
+        self._generators: Optional[Dict[type, Callable[[Any, int], Any]]] = None
+
+    def arguments(self, arg_types: List[Any]) -> list:
+        """Returns a random value for each of the argument types."""
+        return [self.value(arg_type) for arg_type in arg_types]
+
+    def value(self, candid_type: Any, depth: int = 0) -> Any:
+        """Returns a random value of a Candid type.
+
+        Raises:
+            ValueError: if no value can be generated for the type, e.g. for `empty`
+        """
+        generate = self._generator(candid_type)
+        if generate is None:
+            raise ValueError(f"Cannot generate values of type {candid_type.display()}")
+        return generate(candid_type, depth)
+
+    def supports(self, candid_type: Any) -> bool:
+        """Returns whether values of a Candid type, and of all types it contains, can be
+        generated."""
+        return self._supports(candid_type, set())
+
+    def _supports(self, candid_type: Any, seen: Set[int]) -> bool:
+        candid = ic.candid
+
+        if isinstance(candid_type, candid.RecClass):
+            if id(candid_type) in seen:
+                return True
+            seen.add(id(candid_type))
+            return self._supports(candid_type.getType(), seen)
+        if self._generator(candid_type) is None:
+            return False
+        if isinstance(candid_type, (candid.VecClass, candid.OptClass)):
+            return self._supports(candid_type._type, seen)
+        if isinstance(candid_type, (candid.RecordClass, candid.VariantClass)):
+            return all(self._supports(t, seen) for t in candid_type._fields.values())
+        return True
+
+    def _generator(self, candid_type: Any) -> Optional[Callable[[Any, int], Any]]:
+        if self._generators is None:
+            self._generators = self._dispatch_table()
+        # Follow the MRO, so that a subclass, e.g. a tuple, which is a record, takes
+        # precedence over its base classes.
+        for cls in type(candid_type).__mro__:
+            generate = self._generators.get(cls)
+            if generate is not None:
+                return generate
+        return None
+
+    def _dispatch_table(self) -> Dict[type, Callable[[Any, int], Any]]:
+        """Returns the generator for each Candid type class; a generator takes the type
+        and the nesting depth."""
+        candid = ic.candid
+
+        rng = self._rng
+        return {
+            candid.RecClass: lambda t, depth: self.value(t.getType(), depth),
+            candid.BoolClass: lambda t, depth: rng.random() < 0.5,
+            candid.NullClass: lambda t, depth: None,
+            candid.ReservedClass: lambda t, depth: None,
+            candid.NatClass: lambda t, depth: self._int(0, 2**128 - 1),
+            candid.IntClass: lambda t, depth: self._int(-(2**127), 2**127 - 1),
+            candid.FixedNatClass: lambda t, depth: self._int(0, 2**t._bits - 1),
+            candid.FixedIntClass: lambda t, depth: self._int(
+                -(2 ** (t._bits - 1)), 2 ** (t._bits - 1) - 1
+            ),
+            candid.FloatClass: lambda t, depth: self._float(t._bits),
+            candid.TextClass: lambda t, depth: self._text(),
+            candid.PrincipalClass: lambda t, depth: self._principal(),
+            candid.VecClass: self._vec,
+            candid.OptClass: self._opt,
+            candid.TupleClass: self._tuple,
+            candid.RecordClass: self._record,
+            candid.VariantClass: self._variant,
+        }
+
+    def _vec(self, candid_type: Any, depth: int) -> list:
+        size = self._size(depth)
+        return [self.value(candid_type._type, depth + 1) for _ in range(size)]
+
+    def _opt(self, candid_type: Any, depth: int) -> list:
+        if depth >= self.max_depth or self._rng.random() < 0.5:
+            return []
+        return [self.value(candid_type._type, depth + 1)]
+
+    def _tuple(self, candid_type: Any, depth: int) -> list:
+        return [self.value(t, depth + 1) for t in candid_type._components]
+
+    def _record(self, candid_type: Any, depth: int) -> dict:
+        return {
+            name: self.value(t, depth + 1) for name, t in candid_type._fields.items()
+        }
+
+    def _variant(self, candid_type: Any, depth: int) -> dict:
+        name = self._tag(candid_type._fields, depth)
+        return {name: self.value(candid_type._fields[name], depth + 1)}
+
+    def _int(self, low: int, high: int) -> int:
+        if self._rng.random() < 0.5:
+            return self._rng.choice(
+                [v for v in (low, -1, 0, 1, high) if low <= v <= high]
+            )
+        # Spread the values over all magnitudes rather than uniformly over the range.
+        bits = self._rng.randint(1, max(high.bit_length(), (-low).bit_length()))
+        value = self._rng.getrandbits(bits)
+        if low < 0 and self._rng.random() < 0.5:
+            value = -value
+        return min(max(value, low), high)
+
+    def _float(self, bits: int) -> float:
+        if self._rng.random() < 0.5:
+            return self._rng.choice(
+                [0.0, -0.0, 1.0, -1.0, math.inf, -math.inf, math.nan]
+            )
+        limit = 3.4e38 if bits == 32 else 1.7e308
+        return self._rng.uniform(-1.0, 1.0) * 10 ** self._rng.uniform(
+            -10, math.log10(limit)
+        )
+
+    def _text(self) -> str:
+        chars = []
+        for _ in range(self._rng.randint(0, self.max_size)):
+            if self._rng.random() < 0.8:
+                chars.append(chr(self._rng.randint(0x20, 0x7E)))
+            else:
+                # any code point except the surrogates, which UTF-8 cannot encode
+                code = self._rng.randint(0x80, 0x10FFFF - 0x800)
+                chars.append(chr(code + 0x800 if code >= 0xD800 else code))
+        return "".join(chars)
+
+    def _principal(self) -> bytes:
+        choice = self._rng.random()
+        if choice < 0.1:
+            return b""  # the management canister
+        if choice < 0.2:
+            return b"\x04"  # the anonymous principal
+        return bytes(self._rng.getrandbits(8) for _ in range(self._rng.randint(1, 29)))
+
+    def _size(self, depth: int) -> int:
+        if depth >= self.max_depth:
+            return 0
+        return self._rng.randint(0, self.max_size)
+
+    def _tag(self, fields: Dict[str, Any], depth: int) -> str:
+        candid = ic.candid
+
+        names = list(fields)
+        if depth >= self.max_depth:
+            # Prefer tags that end the recursion.
+            leaves = [n for n in names if isinstance(fields[n], candid.PrimitiveType)]
+            names = leaves if leaves else names
+        return self._rng.choice(names)
+
+
+class ResetMode(enum.Enum):
+    """How a `Fuzzer` resets the canister state between batches of cases."""
+
+    NONE = "None"
+    STABLE_MEMORY = "StableMemory"
+    CANISTER_SNAPSHOT = "CanisterSnapshot"
+
+
+class FuzzCase:
+    """One call made by a `Fuzzer`, with its outcome."""
+
+    def __init__(self, method: str, args: list) -> None:
+        self.method = method
+        self.args = args
+        self.reply: Optional[LazyCandidResult] = None
+        self.error: Optional[str] = None
+
+    @property
+    def failed(self) -> bool:
+        """Whether the call was rejected or did not complete."""
+        return self.error is not None
+
+    def __repr__(self) -> str:
+        outcome = f"error={self.error!r}" if self.failed else f"reply={self.reply!r}"
+        return f"FuzzCase({self.method}, args={self.args!r}, {outcome})"
+
+
+class FuzzReport:
+    """The result of a `Fuzzer` run."""
+
+    def __init__(self) -> None:
+        self.cases: List[FuzzCase] = []
+        self.rounds = 0
+        self.resets = 0
+        self.wall_seconds = 0.0
+
+    @property
+    def failures(self) -> List[FuzzCase]:
+        """The cases whose call was rejected or did not complete."""
+        return [case for case in self.cases if case.failed]
+
+    @property
+    def cases_per_second(self) -> float:
+        """Cases per wall-clock second, including the resets."""
+        return len(self.cases) / self.wall_seconds if self.wall_seconds else 0.0
+
+    def __str__(self) -> str:
+        failures = Counter(case.method for case in self.failures)
+        lines = [
+            f"{len(self.cases)} cases in {self.wall_seconds:.2f}s "
+            f"({self.cases_per_second:.1f} cases/s), {self.rounds} rounds, "
+            f"{self.resets} resets, {sum(failures.values())} failed"
+        ]
+        for method, count in Counter(case.method for case in self.cases).items():
+            lines.append(f"  {method}: {count} cases, {failures[method]} failed")
+        return "\n".join(lines)
+
+
+class Fuzzer:
+    """
+    Calls the methods of a canister with random arguments generated from its Candid
+    interface.
+
+    Update calls are made in batches of `batch_size`: all calls of a batch are submitted
+    at once and executed by the same rounds. Before every batch, the canister state is
+    reset according to `reset`. `ResetMode.STABLE_MEMORY` restores the stable memory of
+    the canister to a snapshot taken before the first batch, uploading only the pages
+    that changed; it does not reset the heap. `ResetMode.CANISTER_SNAPSHOT` takes a
+    canister snapshot before the first batch and loads it before every following one,
+    which resets the whole canister state; delete the snapshot with `delete_snapshot`
+    when it is no longer needed. A callable is called with the instance
+    and can reset any state. Use a `batch_size` of 1 to isolate every case. Query calls
+    do not change the state and are made one at a time.
+
+    Example:
+        canister = pic.create_and_install_canister_with_candid(candid, wasm, init_args)
+        report = Fuzzer(pic, canister, reset=ResetMode.STABLE_MEMORY).run(10_000)
+        print(report)
+        for case in report.failures:
+            print(case)
+    """
+
+    def __init__(
+        self,
+        pic: PocketIC,
+        canister: ic.Canister,
+        methods: Optional[List[str]] = None,
+        batch_size: int = 32,
+        reset: Union[ResetMode, Callable[[PocketIC], None]] = ResetMode.NONE,
+        max_rounds: int = 100,
+        seed: Optional[int] = None,
+        generator: Optional[CandidValueGenerator] = None,
+    ) -> None:
+        """Creates a new fuzzer.
+
+        Args:
+            pic (PocketIC): the instance the canister is installed on
+            canister (ic.Canister): the canister, with its parsed Candid interface
+            methods (Optional[List[str]], optional): the methods to call, defaults to
+                all methods of the interface whose arguments the generator supports, see
+                `CandidValueGenerator.supports`
+            batch_size (int, optional): the number of update calls per batch, defaults to 32
+            reset (Union[ResetMode, Callable[[PocketIC], None]], optional): how to reset
+                the state before every batch, defaults to `ResetMode.NONE`
+            max_rounds (int, optional): calls that take more rounds count as failed,
+                defaults to 100
+            seed (Optional[int], optional): the seed for choosing methods and generating
+                arguments
+            generator (Optional[CandidValueGenerator], optional): the argument generator,
+                defaults to one with the given seed
+
+        Raises:
+            ValueError: if a method is not part of the interface or the generator does
+                not support its arguments
+        """
+        generator = generator if generator else CandidValueGenerator(seed)
+        interface = canister.actor["methods"]
+        if methods is None:
+            methods = [
+                name
+                for name, func in interface.items()
+                if all(generator.supports(t) for t in func.argTypes)
+            ]
+            if not methods:
+                raise ValueError("No method of the interface has arguments to generate")
+        unknown = [method for method in methods if method not in interface]
+        if unknown or not methods:
+            raise ValueError(f"Methods not in the canister interface: {unknown}")
+        unsupported = [
+            method
+            for method in methods
+            if not all(generator.supports(t) for t in interface[method].argTypes)
+        ]
+        if unsupported:
+            raise ValueError(f"Cannot generate the arguments of: {unsupported}")
+        self.pic = pic
+        self.canister_id = canister.canister_id
+        self.methods = methods
+        self.batch_size = batch_size
+        self.reset = reset
+        self.max_rounds = max_rounds
+        self.generator = generator
+        self._rng = random.Random(seed)
+        self._methods = [interface[method] for method in methods]
+        self._headers = [candid_header(func.argTypes) for func in self._methods]
+        self._snapshot: Optional[Union[StableMemorySnapshot, CanisterSnapshot]] = None
+
+    def run(self, cases: int) -> FuzzReport:
+        """Makes `cases` calls to randomly chosen methods.
+
+        Args:
+            cases (int): the number of calls to make
+
+        Returns:
+            FuzzReport: the calls and their outcomes, and the throughput
+        """
+        report = FuzzReport()
+        start = time.perf_counter()
+        if self._snapshot is None:
+            if self.reset == ResetMode.STABLE_MEMORY:
+                self._snapshot = self.pic.snapshot_stable_memory(self.canister_id)
+            elif self.reset == ResetMode.CANISTER_SNAPSHOT:
+                self._snapshot = self.pic.take_canister_snapshot(self.canister_id)
+
+        while len(report.cases) < cases:
+            if report.cases:
+                self._reset()
+                report.resets += 1
+            batch = min(self.batch_size, cases - len(report.cases))
+            # message ID and case of the update calls in flight
+            in_flight = []
+            for _ in range(batch):
+                index = self._rng.randrange(len(self._methods))
+                func = self._methods[index]
+                case = FuzzCase(
+                    self.methods[index], self.generator.arguments(func.argTypes)
+                )
+                report.cases.append(case)
+                payload = self._headers[index] + b"".join(
+                    t.encodeValue(v) for t, v in zip(func.argTypes, case.args)
+                )
+                try:
+                    if "query" in func.annotations:
+                        result = self.pic.query_call(
+                            self.canister_id, case.method, payload
+                        )
+                        case.reply = LazyCandidResult(bytes(result), func.retTypes)
+                    else:
+                        message_id = self.pic.submit_call(
+                            self.canister_id, case.method, payload
+                        )
+                        in_flight.append((message_id, case, func.retTypes))
+                except ValueError as e:
+                    case.error = str(e)
+            report.rounds += self._await(in_flight)
+
+        report.wall_seconds = time.perf_counter() - start
+        return report
+
+    def _await(self, in_flight: list) -> int:
+        """Executes rounds until all calls in flight are done; returns the rounds."""
+        rounds = 0
+        while in_flight and rounds < self.max_rounds:
+            self.pic.tick()
+            rounds += 1
+            still_in_flight = []
+            for message_id, case, ret_types in in_flight:
+                try:
+                    result = self.pic.call_result(message_id)
+                except ValueError as e:
+                    case.error = str(e)
+                    continue
+                if result is None:
+                    still_in_flight.append((message_id, case, ret_types))
+                else:
+                    case.reply = LazyCandidResult(bytes(result), ret_types)
+            in_flight = still_in_flight
+        for _, case, _ in in_flight:
+            case.error = f"PocketIC did not complete the update call within {self.max_rounds} rounds"
+        return rounds
+
+    def _reset(self) -> None:
+        if callable(self.reset):
+            self.reset(self.pic)
+        elif self.reset == ResetMode.STABLE_MEMORY:
+            self.pic.restore_stable_memory(self.canister_id, self._snapshot)
+        elif self.reset == ResetMode.CANISTER_SNAPSHOT:
+            self.pic.restore_canister(self.canister_id, self._snapshot)
+
+    def delete_snapshot(self) -> None:
+        """Deletes the canister snapshot taken for `ResetMode.CANISTER_SNAPSHOT`, if any."""
+        if self.reset == ResetMode.CANISTER_SNAPSHOT and self._snapshot is not None:
+            self.pic.delete_canister_snapshot(self.canister_id, self._snapshot)
+            self._snapshot = None
@@ -0,0 +1,110 @@
+"""
+This module contains `InstallMode`, `UpgradeOptions` and `WasmMemoryPersistence`, which
+are used to choose how `PocketIC.install_code` installs code on a canister.
+"""
+
+from enum import Enum
+from typing import TYPE_CHECKING, Optional
+from pocket_ic._lazy import lazy_import
+
+if TYPE_CHECKING:
+    import ic
+else:
+    ic = lazy_import("ic")
+
+
+class InstallMode(Enum):
+    """How to install code on a canister.
+
+    `INSTALL` requires an empty canister. `REINSTALL` replaces the code and clears the
+    state, including stable memory. `UPGRADE` replaces the code and keeps the stable
+    memory, calling the `pre_upgrade` hook of the old code and the `post_upgrade` hook
+    of the new code.
+    """
+
+    INSTALL = "install"
+    REINSTALL = "reinstall"
+    UPGRADE = "upgrade"
+
+
+class WasmMemoryPersistence(Enum):
+    """Whether an upgrade keeps the main (heap) memory of a canister. `KEEP` is only
+    supported by canisters that declare enhanced orthogonal persistence."""
+
+    KEEP = "keep"
+    REPLACE = "replace"
+
+
+class UpgradeOptions:
+    """The options of an upgrade."""
+
+    def __init__(
+        self,
+        skip_pre_upgrade: Optional[bool] = None,
+        wasm_memory_persistence: Optional[WasmMemoryPersistence] = None,
+    ) -> None:
+        """
+        Args:
+            skip_pre_upgrade (Optional[bool], optional): whether to skip the `pre_upgrade`
+                hook of the old code, e.g. to recover a canister whose hook traps,
+                defaults to `None`
+            wasm_memory_persistence (Optional[WasmMemoryPersistence], optional): whether
+                to keep the main memory, defaults to `None`
+        """
+        self.skip_pre_upgrade = skip_pre_upgrade
+        self.wasm_memory_persistence = wasm_memory_persistence
+
+    def __repr__(self) -> str:
+        return f"UpgradeOptions(skip_pre_upgrade={self.skip_pre_upgrade}, wasm_memory_persistence={self.wasm_memory_persistence})"
+
+
+def mode_candid_type():
+    """Returns the Candid type of the `mode` argument of `install_code`."""
+    types = ic.candid.Types
+
+    upgrade_options = types.Record(
+        {
+            "skip_pre_upgrade": types.Opt(types.Bool),
+            "wasm_memory_persistence": types.Opt(
+                types.Variant({"keep": types.Null, "replace": types.Null})
+            ),
+        }
+    )
+    return types.Variant(
+        {
+            "install": types.Null,
+            "reinstall": types.Null,
+            "upgrade": types.Opt(upgrade_options),
+        }
+    )
+
+
+def mode_candid_value(
+    mode: InstallMode, upgrade_options: Optional[UpgradeOptions]
+) -> dict:
+    """Returns the Candid value of the `mode` argument of `install_code`.
+
+    Raises:
+        ValueError: if upgrade options are given for another mode than `UPGRADE`
+    """
+    if mode != InstallMode.UPGRADE:
+        if upgrade_options is not None:
+            raise ValueError("Upgrade options require `InstallMode.UPGRADE`.")
+        return {mode.value: None}
+    if upgrade_options is None:
+        return {"upgrade": []}
+    persistence = upgrade_options.wasm_memory_persistence
+    return {
+        "upgrade": [
+            {
+                "skip_pre_upgrade": (
+                    []
+                    if upgrade_options.skip_pre_upgrade is None
+                    else [upgrade_options.skip_pre_upgrade]
+                ),
+                "wasm_memory_persistence": (
+                    [] if persistence is None else [{persistence.value: None}]
+                ),
+            }
+        ]
+    }
@@ -0,0 +1,83 @@
+"""
+This module contains `LazyCandidResult`, a call result that is only Candid-decoded when
+its contents are inspected.
+"""
+
+from collections.abc import Sequence
+from typing import Any, Optional
+from pocket_ic import tracing
+from pocket_ic._lazy import lazy_import
+
+ic = lazy_import("ic")
+
+
+class LazyCandidResult(Sequence):
+    """
+    The result of a canister call that keeps the raw Candid reply and decodes it on first
+    access. It behaves like the list of return values that `ic.Canister` methods return,
+    so `result[0]` is the first return value. The typed form returned by `ic.decode`,
+    a list of `{"type": ..., "value": ...}` dicts, is available with `decode()`.
+
+    Comparing two lazy results, hashing a lazy result, or reading `raw` does not decode the
+    reply, so checking that two calls returned the same data is cheap even for large
+    replies.
+    """
+
+    __slots__ = ("_raw", "_return_types", "_decoded", "_values")
+
+    def __init__(self, raw: bytes, return_types: Optional[Any] = None) -> None:
+        """Wraps a raw Candid reply.
+
+        Args:
+            raw (bytes): the Candid encoded reply
+            return_types (Optional[Any], optional): the expected Candid return types, as
+                passed to `ic.decode`, defaults to `None`
+        """
+        self._raw = raw
+        self._return_types = return_types
+        self._decoded: Optional[list] = None
+        self._values: Optional[list] = None
+
+    @property
+    def raw(self) -> bytes:
+        """The Candid encoded reply."""
+        return self._raw
+
+    @property
+    def is_decoded(self) -> bool:
+        """Whether the reply has been decoded already."""
+        return self._decoded is not None
+
+    def decode(self) -> list:
+        """Decodes the reply, once, and returns the typed values, like `ic.decode`."""
+        if self._decoded is None:
+            with tracing.span("candid.decode", "candid", lazy=True):
+                self._decoded = ic.decode(self._raw, self._return_types)
+        return self._decoded
+
+    def values(self) -> list:
+        """Returns the decoded values without their types, like `ic.Canister` methods do."""
+        if self._values is None:
+            self._values = [item["value"] for item in self.decode()]
+        return self._values
+
+    def __getitem__(self, index):
+        return self.values()[index]
+
+    def __len__(self) -> int:
+        return len(self.values())
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, LazyCandidResult):
+            return self._raw == other._raw
+        if isinstance(other, list):
+            return self.values() == other
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self._raw)
+
+    def __repr__(self) -> str:
+        if self._decoded is None:
+            return f"LazyCandidResult(<{len(self._raw)} bytes, not decoded>)"
+        return f"LazyCandidResult({self.values()!r})"
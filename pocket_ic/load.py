@@ -0,0 +1,196 @@
+"""
+This module contains `LoadGenerator`, which measures the update call throughput a
+canister sustains on a PocketIC instance.
+"""
+
+from __future__ import annotations
+
+import random
+import time
+from typing import TYPE_CHECKING, Callable, List, Optional, Union
+from pocket_ic._stats import percentile
+
+if TYPE_CHECKING:
+    import ic
+    from pocket_ic.pocket_ic import PocketIC
+
+
+class Call:
+    """
+    One kind of update call in the call mix of a `LoadGenerator`.
+
+    `payload` is either the candid encoded payload, or a function that is called with
+    the sequence number of the call and the sender, and returns the payload. Calls are
+    drawn from the mix proportionally to their `weight`.
+    """
+
+    def __init__(
+        self,
+        canister_id: ic.Principal,
+        method: str,
+        payload: Union[bytes, Callable[[int, ic.Principal], bytes]],
+        weight: int = 1,
+    ) -> None:
+        self.canister_id = canister_id
+        self.method = method
+        self.payload = payload
+        self.weight = weight
+
+    def __repr__(self) -> str:
+        return f"Call(canister_id={self.canister_id}, method={self.method!r}, weight={self.weight})"
+
+    def encode(self, seq: int, sender: ic.Principal) -> bytes:
+        """Returns the payload of the `seq`-th call, made by `sender`."""
+        if callable(self.payload):
+            return self.payload(seq, sender)
+        return self.payload
+
+
+class LoadReport:
+    """The result of a `LoadGenerator` run."""
+
+    def __init__(self) -> None:
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.rounds = 0
+        self.wall_seconds = 0.0
+        # latency of every completed or rejected call, in rounds
+        self.latencies: List[int] = []
+
+    @property
+    def throughput_per_round(self) -> float:
+        """Successfully completed calls per round."""
+        return self.completed / self.rounds if self.rounds else 0.0
+
+    @property
+    def throughput_per_second(self) -> float:
+        """Successfully completed calls per wall-clock second."""
+        return self.completed / self.wall_seconds if self.wall_seconds else 0.0
+
+    @property
+    def rejection_rate(self) -> float:
+        """The fraction of submitted calls that were rejected."""
+        return self.rejected / self.submitted if self.submitted else 0.0
+
+    def latency_percentile(self, p: float) -> float:
+        """Returns the `p`-th percentile of the call latency, in rounds."""
+        return percentile(self.latencies, p)
+
+    def __str__(self) -> str:
+        return (
+            f"submitted {self.submitted}, completed {self.completed}, "
+            f"rejected {self.rejected} ({self.rejection_rate:.1%}), timed out {self.timed_out}\n"
+            f"{self.rounds} rounds in {self.wall_seconds:.2f}s: "
+            f"{self.throughput_per_round:.1f} calls/round, {self.throughput_per_second:.1f} calls/s\n"
+            f"latency in rounds: p50 {self.latency_percentile(50)}, "
+            f"p90 {self.latency_percentile(90)}, p99 {self.latency_percentile(99)}, "
+            f"max {max(self.latencies, default=0)}"
+        )
+
+
+class LoadGenerator:
+    """
+    Generates update call load on a PocketIC instance.
+
+    Up to `concurrency` calls are kept in flight: every round, new calls are submitted
+    until that limit is reached, then the instance executes one round and the status of
+    all calls in flight is checked. Calls are drawn from the weighted call mix and sent
+    by the `senders` in turn.
+
+    Example:
+        transfer = Call(ledger_id, "icrc1_transfer", lambda seq, sender: encode_transfer(seq))
+        report = LoadGenerator(pic, [transfer], senders=accounts, concurrency=200).run(5_000)
+        print(report)
+    """
+
+    def __init__(
+        self,
+        pic: PocketIC,
+        calls: List[Call],
+        senders: Optional[List[ic.Principal]] = None,
+        concurrency: int = 100,
+        max_rounds_per_call: int = 100,
+        seed: Optional[int] = None,
+    ) -> None:
+        """Creates a new load generator.
+
+        Args:
+            pic (PocketIC): the instance to generate load on
+            calls (List[Call]): the call mix
+            senders (Optional[List[ic.Principal]], optional): the senders of the calls,
+                defaults to the sender set on `pic`
+            concurrency (int, optional): the maximum number of calls in flight, defaults to 100
+            max_rounds_per_call (int, optional): calls that take more rounds are counted
+                as timed out, defaults to 100
+            seed (Optional[int], optional): the seed for drawing calls from the mix
+
+        Raises:
+            ValueError: if the call mix is empty
+        """
+        if not calls:
+            raise ValueError("At least one call must be configured.")
+        self.pic = pic
+        self.calls = calls
+        self.senders = senders if senders else [pic.sender]
+        self.concurrency = concurrency
+        self.max_rounds_per_call = max_rounds_per_call
+        self._rng = random.Random(seed)
+
+    def run(self, total_calls: int) -> LoadReport:
+        """Submits `total_calls` calls and executes rounds until all of them are done.
+
+        Args:
+            total_calls (int): the number of calls to make
+
+        Returns:
+            LoadReport: the throughput, latency and rejection statistics
+        """
+        report = LoadReport()
+        weights = [call.weight for call in self.calls]
+        # message ID and submission round of the calls in flight
+        in_flight: List[tuple] = []
+        start = time.perf_counter()
+
+        while report.submitted < total_calls or in_flight:
+            while len(in_flight) < self.concurrency and report.submitted < total_calls:
+                seq = report.submitted
+                call = self._rng.choices(self.calls, weights)[0]
+                sender = self.senders[seq % len(self.senders)]
+                report.submitted += 1
+                try:
+                    message_id = self.pic.submit_call(
+                        call.canister_id,
+                        call.method,
+                        call.encode(seq, sender),
+                        sender=sender,
+                    )
+                except ValueError:
+                    report.rejected += 1
+                    report.latencies.append(0)
+                    continue
+                in_flight.append((message_id, report.rounds))
+
+            self.pic.tick()
+            report.rounds += 1
+
+            still_in_flight = []
+            for message_id, submitted_in in in_flight:
+                latency = report.rounds - submitted_in
+                status = self.pic.ingress_status(message_id)
+                if not status:
+                    if latency >= self.max_rounds_per_call:
+                        report.timed_out += 1
+                    else:
+                        still_in_flight.append((message_id, submitted_in))
+                    continue
+                report.latencies.append(latency)
+                if "Ok" in status:
+                    report.completed += 1
+                else:
+                    report.rejected += 1
+            in_flight = still_in_flight
+
+        report.wall_seconds = time.perf_counter() - start
+        return report
@@ -2,13 +2,104 @@
 This module contains `PocketIC`, which is the main interface exposed to the test author.
 """
 
+from __future__ import annotations
+
 import base64
-import ic
-from ic.candid import Types
-from typing import Optional, Any
-from pocket_ic.pocket_ic_server import PocketICServer
+import hashlib
+import shutil
+import tempfile
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Callable, List, Optional, Any
+from pocket_ic import tracing
+from pocket_ic._lazy import lazy_import
+from pocket_ic.auto_progress import AutoProgress
+from pocket_ic.chunk_store import (
+    CHUNK_SIZE,
+    WasmSource,
+    encode_upload_chunk,
+    open_wasm_module,
+)
+from pocket_ic.compression import DEFAULT_COMPRESSOR, PayloadCompressor
+from pocket_ic.install_mode import (
+    InstallMode,
+    UpgradeOptions,
+    mode_candid_type,
+    mode_candid_value,
+)
+from pocket_ic.lazy_result import LazyCandidResult
+from pocket_ic.prepared_call import PreparedCall
+from pocket_ic.profiler import CyclesProfiler
+from pocket_ic.query_cache import QueryCache
+from pocket_ic.stable_memory import (
+    WASM_PAGE_SIZE,
+    StableMemoryDiff,
+    StableMemorySnapshot,
+)
+from pocket_ic.pocket_ic_server import PocketICServer, PocketICServerCluster
 from pocket_ic.subnet_config import SubnetConfig, SubnetKind
 
+if TYPE_CHECKING:
+    import ic
+else:
+    # ic-py pulls in the ANTLR Candid parser, ecdsa, cbor2, etc.; defer it to first use.
+    ic = lazy_import("ic")
+
+
+class Checkpoint:
+    """
+    A persisted copy of the subnet states of a PocketIC instance, created with
+    `PocketIC.checkpoint()`. Use `PocketIC.fork(checkpoint)` to create new instances
+    from it; the checkpoint itself is never modified by the instances forked from it.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def __repr__(self) -> str:
+        return f"Checkpoint(path={self.path!r})"
+
+    def delete(self) -> None:
+        """Removes the checkpoint from disk."""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class CanisterSnapshot:
+    """
+    A snapshot of the state of a canister, taken with `PocketIC.take_canister_snapshot`.
+    Snapshots are stored by the management canister; use `PocketIC.restore_canister` to
+    roll the canister back to one.
+    """
+
+    def __init__(self, snapshot_id: bytes, taken_at_timestamp: int, total_size: int):
+        self.id = snapshot_id
+        self.taken_at_timestamp = taken_at_timestamp
+        self.total_size = total_size
+
+    def __repr__(self) -> str:
+        return f"CanisterSnapshot(id={self.id.hex()}, total_size={self.total_size})"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, CanisterSnapshot) and self.id == other.id
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+    @staticmethod
+    def _candid_type():
+        types = ic.candid.Types
+
+        return types.Record(
+            {
+                "id": types.Vec(types.Nat8),
+                "taken_at_timestamp": types.Nat64,
+                "total_size": types.Nat64,
+            }
+        )
+
+    @classmethod
+    def _from_candid(cls, value: dict) -> CanisterSnapshot:
+        return cls(bytes(value["id"]), value["taken_at_timestamp"], value["total_size"])
+
 
 class PocketIC:
     """
@@ -16,24 +107,169 @@ class PocketIC:
 
     The interface of this class is derived from the StateMachine testing framework,
     which presents a blocking API to the user.
+
+    The instance is deleted from the server when `close()` is called, when the `with`
+    block using it as a context manager is left, or at the latest when the object is
+    garbage collected. Deletion happens in the background and does not block the caller.
+
+    Wasm modules and stable memory blobs above `compressor.threshold` bytes are
+    gzip-compressed before they are sent to the server. Set `compressor` to another
+    `PayloadCompressor` to tune this, or to `None` to send all payloads as given.
+
+    Set `lazy_decoding` to `True` to make `query_raw` and `update_raw`, and therefore the
+    methods of `ic.Canister` objects, return a `LazyCandidResult` that is only decoded when
+    inspected. The result is a sequence of the return values, like the list that
+    `ic.Canister` methods return otherwise; `decode()` returns the typed values.
     """
 
-    def __init__(self, subnet_config: Optional[SubnetConfig] = None) -> None:
+    def __init__(
+        self,
+        subnet_config: Optional[SubnetConfig] = None,
+        server: Optional[PocketICServer | PocketICServerCluster] = None,
+    ) -> None:
         """Creates a new PocketIC instance with an optional subnet configuration.
 
         Args:
             subnet_config (Optional[SubnetConfig], optional): the subnet configuration to use,
               defaults to one application subnet
+            server (Optional[PocketICServer | PocketICServerCluster], optional): the server
+              or cluster of servers to create the instance on, defaults to the server of the
+              current process
         """
-        self.server = PocketICServer()
+        self.server = server if server else PocketICServer()
         subnet_config = subnet_config if subnet_config else SubnetConfig(application=1)
         subnet_config.validate()
-        self.instance_id = self.server.new_instance(subnet_config._json())
+        self._state_dir = subnet_config.state_dir
+        self._owns_state_dir = False
+        self._deletion: Optional[Future] = None
+        self.auto_progress: Optional[AutoProgress] = None
+        self.instance_id = self.server.new_instance(subnet_config._json(), owner=self)
+        # the resource usage of the server process during the lifetime of the instance
+        self._sampler = getattr(self.server, "sampler", None)
+        self._resources = None
+        if self._sampler is not None:
+            try:
+                self._resources = self._sampler.begin(f"instance {self.instance_id}")
+            except OSError:
+                # The sampled process has exited; the instance lives on another server.
+                pass
         self.sender = ic.Principal.anonymous()
+        self.compressor: Optional[PayloadCompressor] = DEFAULT_COMPRESSOR
+        self.profiler: Optional[CyclesProfiler] = None
+        self.lazy_decoding = False
+        self.query_cache: Optional[QueryCache] = None
 
-    def __del__(self) -> None:
-        """Deletes the instance from the PocketIC server."""
+    def __enter__(self) -> PocketIC:
+        return self
+
+    def __exit__(self, *_exc_info) -> None:
+        self.close()
+
+    def close(self) -> Future:
+        """Deletes the instance from the PocketIC server in the background. Calling this
+        method more than once has no further effect.
+
+        The PocketIC server writes the state of an instance created with
+        `SubnetConfig(state_dir=...)` to that directory when it is deleted, so wait for
+        the returned future before creating an instance from the state.
+
+        Returns:
+            Future: a future that completes once the instance is deleted
+        """
+        return self._close(background=True)
+
+    def _close(self, background: bool) -> Future:
+        if self._deletion is None:
+            self.stop_auto_progress()
+            if self._resources is not None:
+                self._sampler.end(self._resources)
+            if background:
+                self._deletion = self.server.delete_instance_in_background(
+                    self.instance_id
+                )
+            else:
+                self.server.delete_instance(self.instance_id)
+                self._deletion = Future()
+                self._deletion.set_result(None)
+            if self._owns_state_dir:
+                state_dir = self._state_dir
+                self._deletion.add_done_callback(
+                    lambda _: shutil.rmtree(state_dir, ignore_errors=True)
+                )
+        return self._deletion
+
+    def checkpoint(self, path: Optional[str] = None) -> Checkpoint:
+        """Persists the current state of all subnets of this instance, so that new
+        instances can be forked from it with `PocketIC.fork`.
+
+        The instance must have been created with `SubnetConfig(state_dir=...)`. The PocketIC
+        server writes the subnet states to that directory when the instance is deleted, so
+        the instance is deleted and immediately recreated from its state. This changes
+        `instance_id`, but the state of the instance is preserved.
+
+        Args:
+            path (Optional[str], optional): an empty directory to store the checkpoint in,
+                defaults to a new temporary directory
+
+        Raises:
+            ValueError: if the instance has no state directory or is already closed
+
+        Returns:
+            Checkpoint: the checkpoint
+        """
+        if self._state_dir is None:
+            raise ValueError(
+                "Checkpoints require an instance created with `SubnetConfig(state_dir=...)`."
+            )
+        if self._deletion is not None:
+            raise ValueError("Cannot checkpoint a closed instance.")
+        path = path if path else tempfile.mkdtemp(prefix="pocket_ic_checkpoint_")
         self.server.delete_instance(self.instance_id)
+        shutil.copytree(self._state_dir, path, dirs_exist_ok=True)
+        self.instance_id = self.server.new_instance(
+            SubnetConfig(state_dir=self._state_dir)._json(), owner=self
+        )
+        return Checkpoint(path)
+
+    @classmethod
+    def fork(
+        cls,
+        checkpoint: Checkpoint,
+        server: Optional[PocketICServer | PocketICServerCluster] = None,
+    ) -> PocketIC:
+        """Creates a new PocketIC instance from a checkpoint, without replaying the calls
+        that produced its state. The new instance works on its own copy of the checkpoint,
+        which is removed when the instance is closed.
+
+        Args:
+            checkpoint (Checkpoint): a checkpoint created with `PocketIC.checkpoint()`
+            server (Optional[PocketICServer | PocketICServerCluster], optional): the server
+                or cluster of servers to create the instance on, defaults to the server of
+                the current process
+
+        Returns:
+            PocketIC: the new instance
+        """
+        state_dir = tempfile.mkdtemp(prefix="pocket_ic_fork_")
+        shutil.copytree(checkpoint.path, state_dir, dirs_exist_ok=True)
+        pic = cls(SubnetConfig(state_dir=state_dir), server=server)
+        pic._owns_state_dir = True
+        return pic
+
+    def __del__(self) -> None:
+        """Deletes the instance from the PocketIC server, unless it is already closed.
+        Instances with a state directory are deleted synchronously, so that their state
+        is written once they are garbage collected."""
+        if getattr(self, "_deletion", None) is not None or not hasattr(
+            self, "instance_id"
+        ):
+            return
+        try:
+            self._close(background=self._state_dir is None or self._owns_state_dir)
+        except RuntimeError:
+            # No new threads can be started during interpreter shutdown; the instance
+            # is deleted by the sweep that `PocketICServer` registers to run at exit.
+            pass
 
     def set_anonymous_sender(self) -> None:
         """Sets the new sender for all following calls to the IC to the anonymous principal."""
@@ -100,8 +336,10 @@ class PocketIC:
         new_time = self.get_time()["nanos_since_epoch"] + nanosecs
         self.set_time(new_time)
 
+    @tracing.traced
     def tick(self) -> None:
         """Make the IC produce and progress by one block."""
+        tracing.count("rounds")
         self._instance_post("update/tick", {})
 
     def get_subnet(self, canister_id: ic.Principal) -> Optional[ic.Principal]:
@@ -120,6 +358,27 @@ class PocketIC:
             return ic.Principal(b)
         return None
 
+    def get_subnet_size(self, subnet_id: ic.Principal) -> int:
+        """Get the number of nodes of a subnet. The fees a subnet charges scale with its
+        size.
+
+        Args:
+            subnet_id (ic.Principal): the ID of the subnet
+
+        Raises:
+            ValueError: if the subnet does not exist
+
+        Returns:
+            int: the number of nodes of the subnet
+        """
+        subnets = self._instance_get("read/topology")["subnet_configs"]
+        config = subnets.get(subnet_id.to_str())
+        if config is None:
+            raise ValueError(f"Subnet {subnet_id.to_str()} does not exist.")
+        if "size" in config:
+            return config["size"]
+        return len(config["node_ids"])
+
     def check_canister_exists(self, canister_id: ic.Principal) -> bool:
         """Check whether the provided canister exists.
 
@@ -182,9 +441,12 @@ class PocketIC:
         Args:
             canister_id (ic.Principal): the ID of the canister
             data (bytes): the data to set
-            compression (str, optional): optional gzip compression, defaults to `None`
+            compression (str, optional): "gzip" if `data` is already compressed, defaults
+                to `None`, in which case large data is compressed automatically
         """
-        blob_id = self.server.set_blob_store_entry(data, compression)
+        if compression is None:
+            data, compression = self._compress(data).result()
+        blob_id = self.server.set_blob_store_entry(data, compression, self.instance_id)
         body = {
             "canister_id": base64.b64encode(canister_id.bytes).decode(),
             "blob_id": base64.b64encode(bytes.fromhex(blob_id)).decode(),
@@ -192,6 +454,75 @@ class PocketIC:
 
         self._instance_post("update/set_stable_memory", body)
 
+    def snapshot_stable_memory(
+        self,
+        canister_id: ic.Principal,
+        keep_pages: bool = True,
+        base: Optional[StableMemorySnapshot] = None,
+        page_size: int = WASM_PAGE_SIZE,
+    ) -> StableMemorySnapshot:
+        """Takes a page-hashed snapshot of the stable memory of a canister.
+
+        Args:
+            canister_id (ic.Principal): the ID of the canister
+            keep_pages (bool, optional): whether to keep the page contents, which is required
+                to restore the snapshot, defaults to `True`
+            base (Optional[StableMemorySnapshot], optional): an earlier snapshot; only pages
+                that differ from it are kept, defaults to `None`
+            page_size (int, optional): the page size, defaults to the wasm page size
+
+        Returns:
+            StableMemorySnapshot: the snapshot
+        """
+        data = self.get_stable_memory(canister_id)
+        return StableMemorySnapshot(data, page_size, keep_pages, base)
+
+    def diff_stable_memory(
+        self, canister_id: ic.Principal, snapshot: StableMemorySnapshot
+    ) -> StableMemoryDiff:
+        """Compares the stable memory of a canister with a snapshot, without keeping a copy
+        of the memory.
+
+        Args:
+            canister_id (ic.Principal): the ID of the canister
+            snapshot (StableMemorySnapshot): the snapshot to compare with
+
+        Returns:
+            StableMemoryDiff: the pages that changed since the snapshot was taken
+        """
+        current = self.snapshot_stable_memory(
+            canister_id, keep_pages=False, page_size=snapshot.page_size
+        )
+        return snapshot.diff(current)
+
+    def restore_stable_memory(
+        self, canister_id: ic.Principal, snapshot: StableMemorySnapshot
+    ) -> StableMemoryDiff:
+        """Restores the stable memory of a canister to a snapshot. Only the pages that
+        changed since the snapshot are taken from it, and nothing is uploaded if no page
+        changed.
+
+        Args:
+            canister_id (ic.Principal): the ID of the canister
+            snapshot (StableMemorySnapshot): a snapshot taken with `keep_pages=True`
+
+        Raises:
+            ValueError: if the snapshot does not keep its pages
+
+        Returns:
+            StableMemoryDiff: the pages that were restored
+        """
+        if not snapshot.has_pages:
+            raise ValueError(
+                "Only snapshots taken with `keep_pages=True` can be restored."
+            )
+        data = self.get_stable_memory(canister_id)
+        diff = snapshot.diff(StableMemorySnapshot(data, snapshot.page_size))
+        if diff:
+            self.set_stable_memory(canister_id, snapshot.patch(data, diff))
+        return diff
+
+    @tracing.traced
     def update_call(
         self,
         canister_id: Optional[ic.Principal],
@@ -212,6 +543,7 @@ class PocketIC:
             canister_id, None, method, payload
         )
 
+    @tracing.traced
     def query_call(
         self,
         canister_id: Optional[ic.Principal],
@@ -230,6 +562,13 @@ class PocketIC:
         """
 
         canister_id = canister_id if canister_id else ic.Principal.management_canister()
+        cache = self.query_cache
+        if cache is not None:
+            key = (canister_id.bytes, method, bytes(payload), self.sender.bytes)
+            result, generation = cache.get(key)
+            if result is not None:
+                # Lists are mutable; don't let the caller modify the cached result.
+                return list(result) if isinstance(result, list) else result
         body = {
             "sender": base64.b64encode(self.sender.bytes).decode(),
             "effective_principal": "None",
@@ -238,8 +577,16 @@ class PocketIC:
             "payload": base64.b64encode(payload).decode(),
         }
 
-        submit_ingress_message_response = self._instance_post("read/query", body)
-        return self._get_ok_data(submit_ingress_message_response)
+        result = self.profiled(
+            canister_id,
+            method,
+            lambda: self._get_ok_data(self._instance_post("read/query", body)),
+        )
+        if cache is not None:
+            cache.put(
+                key, list(result) if isinstance(result, list) else result, generation
+            )
+        return result
 
     def create_canister(
         self,
@@ -265,19 +612,21 @@ class PocketIC:
         Returns:
             ic.Principal: the ID of the created canister
         """
-        record = Types.Record(
+        types = ic.candid.Types
+
+        record = types.Record(
             {
-                "settings": Types.Opt(
-                    Types.Record(
+                "settings": types.Opt(
+                    types.Record(
                         {
-                            "controllers": Types.Opt(Types.Vec(Types.Principal)),
-                            "compute_allocation": Types.Opt(Types.Nat),
-                            "memory_allocation": Types.Opt(Types.Nat),
-                            "freezing_threshold": Types.Opt(Types.Nat),
+                            "controllers": types.Opt(types.Vec(types.Principal)),
+                            "compute_allocation": types.Opt(types.Nat),
+                            "memory_allocation": types.Opt(types.Nat),
+                            "freezing_threshold": types.Opt(types.Nat),
                         }
                     )
                 ),
-                "specified_id": Types.Opt(Types.Principal),
+                "specified_id": types.Opt(types.Principal),
             }
         )
 
@@ -301,56 +650,339 @@ class PocketIC:
             ic.encode(payload),
         )
         candid = ic.decode(
-            bytes(request_result), Types.Record({"canister_id": Types.Principal})
+            bytes(request_result), types.Record({"canister_id": types.Principal})
         )
         canister_id = candid[0]["value"]["canister_id"]
         return canister_id
 
+    @tracing.traced
     def install_code(
         self,
         canister_id: ic.Principal,
         wasm_module: bytes,
         arg: list,
+        mode: InstallMode = InstallMode.INSTALL,
+        upgrade_options: Optional[UpgradeOptions] = None,
     ) -> None:
         """Installs WASM code to the given canister ID with arguments.
 
         Args:
             canister_id (ic.Principal): the target canister
-            wasm_module (bytes): the wasm module as bytes
+            wasm_module (bytes): the wasm module as bytes, optionally gzip-compressed
             arg (list): list of install arguments
+            mode (InstallMode, optional): whether to install, reinstall or upgrade,
+                defaults to `InstallMode.INSTALL`
+            upgrade_options (Optional[UpgradeOptions], optional): the options of an
+                upgrade, defaults to `None`
+
+        Raises:
+            ValueError: if upgrade options are given for another mode than `UPGRADE`
         """
-        install_code_arg = Types.Record(
+        types = ic.candid.Types
+
+        mode_value = mode_candid_value(mode, upgrade_options)
+        # Compress on a worker thread while the rest of the payload is built.
+        compressed_wasm = self._compress(wasm_module)
+        install_code_arg = types.Record(
             {
-                "wasm_module": Types.Vec(Types.Nat8),
-                "canister_id": Types.Principal,
-                "arg": Types.Vec(Types.Nat8),
-                "mode": Types.Variant(
-                    {
-                        "install": Types.Null,
-                        "reinstall": Types.Null,
-                        "upgrade": Types.Null,
-                    }
-                ),
+                "wasm_module": types.Vec(types.Nat8),
+                "canister_id": types.Principal,
+                "arg": types.Vec(types.Nat8),
+                "mode": mode_candid_type(),
             }
         )
+        with tracing.span("compress", "compression", size=len(wasm_module)):
+            wasm = compressed_wasm.result()[0]
         payload = [
             {
                 "type": install_code_arg,
                 "value": {
-                    "wasm_module": wasm_module,
+                    "wasm_module": wasm,
                     "arg": ic.encode(arg),
                     "canister_id": canister_id.bytes,
-                    "mode": {"install": None},
+                    "mode": mode_value,
                 },
             }
         ]
 
+        with tracing.span("candid.encode", "candid"):
+            encoded = ic.encode(payload)
         effective_principal = {
             "CanisterId": base64.b64encode(canister_id.bytes).decode()
         }
-        self.update_call_with_effective_principal(
-            None, effective_principal, "install_code", ic.encode(payload)
+        self.profiled(
+            canister_id,
+            "install_code",
+            lambda: self.update_call_with_effective_principal(
+                None, effective_principal, "install_code", encoded
+            ),
+        )
+
+    def stored_chunks(self, canister_id: ic.Principal) -> List[bytes]:
+        """Lists the hashes of the chunks in the chunk store of a canister.
+
+        Args:
+            canister_id (ic.Principal): the canister
+
+        Returns:
+            List[bytes]: the SHA-256 hashes of the stored chunks
+        """
+        types = ic.candid.Types
+
+        res = self._canister_management_call(canister_id, "stored_chunks", {})
+        hashes = ic.decode(
+            bytes(res), types.Vec(types.Record({"hash": types.Vec(types.Nat8)}))
+        )
+        return [bytes(item["hash"]) for item in hashes[0]["value"]]
+
+    def upload_chunks(
+        self,
+        canister_id: ic.Principal,
+        wasm_module: WasmSource,
+        chunk_size: int = CHUNK_SIZE,
+        max_rounds: int = 100,
+    ) -> List[bytes]:
+        """Uploads a wasm module in chunks to the chunk store of a canister. Chunks that
+        are already stored are skipped, and the uploads of all other chunks are submitted
+        at once and executed by the same rounds.
+
+        Args:
+            canister_id (ic.Principal): the canister whose chunk store to upload to
+            wasm_module (WasmSource): the module as bytes or a memory map, or the path of
+                a file containing it, which is memory-mapped rather than read
+            chunk_size (int, optional): the size of the chunks, at most 1 MiB, defaults
+                to 1 MiB
+            max_rounds (int, optional): the number of rounds after which to give up,
+                defaults to 100
+
+        Raises:
+            ValueError: if the chunk size is too large, or an upload is rejected or does
+                not complete within `max_rounds`
+
+        Returns:
+            List[bytes]: the SHA-256 hashes of the chunks of the module, in order
+        """
+        if not 0 < chunk_size <= CHUNK_SIZE:
+            raise ValueError(
+                f"The chunk size must be between 1 and {CHUNK_SIZE} bytes."
+            )
+        effective_principal = self._effective_canister(canister_id)
+        stored = set(self.stored_chunks(canister_id))
+        hashes = []
+        message_ids = []
+        with open_wasm_module(wasm_module) as module:
+            for offset in range(0, len(module), chunk_size):
+                chunk = module[offset : offset + chunk_size]
+                chunk_hash = hashlib.sha256(chunk).digest()
+                hashes.append(chunk_hash)
+                if chunk_hash in stored:
+                    continue
+                stored.add(chunk_hash)
+                message_ids.append(
+                    self.submit_call(
+                        None,
+                        "upload_chunk",
+                        encode_upload_chunk(canister_id, chunk),
+                        effective_principal,
+                    )
+                )
+        self._await_all(message_ids, max_rounds)
+        return hashes
+
+    def install_chunked_code(
+        self,
+        canister_id: ic.Principal,
+        wasm_module: WasmSource,
+        arg: list,
+        chunk_size: int = CHUNK_SIZE,
+        mode: InstallMode = InstallMode.INSTALL,
+        upgrade_options: Optional[UpgradeOptions] = None,
+    ) -> None:
+        """Installs a wasm module that is too large for `install_code` to the given
+        canister ID with arguments. The module is uploaded to the chunk store of the
+        canister with `upload_chunks` and installed from there.
+
+        Args:
+            canister_id (ic.Principal): the target canister
+            wasm_module (WasmSource): the module as bytes or a memory map, or the path of
+                a file containing it, which is memory-mapped rather than read
+            arg (list): list of install arguments
+            chunk_size (int, optional): the size of the chunks, at most 1 MiB, defaults
+                to 1 MiB
+            mode (InstallMode, optional): whether to install, reinstall or upgrade,
+                defaults to `InstallMode.INSTALL`
+            upgrade_options (Optional[UpgradeOptions], optional): the options of an
+                upgrade, defaults to `None`
+
+        Raises:
+            ValueError: if upgrade options are given for another mode than `UPGRADE`
+        """
+        types = ic.candid.Types
+
+        mode_value = mode_candid_value(mode, upgrade_options)
+        with open_wasm_module(wasm_module) as module:
+            chunk_hashes = self.upload_chunks(canister_id, module, chunk_size)
+            module_hash = hashlib.sha256(module).digest()
+        hash_type = types.Record({"hash": types.Vec(types.Nat8)})
+        install_chunked_code_arg = types.Record(
+            {
+                "mode": mode_candid_type(),
+                "target_canister": types.Principal,
+                "store_canister": types.Opt(types.Principal),
+                "chunk_hashes_list": types.Vec(hash_type),
+                "wasm_module_hash": types.Vec(types.Nat8),
+                "arg": types.Vec(types.Nat8),
+                "sender_canister_version": types.Opt(types.Nat64),
+            }
+        )
+        payload = [
+            {
+                "type": install_chunked_code_arg,
+                "value": {
+                    "mode": mode_value,
+                    "target_canister": canister_id.bytes,
+                    "store_canister": [],
+                    "chunk_hashes_list": [{"hash": h} for h in chunk_hashes],
+                    "wasm_module_hash": module_hash,
+                    "arg": ic.encode(arg),
+                    "sender_canister_version": [],
+                },
+            }
+        ]
+        self.profiled(
+            canister_id,
+            "install_chunked_code",
+            lambda: self.update_call_with_effective_principal(
+                None,
+                self._effective_canister(canister_id),
+                "install_chunked_code",
+                ic.encode(payload),
+            ),
+        )
+
+    def start_canister(self, canister_id: ic.Principal) -> None:
+        """Starts a stopped canister.
+
+        Args:
+            canister_id (ic.Principal): the canister
+        """
+        self._canister_management_call(canister_id, "start_canister", {})
+
+    def stop_canister(self, canister_id: ic.Principal) -> None:
+        """Stops a canister, once its outstanding calls are done.
+
+        Args:
+            canister_id (ic.Principal): the canister
+        """
+        self._canister_management_call(canister_id, "stop_canister", {})
+
+    def take_canister_snapshot(
+        self,
+        canister_id: ic.Principal,
+        replace_snapshot: Optional[CanisterSnapshot] = None,
+    ) -> CanisterSnapshot:
+        """Takes a snapshot of the state of a canister.
+
+        Args:
+            canister_id (ic.Principal): the canister
+            replace_snapshot (Optional[CanisterSnapshot], optional): a snapshot of the
+                canister to replace, defaults to `None`
+
+        Raises:
+            ValueError: if the call is rejected, e.g. because the canister has reached its
+                maximum number of snapshots
+
+        Returns:
+            CanisterSnapshot: the snapshot
+        """
+        types = ic.candid.Types
+
+        res = self._canister_management_call(
+            canister_id,
+            "take_canister_snapshot",
+            {"replace_snapshot": types.Opt(types.Vec(types.Nat8))},
+            {"replace_snapshot": [replace_snapshot.id] if replace_snapshot else []},
         )
+        snapshot = ic.decode(bytes(res), CanisterSnapshot._candid_type())
+        return CanisterSnapshot._from_candid(snapshot[0]["value"])
+
+    def load_canister_snapshot(
+        self, canister_id: ic.Principal, snapshot: CanisterSnapshot
+    ) -> None:
+        """Replaces the state of a canister with a snapshot of it. The snapshot is kept.
+
+        Args:
+            canister_id (ic.Principal): the canister
+            snapshot (CanisterSnapshot): a snapshot of the canister
+
+        Raises:
+            ValueError: if the call is rejected, e.g. because the snapshot does not exist
+        """
+        types = ic.candid.Types
+
+        self._canister_management_call(
+            canister_id,
+            "load_canister_snapshot",
+            {
+                "snapshot_id": types.Vec(types.Nat8),
+                "sender_canister_version": types.Opt(types.Nat64),
+            },
+            {"snapshot_id": snapshot.id, "sender_canister_version": []},
+        )
+
+    def list_canister_snapshots(
+        self, canister_id: ic.Principal
+    ) -> List[CanisterSnapshot]:
+        """Lists the snapshots of a canister.
+
+        Args:
+            canister_id (ic.Principal): the canister
+
+        Returns:
+            List[CanisterSnapshot]: the snapshots
+        """
+        types = ic.candid.Types
+
+        res = self._canister_management_call(canister_id, "list_canister_snapshots", {})
+        snapshots = ic.decode(bytes(res), types.Vec(CanisterSnapshot._candid_type()))
+        return [CanisterSnapshot._from_candid(value) for value in snapshots[0]["value"]]
+
+    def delete_canister_snapshot(
+        self, canister_id: ic.Principal, snapshot: CanisterSnapshot
+    ) -> None:
+        """Deletes a snapshot of a canister.
+
+        Args:
+            canister_id (ic.Principal): the canister
+            snapshot (CanisterSnapshot): the snapshot to delete
+        """
+        types = ic.candid.Types
+
+        self._canister_management_call(
+            canister_id,
+            "delete_canister_snapshot",
+            {"snapshot_id": types.Vec(types.Nat8)},
+            {"snapshot_id": snapshot.id},
+        )
+
+    def restore_canister(
+        self, canister_id: ic.Principal, snapshot: CanisterSnapshot, stop: bool = False
+    ) -> None:
+        """Rolls a canister back to a snapshot, typically within a single round. Unlike
+        checkpoints, this only touches one canister and keeps the instance.
+
+        Args:
+            canister_id (ic.Principal): the canister
+            snapshot (CanisterSnapshot): a snapshot of the canister
+            stop (bool, optional): whether to stop the canister while loading the snapshot,
+                which takes additional rounds but waits for outstanding calls of the
+                canister to finish first, defaults to `False`
+        """
+        if stop:
+            self.stop_canister(canister_id)
+        self.load_canister_snapshot(canister_id, snapshot)
+        if stop:
+            self.start_canister(canister_id)
 
     def create_and_install_canister_with_candid(
         self,
@@ -376,6 +1008,8 @@ class PocketIC:
         Returns:
             ic.Canister: the canister object
         """
+        # Start compressing the module right away; `install_code` picks up the cached result.
+        self._compress(wasm_module)
         canister_id = self.create_canister(subnet=subnet)
         canister = ic.Canister(self, canister_id, candid)
 
@@ -408,11 +1042,86 @@ class PocketIC:
                 encoded, or `None`.
             method (str): the method to call
             payload (bytes): the candid encoded payload"""
+        return self.profiled(
+            canister_id,
+            method,
+            lambda: self.await_call(
+                self.submit_call(canister_id, method, payload, effective_principal)
+            ),
+        )
+
+    def prepare(
+        self,
+        canister_id: Optional[ic.Principal],
+        method: str,
+        arg_types: list,
+        ret_types: Optional[list] = None,
+        sender: Optional[ic.Principal] = None,
+        query: bool = False,
+        effective_principal: Optional[dict] = None,
+    ) -> PreparedCall:
+        """Prepares calls to a canister method that is called many times. The request is
+        encoded ahead of time except for the argument values, see `PreparedCall`.
+
+        Args:
+            canister_id (Optional[ic.Principal]): canister ID of the canister to call. If
+                `None`, calls the management canister.
+            method (str): the method to call
+            arg_types (list): the Candid types of the arguments
+            ret_types (Optional[list], optional): the Candid types of the result; if `None`,
+                calls return the raw reply, defaults to `None`
+            sender (Optional[ic.Principal], optional): the sender of the calls, defaults to
+                the sender set on this instance at the time of preparation
+            query (bool, optional): whether to make query calls, defaults to `False`
+            effective_principal (Optional[dict], optional): the effective principal to use,
+                see `update_call_with_effective_principal`, defaults to `None`
+
+        Returns:
+            PreparedCall: a callable making the call with the given argument values
+        """
+        return PreparedCall(
+            self,
+            canister_id,
+            method,
+            arg_types,
+            ret_types,
+            sender,
+            query,
+            effective_principal,
+        )
 
+    def submit_call(
+        self,
+        canister_id: Optional[ic.Principal],
+        method: str,
+        payload: bytes,
+        effective_principal: Optional[dict] = None,
+        sender: Optional[ic.Principal] = None,
+    ) -> dict:
+        """Submits an update call to a canister without executing it. The call is executed
+        by the following rounds; use `await_call` or `ingress_status` to get its result.
+
+        Args:
+            canister_id (Optional[ic.Principal]): canister ID of the canister to call. If
+                `None`, calls the management canister.
+            method (str): the method to call
+            payload (bytes): the candid encoded payload
+            effective_principal (Optional[dict], optional): the effective principal to use,
+                see `update_call_with_effective_principal`, defaults to `None`
+            sender (Optional[ic.Principal], optional): the sender of the call, defaults to
+                the sender set on this instance
+
+        Raises:
+            ValueError: if the call is rejected at submission
+
+        Returns:
+            dict: the message ID of the call
+        """
         canister_id = canister_id if canister_id else ic.Principal.management_canister()
         effective_principal = effective_principal if effective_principal else "None"
+        sender = sender if sender else self.sender
         body = {
-            "sender": base64.b64encode(self.sender.bytes).decode(),
+            "sender": base64.b64encode(sender.bytes).decode(),
             "effective_principal": effective_principal,
             "canister_id": base64.b64encode(canister_id.bytes).decode(),
             "method": method,
@@ -422,22 +1131,248 @@ class PocketIC:
         submit_ingress_message = self._instance_post(
             "update/submit_ingress_message", body
         )
-        msg_id = self._get_ok(submit_ingress_message)
-        for round_limit in range(100):
-          self.tick()
-          result = self._ingress_status(msg_id)
-          if result:
-            return self._get_ok_data(result)
-        msg = f"PocketIC did not complete the update call within 100 rounds"
+        return self._get_ok(submit_ingress_message)
+
+    def await_call(self, message_id: dict, max_rounds: int = 100) -> Any:
+        """Executes rounds until the call with the given message ID completes.
+
+        Args:
+            message_id (dict): the message ID returned by `submit_call`
+            max_rounds (int, optional): the number of rounds after which to give up,
+                defaults to 100
+
+        Raises:
+            ValueError: if the call is rejected or does not complete within `max_rounds`
+
+        Returns:
+            list: a list of candid objects
+        """
+        for _ in range(max_rounds):
+            self.tick()
+            result = self.call_result(message_id)
+            if result is not None:
+                return result
+        msg = f"PocketIC did not complete the update call within {max_rounds} rounds"
         raise ValueError(msg)
 
-    def _ingress_status(self, msg_id):
+    def ingress_status(self, message_id: dict) -> Optional[dict]:
+        """Gets the status of a submitted call without executing any rounds.
+
+        Args:
+            message_id (dict): the message ID returned by `submit_call`
+
+        Returns:
+            Optional[dict]: `None` while the call is in progress, otherwise the raw result,
+                either {"Ok": ...} or {"Err": ...}
+        """
         body = {
-            "raw_message_id": msg_id,
+            "raw_message_id": message_id,
             "raw_caller": None,
         }
         return self._instance_post("read/ingress_status", body)
 
+    def call_result(self, message_id: dict) -> Optional[Any]:
+        """Gets the reply of a submitted call without executing any rounds.
+
+        Args:
+            message_id (dict): the message ID returned by `submit_call`
+
+        Raises:
+            ValueError: if the call was rejected
+
+        Returns:
+            Optional[Any]: `None` while the call is in progress, otherwise the reply, see
+                `reply`
+        """
+        status = self.ingress_status(message_id)
+        return self.reply(status) if status else None
+
+    def reply(self, request_result: dict) -> Any:
+        """Returns the reply of a completed call from its raw result, e.g. as returned by
+        `ingress_status`.
+
+        Args:
+            request_result (dict): the raw result, either {"Ok": ...} or {"Err": ...}
+
+        Raises:
+            ValueError: if the call was rejected
+
+        Returns:
+            Any: the Candid encoded reply as bytes, or a list of its bytes if it is not
+                Candid encoded
+        """
+        return self._get_ok_data(request_result)
+
+    def start_auto_progress(
+        self, interval: float = 0.01, max_rounds: int = 100
+    ) -> AutoProgress:
+        """Starts executing rounds on a background thread, see `AutoProgress`. While it
+        runs, `update_call_async` returns without executing any rounds itself.
+
+        Args:
+            interval (float, optional): the seconds to wait between rounds, defaults to 0.01
+            max_rounds (int, optional): the number of rounds after which a pending call
+                fails, defaults to 100
+
+        Returns:
+            AutoProgress: the running driver
+        """
+        self.stop_auto_progress()
+        self.auto_progress = AutoProgress(self, interval, max_rounds)
+        self.auto_progress.start()
+        return self.auto_progress
+
+    def stop_auto_progress(self) -> None:
+        """Stops executing rounds in the background. Pending `update_call_async` calls fail."""
+        if self.auto_progress is not None:
+            self.auto_progress.stop()
+            self.auto_progress = None
+
+    def update_call_async(
+        self,
+        canister_id: Optional[ic.Principal],
+        method: str,
+        payload: bytes,
+        effective_principal: Optional[dict] = None,
+    ) -> Future:
+        """Submits an update call that is executed by the auto-progress rounds.
+
+        Args:
+            canister_id (Optional[ic.Principal]): canister ID of the canister to call. If
+                `None`, calls the management canister.
+            method (str): the method to call
+            payload (bytes): the candid encoded payload
+            effective_principal (Optional[dict], optional): the effective principal to use,
+                see `update_call_with_effective_principal`, defaults to `None`
+
+        Raises:
+            RuntimeError: if auto-progress is not running, see `start_auto_progress`
+            ValueError: if the call is rejected at submission
+
+        Returns:
+            Future: a future resolving to the result, like `update_call`
+        """
+        if self.auto_progress is None or not self.auto_progress.running:
+            raise RuntimeError("Call start_auto_progress() before update_call_async()")
+        message_id = self.submit_call(canister_id, method, payload, effective_principal)
+        return self.auto_progress.watch(message_id)
+
+    def enable_query_cache(self, max_entries: int = 1024) -> QueryCache:
+        """Serves repeated `query_call`s with the same canister, method, payload and sender
+        from a local cache until the state of the instance changes, see `QueryCache`.
+        Calls through `ic.Canister` objects and `query_raw` are cached as well; prepared
+        calls are not.
+
+        Args:
+            max_entries (int, optional): the number of results to keep, defaults to 1024
+
+        Returns:
+            QueryCache: the cache, with its hit and miss counters
+        """
+        self.query_cache = QueryCache(max_entries)
+        return self.query_cache
+
+    def disable_query_cache(self) -> None:
+        """Stops caching query results."""
+        self.query_cache = None
+
+    def enable_cycles_profiling(
+        self, profiler: Optional[CyclesProfiler] = None
+    ) -> CyclesProfiler:
+        """Records the cycles consumed by every following `update_call`, `query_call` and
+        `install_code`. Each profiled call costs two additional requests to read the
+        canister's cycles balance.
+
+        Args:
+            profiler (Optional[CyclesProfiler], optional): the profiler to record to, e.g.
+                one shared by all instances of a test session, defaults to a new profiler
+
+        Returns:
+            CyclesProfiler: the profiler
+        """
+        self.profiler = profiler if profiler else CyclesProfiler()
+        return self.profiler
+
+    def disable_cycles_profiling(self) -> None:
+        """Stops recording the cycles consumption of calls."""
+        self.profiler = None
+
+    def profiled(
+        self, canister_id: Optional[ic.Principal], method: str, call: Callable[[], Any]
+    ) -> Any:
+        """Runs `call` and, if cycles profiling is enabled, records the cycles it consumed
+        on `canister_id` for `method`. The management canister (`None` or the empty
+        principal) has no cycles balance.
+
+        Args:
+            canister_id (Optional[ic.Principal]): the canister that `call` calls
+            method (str): the method to record the cycles for
+            call (Callable[[], Any]): makes the call
+
+        Returns:
+            Any: the result of `call`
+        """
+        if self.profiler is None or canister_id is None or not canister_id.bytes:
+            return call()
+        before = self.get_cycles_balance(canister_id)
+        result = call()
+        consumed = before - self.get_cycles_balance(canister_id)
+        self.profiler.record(str(canister_id), method, consumed)
+        return result
+
+    def _compress(self, data: bytes) -> Future:
+        if self.compressor is None:
+            future: Future = Future()
+            future.set_result((data, None))
+            return future
+        return self.compressor.compress(data)
+
+    def _await_all(self, message_ids: List[dict], max_rounds: int = 100) -> list:
+        """Executes rounds until all submitted calls complete and returns their results.
+
+        Raises:
+            ValueError: if a call is rejected or does not complete within `max_rounds`
+        """
+        results: List[Any] = [None] * len(message_ids)
+        pending = dict(enumerate(message_ids))
+        for _ in range(max_rounds):
+            if not pending:
+                return results
+            self.tick()
+            for index, message_id in list(pending.items()):
+                result = self.call_result(message_id)
+                if result is not None:
+                    results[index] = result
+                    del pending[index]
+        if pending:
+            msg = f"PocketIC did not complete {len(pending)} update calls within {max_rounds} rounds"
+            raise ValueError(msg)
+        return results
+
+    def _canister_management_call(
+        self,
+        canister_id: ic.Principal,
+        method: str,
+        field_types: dict,
+        values: Optional[dict] = None,
+    ):
+        """Calls a management canister method whose argument is a record with the
+        `canister_id` and the given fields."""
+        types = ic.candid.Types
+
+        arg_type = types.Record({"canister_id": types.Principal, **field_types})
+        value = {"canister_id": canister_id.bytes, **(values if values else {})}
+        return self.update_call_with_effective_principal(
+            None,
+            self._effective_canister(canister_id),
+            method,
+            ic.encode([{"type": arg_type, "value": value}]),
+        )
+
+    @staticmethod
+    def _effective_canister(canister_id: ic.Principal) -> dict:
+        return {"CanisterId": base64.b64encode(canister_id.bytes).decode()}
+
     def _get_ok(self, request_result):
         if "Ok" in request_result:
             return request_result["Ok"]
@@ -464,8 +1399,31 @@ class PocketIC:
 
     def _instance_post(self, endpoint, body):
         """HTTP post requests for instance endpoints"""
+        if endpoint.startswith("update/"):
+            self._state_changing()
         return self.server.instance_post(endpoint, self.instance_id, body)
 
+    def _state_changing(self) -> None:
+        """Called before every request that may change the state of the instance."""
+        if self.query_cache is not None:
+            self.query_cache.invalidate()
+
+    def decode_reply(self, res: Any, return_types: Any) -> Any:
+        """Decodes a Candid encoded reply, or wraps it in a `LazyCandidResult` if lazy
+        decoding is enabled.
+
+        Args:
+            res (Any): the reply, as bytes or a list of bytes
+            return_types (Any): the Candid return types
+
+        Returns:
+            Any: the decoded values, or a `LazyCandidResult`
+        """
+        if self.lazy_decoding:
+            return LazyCandidResult(bytes(res), return_types)
+        with tracing.span("candid.decode", "candid"):
+            return ic.decode(bytes(res), return_types)
+
     ############### For compatibility with ic-py's `ic.Agent` class;  #########
     ############### the `ic.Canister` interface requires these two methods. ###
 
@@ -474,13 +1432,13 @@ class PocketIC:
     ):
         """For compatibility with `ic-py`'s `Agent` class."""
         res = self.query_call(canister_id, name, arguments)
-        return ic.decode(bytes(res), return_types)
+        return self.decode_reply(res, return_types)
 
     def update_raw(
         self, canister_id, name, arguments, return_types, _effective_canister_id
     ):
         """For compatibility with `ic-py`'s `Agent` class."""
         res = self.update_call(canister_id, name, arguments)
-        return ic.decode(bytes(res), return_types)
+        return self.decode_reply(res, return_types)
 
     ###########################################################################
@@ -2,11 +2,29 @@
 This module contains the `PocketICServer`, which starts or discovers a PocketIC server process.
 """
 
+import atexit
+import contextlib
+import json
 import os
+import re
+import signal
+import subprocess
+import threading
 import time
+import weakref
 import requests
-from typing import List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Tuple
 from tempfile import gettempdir
+from pocket_ic import tracing
+from pocket_ic.resources import ResourceSampler
+from pocket_ic.transport import RequestsTransport, Response, Transport
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where servers cannot be shared between processes.
+    fcntl = None
 
 
 class PocketICServer:
@@ -21,49 +39,143 @@ class PocketICServer:
     test will launch a server, while all subsequent tests will discover the running
     one.
 
+    Test suites that run in several processes, e.g. with pytest-xdist, can share one
+    server between all of them by passing the same `shared` name in every process, or by
+    setting the POCKET_IC_SHARED_SERVER environment variable to that name. The processes
+    meet at a lock-protected rendezvous file in the temp directory, which records the
+    server and the processes using it. The last process to exit shuts the server down.
+
     A 'PocketIC' instance uses a 'PocketICServer' instance to retrieve an instance id,
     and a corresponding URL.
+
+    The server answers requests that take long with status 202 (accepted) or 409 (busy).
+    Such requests are polled, respectively retried, with exponential backoff until they
+    complete or `request_deadline` seconds have passed. `metrics` counts how often this
+    happens.
+
+    Instances created through this class are tracked per server. Instances whose owner
+    has been garbage collected without deleting them can be reclaimed with
+    `reclaim_instances`, and all remaining instances are reclaimed at interpreter exit.
+
+    `pid` is the process ID of the server if it was launched by this process or is a
+    shared server, and `None` if the server was attached to by URL. Servers with a known
+    process ID can sample its resource usage, see `enable_resource_sampling`.
+
+    Requests are sent by a `pocket_ic.transport.Transport`, which keeps a pool of
+    keep-alive connections and retries requests that fail at the connection level. Pass
+    a `RequestsTransport` or `HttpxTransport` to configure the pool size, timeouts and
+    retry policy, or to use HTTP/2.
     """
 
-    def __init__(self) -> None:
-        pid = os.getpid()
-        if "POCKET_IC_BIN" in os.environ:
-            bin_path = os.environ["POCKET_IC_BIN"]
-        else:
-            bin_path = "./pocket-ic"
+    # servers launched by this process, by port file path
+    _launched: Dict[str, subprocess.Popen] = {}
+    # resource samplers, by server process ID
+    _samplers: Dict[int, ResourceSampler] = {}
 
-        if not os.path.isfile(bin_path):
-            raise FileNotFoundError(
-                f"""Could not find the PocketIC binary.
+    def __init__(
+        self,
+        request_deadline: float = 300.0,
+        url: Optional[str] = None,
+        port_file_name: Optional[str] = None,
+        shared: Optional[str] = None,
+        transport: Optional[Transport] = None,
+    ) -> None:
+        """Launches or discovers the PocketIC server of the current process, or attaches to
+        a running server.
 
-The PocketIC binary could not be found at "{bin_path}". Please specify the path to the binary with the POCKET_IC_BIN environment variable, \
-or place it in your current working directory (you are running PocketIC from {os.getcwd()}).
+        Args:
+            request_deadline (float, optional): the number of seconds to wait for a request
+                that the server is still processing, defaults to 300
+            url (Optional[str], optional): the URL of a running server to attach to instead
+                of launching one, defaults to `None`
+            port_file_name (Optional[str], optional): the name of the port file in the temp
+                directory used for discovery, defaults to `pocket_ic_{pid}.port`
+            shared (Optional[str], optional): the name of a server shared with other
+                processes, defaults to the POCKET_IC_SHARED_SERVER environment variable
+                unless `url` is given
+            transport (Optional[Transport], optional): the transport to send requests
+                with, defaults to a `RequestsTransport` with default settings
 
-To download the binary, please visit https://github.com/dfinity/pocketic.
-"""
-            )
+        Raises:
+            ValueError: if both `url` and `shared` are given
+            RuntimeError: if a shared server is requested on a platform without POSIX
+                file locks, e.g. Windows
+        """
+        if shared and url is not None:
+            raise ValueError("A shared server cannot be combined with an explicit URL.")
+        if shared is None and url is None:
+            shared = os.environ.get("POCKET_IC_SHARED_SERVER")
+        self.pid: Optional[int] = None
+        self.transport = transport if transport else RequestsTransport()
+        if shared:
+            url, self.pid = _SharedServer.join(shared, self.transport)
+        if url is None:
+            port_file_name = port_file_name or f"pocket_ic_{os.getpid()}.port"
+            port_file_path = os.path.join(gettempdir(), port_file_name)
+            self._launch(port_file_path)
+            url = self._get_url(port_file_path)
+            self.pid = self._running_pid(port_file_path)
+        self.url = url.rstrip("/")
+        self.request_deadline = request_deadline
+        self.metrics = RequestMetrics()
 
-        mute = (
-            "1> /dev/null 2> /dev/null" if "POCKET_IC_MUTE_SERVER" in os.environ else ""
-        )
-        # Attempt to start the PocketIC server if it's not already running.
-        tmp_dir = gettempdir()
-        port_file_path = f"{tmp_dir}/pocket_ic_{pid}.port"
+    @property
+    def sampler(self) -> Optional[ResourceSampler]:
+        """The resource sampler of the server process, if sampling is enabled."""
+        return PocketICServer._samplers.get(self.pid) if self.pid else None
+
+    def enable_resource_sampling(
+        self, interval: float = 1.0, report_at_exit: bool = False
+    ) -> ResourceSampler:
+        """Starts sampling the memory, CPU time and thread count of the server process in
+        the background. Every `PocketIC` instance created on the server process afterwards,
+        through any `PocketICServer` object, is sampled as a scope named after it, from its
+        creation until it is closed.
+
+        Args:
+            interval (float, optional): the seconds between samples, defaults to 1
+            report_at_exit (bool, optional): whether to print the instances with the
+                largest memory growth to stderr at exit, defaults to `False`
+
+        Raises:
+            ValueError: if the process ID of the server is not known
 
-        os.system(f"{bin_path} --port-file {port_file_path} {mute} &")
-        self.url = self._get_url(port_file_path)
-        self.request_client = requests.session()
+        Returns:
+            ResourceSampler: the sampler, e.g. to open scopes for tests
+        """
+        if self.pid is None:
+            raise ValueError("The server process is unknown, e.g. attached to by URL.")
+        if self.pid not in PocketICServer._samplers:
+            sampler = ResourceSampler(self.pid, interval, report_at_exit)
+            sampler.start()
+            PocketICServer._samplers[self.pid] = sampler
+        return PocketICServer._samplers[self.pid]
+
+    def disable_resource_sampling(self) -> None:
+        """Stops sampling the server process."""
+        sampler = PocketICServer._samplers.pop(self.pid, None)
+        if sampler is not None:
+            sampler.stop()
 
-    def new_instance(self, subnet_config: dict) -> int:
+    def new_instance(self, subnet_config: dict, owner: Optional[object] = None) -> int:
         """Creates a new PocketIC instance.
 
+        Args:
+            subnet_config (dict): the JSON subnet configuration
+            owner (Optional[object], optional): the object responsible for deleting the
+                instance. Once it is garbage collected, the instance is considered orphaned
+                and can be reclaimed with `reclaim_instances`. Defaults to `None`, in which
+                case the instance is only reclaimed at interpreter exit.
+
         Returns:
             int: the new instance ID
         """
         url = f"{self.url}/instances"
-        response = self.request_client.post(url, json=subnet_config)
+        response = self._request("POST", url, json=subnet_config)
         res = self._check_response(response)["Created"]
-        return res["instance_id"]
+        instance_id = res["instance_id"]
+        _registry.add(self, instance_id, owner)
+        return instance_id
 
     def list_instances(self) -> List[str]:
         """Lists the currently running instances on the PocketIC Server.
@@ -72,7 +184,7 @@ To download the binary, please visit https://github.com/dfinity/pocketic.
             List[str]: a list of instance names
         """
         url = f"{self.url}/instances"
-        response = self.request_client.get(url)
+        response = self._request("GET", url)
         response = self._check_response(response)
         return response
 
@@ -83,43 +195,150 @@ To download the binary, please visit https://github.com/dfinity/pocketic.
             instance_id (int): the ID of the instance to delete
         """
         url = f"{self.url}/instances/{instance_id}"
-        self.request_client.delete(url)
+        self._request("DELETE", url)
+        _registry.remove(self.url, instance_id)
+
+    def delete_instance_in_background(self, instance_id: int) -> Future:
+        """Deletes an instance from the PocketIC Server on a background thread.
+
+        Args:
+            instance_id (int): the ID of the instance to delete
+
+        Raises:
+            RuntimeError: if called during interpreter shutdown
+
+        Returns:
+            Future: a future that completes once the instance is deleted
+        """
+        return _registry.submit_deletion(self, instance_id)
+
+    def wait_for_deletions(self) -> None:
+        """Blocks until all background deletions scheduled so far have completed."""
+        _registry.wait_for_deletions()
+
+    def reclaim_instances(self, include_live: bool = False) -> List[int]:
+        """Deletes orphaned instances created by this process, i.e. instances whose owner
+        was garbage collected without deleting them.
+
+        Args:
+            include_live (bool, optional): also delete instances whose owner is still alive,
+                defaults to `False`
+
+        Returns:
+            List[int]: the IDs of the deleted instances
+        """
+        statuses = self.list_instances()
+        reclaimed = []
+        for instance_id, owner in _registry.instances(self.url):
+            if instance_id < len(statuses) and statuses[instance_id] == "Deleted":
+                _registry.remove(self.url, instance_id)
+            elif include_live or (owner is not None and owner() is None):
+                self.delete_instance(instance_id)
+                reclaimed.append(instance_id)
+        return reclaimed
+
+    def instance_url(self, endpoint: str, instance_id: int) -> str:
+        """Returns the URL of an instance endpoint"""
+        return f"{self.url}/instances/{instance_id}/{endpoint}"
 
     def instance_get(self, endpoint: str, instance_id: int):
         """HTTP get requests for instance endpoints"""
-        url = f"{self.url}/instances/{instance_id}/{endpoint}"
-        response = self.request_client.get(url)
+        response = self._request("GET", self.instance_url(endpoint, instance_id))
         return self._check_response(response)
 
     def instance_post(self, endpoint: str, instance_id: int, body: Optional[dict]):
         """HTTP post requests for instance endpoints"""
-        url = f"{self.url}/instances/{instance_id}/{endpoint}"
-        response = self.request_client.post(url, json=body)
+        return self.post(self.instance_url(endpoint, instance_id), body)
+
+    def post(self, url: str, body: Optional[dict]):
+        """HTTP post requests for a URL of this server, e.g. from `instance_url`"""
+        response = self._request("POST", url, json=body)
         return self._check_response(response)
 
-    def set_blob_store_entry(self, blob: bytes, compression: Optional[str]) -> str:
+    def set_blob_store_entry(
+        self,
+        blob: bytes,
+        compression: Optional[str],
+        instance_id: Optional[int] = None,
+    ) -> str:
         """Sets a blob store entry.
 
         Args:
             blob (bytes): the blob to set
             compression (str/None): "gzip" or None
+            instance_id (Optional[int], optional): the instance that will use the blob;
+                only relevant for a `PocketICServerCluster`, defaults to `None`
 
         Returns:
             str: the blob store key
         """
+        # All instances of a server share its blob store; the parameter only exists to
+        # share the signature with `PocketICServerCluster.set_blob_store_entry`.
+        del instance_id
         url = f"{self.url}/blobstore"
         if compression is None:
-            response = self.request_client.post(url, data=blob)
+            response = self._request("POST", url, data=blob)
         elif compression == "gzip":
             headers = {"Content-Encoding": "gzip"}
-            response = self.request_client.post(url, data=blob, headers=headers)
+            response = self._request("POST", url, data=blob, headers=headers)
         else:
             raise ValueError('only "gzip" compression is supported')
 
         self._check_status_code(response)
         return response.text
 
-    def _get_url(self, port_file_path: int) -> str:
+    @staticmethod
+    def _launch(port_file_path: str) -> None:
+        """Launches a server unless this process already launched a server using the port
+        file that is still running."""
+        process = PocketICServer._launched.get(port_file_path)
+        if process is None or process.poll() is not None:
+            # If another process runs a server using the port file, this one exits.
+            PocketICServer._launched[port_file_path] = PocketICServer._spawn(
+                port_file_path
+            )
+
+    @staticmethod
+    def _running_pid(port_file_path: str) -> Optional[int]:
+        """Returns the process ID of the server launched for the port file, or `None` if
+        it has exited, e.g. because the port file belongs to another process's server."""
+        process = PocketICServer._launched.get(port_file_path)
+        if process is None or process.poll() is not None:
+            return None
+        return process.pid
+
+    @staticmethod
+    def _spawn(port_file_path: str) -> subprocess.Popen:
+        output = subprocess.DEVNULL if "POCKET_IC_MUTE_SERVER" in os.environ else None
+        return subprocess.Popen(
+            [PocketICServer._bin_path(), "--port-file", port_file_path],
+            stdout=output,
+            stderr=output,
+            # keep the server running when the launching process is interrupted
+            start_new_session=True,
+        )
+
+    @staticmethod
+    def _bin_path() -> str:
+        if "POCKET_IC_BIN" in os.environ:
+            bin_path = os.environ["POCKET_IC_BIN"]
+        else:
+            bin_path = "./pocket-ic"
+
+        if not os.path.isfile(bin_path):
+            raise FileNotFoundError(
+                f"""Could not find the PocketIC binary.
+
+The PocketIC binary could not be found at "{bin_path}". Please specify the path to the binary with the POCKET_IC_BIN environment variable, \
+or place it in your current working directory (you are running PocketIC from {os.getcwd()}).
+
+To download the binary, please visit https://github.com/dfinity/pocketic.
+"""
+            )
+        return bin_path
+
+    @staticmethod
+    def _get_url(port_file_path: str) -> str:
         while True:
             if os.path.isfile(port_file_path):
                 with open(port_file_path, "r", encoding="utf-8") as port_file:
@@ -128,13 +347,495 @@ To download the binary, please visit https://github.com/dfinity/pocketic.
                     return f"http://127.0.0.1:{port.strip()}"
             time.sleep(0.02)  # wait for 20ms
 
-    def _check_response(self, response: requests.Response):
+    def _request(self, method: str, url: str, **kwargs) -> Response:
+        """Sends a request and waits until the server has completed it.
+
+        Raises:
+            TimeoutError: if the request is not completed within `request_deadline` seconds
+        """
+        if tracing.active_tracer() is None:
+            return self._complete(method, url, {}, kwargs)
+        path = url[len(self.url) :] if url.startswith(self.url) else url
+        with tracing.span(f"{method} {path}", "http", url=url) as span:
+            return self._complete(method, url, span, kwargs)
+
+    def _complete(self, method: str, url: str, span: dict, kwargs: dict) -> Response:
+        """Sends a request, again while the instance is busy, and waits until the server
+        has completed it. Records the retries and the status code in `span`."""
+        deadline = time.monotonic() + self.request_deadline
+        delay = _Backoff()
+        while True:
+            response = self.transport.request(method, url, **kwargs)
+            self.metrics.requests += 1
+            if response.status_code == 202:
+                self.metrics.accepted += 1
+                response = self._await_operation(response.json(), deadline)
+            elif response.status_code == 409:
+                # The instance is busy with another operation; retry the request.
+                self.metrics.busy += 1
+                span["retries"] = span.get("retries", 0) + 1
+                self._sleep(delay, deadline, f"{method} {url}")
+                continue
+            span["status"] = response.status_code
+            return response
+
+    def _await_operation(self, started: dict, deadline: float) -> Response:
+        """Polls an operation that the server accepted but has not completed yet."""
+        url = f"{self.url}/read_graph/{started['state_label']}/{started['op_id']}"
+        delay = _Backoff()
+        with tracing.span("await operation", "http", op_id=started["op_id"]) as span:
+            while True:
+                self._sleep(delay, deadline, f"operation {started['op_id']}")
+                response = self.transport.request("GET", url)
+                self.metrics.polls += 1
+                span["polls"] = span.get("polls", 0) + 1
+                if response.status_code != 404:
+                    return response
+
+    def _sleep(self, delay: "_Backoff", deadline: float, what: str):
+        seconds = delay.next()
+        if time.monotonic() + seconds > deadline:
+            self.metrics.timeouts += 1
+            raise TimeoutError(
+                f"PocketIC server did not complete {what} within {self.request_deadline}s"
+            )
+        self.metrics.waiting_seconds += seconds
+        time.sleep(seconds)
+
+    def _check_response(self, response: Response):
         self._check_status_code(response)
         res_json = response.json()
         return res_json
 
-    def _check_status_code(self, response: requests.Response):
-        if response.status_code not in [200, 201, 202]:
+    def _check_status_code(self, response: Response):
+        if response.status_code not in [200, 201]:
+            try:
+                message = response.json()["message"]
+            except (ValueError, KeyError, TypeError):
+                message = response.text
             raise ConnectionError(
-                f'PocketIC server returned status code {response.status_code}: {response.json()["message"]}'
+                f"PocketIC server returned status code {response.status_code}: {message}"
             )
+
+
+class PocketICServerCluster:
+    """
+    A group of PocketIC servers that is used like a single `PocketICServer`, to spread
+    heavy instances over several server processes and thus CPU cores.
+
+    New instances are placed on the server that currently hosts the fewest instances
+    created through this cluster. The instance IDs handed out by the cluster encode the
+    server, so all instance-scoped requests are routed to the right server transparently.
+
+    Example:
+        cluster = PocketICServerCluster(size=4)
+        pics = [PocketIC(server=cluster) for _ in range(16)]
+    """
+
+    def __init__(
+        self,
+        size: int = 2,
+        urls: Optional[List[str]] = None,
+        request_deadline: float = 300.0,
+        transport: Optional[Transport] = None,
+    ) -> None:
+        """Launches `size` servers or attaches to the servers running at `urls`.
+
+        Args:
+            size (int, optional): the number of servers to launch, defaults to 2. Every
+                server is a separate process with its own memory and threads, so only
+                launch as many as the machine's cores and memory can sustain.
+            urls (Optional[List[str]], optional): the URLs of running servers to attach to
+                instead of launching servers, defaults to `None`
+            request_deadline (float, optional): see `PocketICServer`, defaults to 300
+            transport (Optional[Transport], optional): the transport shared by all
+                servers, whose `max_servers` must be at least the number of servers,
+                defaults to a `RequestsTransport` per server
+        """
+        if urls:
+            self.servers = [
+                PocketICServer(request_deadline, url=url, transport=transport)
+                for url in urls
+            ]
+        else:
+            port_file_paths = [
+                os.path.join(gettempdir(), f"pocket_ic_{os.getpid()}_{shard}.port")
+                for shard in range(size)
+            ]
+            # Launch all servers first, so that they start up concurrently.
+            for path in port_file_paths:
+                PocketICServer._launch(path)
+            self.servers = []
+            for path in port_file_paths:
+                url = PocketICServer._get_url(path)
+                server = PocketICServer(request_deadline, url=url, transport=transport)
+                server.pid = PocketICServer._running_pid(path)
+                self.servers.append(server)
+        self._load = [0] * len(self.servers)
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"PocketICServerCluster(urls={[server.url for server in self.servers]})"
+
+    def load(self) -> List[int]:
+        """Returns the number of live instances created through this cluster per server."""
+        with self._lock:
+            return list(self._load)
+
+    def _route(self, instance_id: int):
+        shards = len(self.servers)
+        return self.servers[instance_id % shards], instance_id // shards
+
+    def _release(self, shard: int):
+        with self._lock:
+            self._load[shard] -= 1
+
+    def new_instance(self, subnet_config: dict, owner: Optional[object] = None) -> int:
+        """Creates a new PocketIC instance on the least loaded server.
+
+        Returns:
+            int: the new instance ID
+        """
+        with self._lock:
+            shard = min(range(len(self.servers)), key=lambda i: self._load[i])
+            self._load[shard] += 1
+        local_id = None
+        try:
+            local_id = self.servers[shard].new_instance(subnet_config, owner)
+        finally:
+            if local_id is None:
+                self._release(shard)
+        return local_id * len(self.servers) + shard
+
+    def list_instances(self) -> List[Optional[str]]:
+        """Lists the instances of all servers, indexed by cluster instance ID. IDs that
+        do not belong to any instance are `None`.
+
+        Returns:
+            List[Optional[str]]: a list of instance names
+        """
+        shards = len(self.servers)
+        per_server = [server.list_instances() for server in self.servers]
+        size = max([len(instances) * shards for instances in per_server], default=0)
+        instances: List[Optional[str]] = [None] * size
+        for shard, shard_instances in enumerate(per_server):
+            for local_id, status in enumerate(shard_instances):
+                instances[local_id * shards + shard] = status
+        return instances
+
+    def delete_instance(self, instance_id: int):
+        """Deletes an instance from its server."""
+        server, local_id = self._route(instance_id)
+        server.delete_instance(local_id)
+        self._release(instance_id % len(self.servers))
+
+    def delete_instance_in_background(self, instance_id: int) -> Future:
+        """Deletes an instance from its server on a background thread."""
+        server, local_id = self._route(instance_id)
+        future = server.delete_instance_in_background(local_id)
+        self._release(instance_id % len(self.servers))
+        return future
+
+    def wait_for_deletions(self) -> None:
+        """Blocks until all background deletions scheduled so far have completed."""
+        _registry.wait_for_deletions()
+
+    def reclaim_instances(self, include_live: bool = False) -> List[int]:
+        """Deletes orphaned instances on all servers, see `PocketICServer.reclaim_instances`.
+
+        Returns:
+            List[int]: the cluster IDs of the deleted instances
+        """
+        reclaimed = []
+        for shard, server in enumerate(self.servers):
+            for local_id in server.reclaim_instances(include_live):
+                self._release(shard)
+                reclaimed.append(local_id * len(self.servers) + shard)
+        return reclaimed
+
+    def instance_url(self, endpoint: str, instance_id: int) -> str:
+        """Returns the URL of an instance endpoint"""
+        server, local_id = self._route(instance_id)
+        return server.instance_url(endpoint, local_id)
+
+    def instance_get(self, endpoint: str, instance_id: int):
+        """HTTP get requests for instance endpoints"""
+        server, local_id = self._route(instance_id)
+        return server.instance_get(endpoint, local_id)
+
+    def instance_post(self, endpoint: str, instance_id: int, body: Optional[dict]):
+        """HTTP post requests for instance endpoints"""
+        server, local_id = self._route(instance_id)
+        return server.instance_post(endpoint, local_id, body)
+
+    def post(self, url: str, body: Optional[dict]):
+        """HTTP post requests for a URL of one of the servers"""
+        for server in self.servers:
+            if url.startswith(server.url + "/"):
+                return server.post(url, body)
+        raise ValueError(f"{url} does not belong to any server of the cluster")
+
+    def set_blob_store_entry(
+        self,
+        blob: bytes,
+        compression: Optional[str],
+        instance_id: Optional[int] = None,
+    ) -> str:
+        """Sets a blob store entry on the server of the given instance.
+
+        Raises:
+            ValueError: if no instance ID is given; blobs are stored per server
+        """
+        if instance_id is None:
+            raise ValueError("The blob store of a cluster requires an instance ID.")
+        server, _ = self._route(instance_id)
+        return server.set_blob_store_entry(blob, compression)
+
+
+class _SharedServer:
+    """
+    The rendezvous of processes sharing one PocketIC server. The rendezvous file
+    `pocket_ic_shared_{name}.json` in the temp directory holds the server's PID and URL
+    and the PIDs of the processes using it; it is only accessed while holding an exclusive
+    lock on `pocket_ic_shared_{name}.lock`. Each process joins at most once per name and
+    leaves at exit.
+    """
+
+    # URL and process ID of the servers joined by this process
+    _joined: Dict[str, Tuple[str, int]] = {}
+    # transports of the joined servers, to check whether a server is alive when leaving
+    _transports: Dict[str, Transport] = {}
+    # servers launched by this process, to reap them after shutting them down
+    _processes: Dict[int, subprocess.Popen] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def join(cls, name: str, transport: Transport) -> Tuple[str, int]:
+        """Joins the shared server `name`, launching it if it is not running.
+
+        Args:
+            name (str): the name of the shared server
+            transport (Transport): the transport to check whether the server is alive with
+
+        Raises:
+            RuntimeError: if the platform has no POSIX file locks
+
+        Returns:
+            Tuple[str, int]: the URL and the process ID of the server
+        """
+        if fcntl is None:
+            raise RuntimeError(
+                "Shared PocketIC servers require POSIX file locks, which this platform does not support."
+            )
+        with cls._lock:
+            if name in cls._joined:
+                return cls._joined[name]
+            with _SharedServer._locked(name) as state:
+                if not cls._server_alive(state, transport):
+                    state.update(cls._launch(name))
+                state["users"] = [
+                    pid for pid in state.get("users", []) if _pid_alive(pid)
+                ] + [os.getpid()]
+            cls._joined[name] = (state["url"], state["server_pid"])
+            cls._transports[name] = transport
+            return cls._joined[name]
+
+    @classmethod
+    def leave(cls, name: str) -> None:
+        """Leaves the shared server `name`; the last process to leave shuts it down. Does
+        nothing if this process has not joined the server."""
+        with cls._lock:
+            if cls._joined.pop(name, None) is None:
+                return
+            transport = cls._transports.pop(name)
+            with _SharedServer._locked(name) as state:
+                state["users"] = [
+                    pid
+                    for pid in state.get("users", [])
+                    if pid != os.getpid() and _pid_alive(pid)
+                ]
+                if not state["users"]:
+                    process = cls._processes.pop(state.get("server_pid"), None)
+                    if process is not None:
+                        process.terminate()
+                        process.wait()
+                    elif cls._server_alive(state, transport):
+                        # Only signal the PID if it still belongs to the server.
+                        os.kill(state["server_pid"], signal.SIGTERM)
+                    state.clear()
+
+    @classmethod
+    def leave_all(cls) -> None:
+        """Leaves all shared servers joined by this process. Registered to run at exit."""
+        for name in list(cls._joined):
+            cls.leave(name)
+
+    @staticmethod
+    def _server_alive(state: dict, transport: Transport) -> bool:
+        """Returns whether the server recorded in the rendezvous state is running."""
+        if not _pid_alive(state.get("server_pid")):
+            return False
+        # The PID may be a zombie or reused by now, so check that the server responds.
+        try:
+            transport.request("GET", f"{state['url']}/instances")
+        except (requests.RequestException, ConnectionError, TimeoutError):
+            return False
+        return True
+
+    @staticmethod
+    def _path(name: str, extension: str) -> str:
+        """Returns the path of a rendezvous file of the shared server `name`."""
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+        return os.path.join(gettempdir(), f"pocket_ic_shared_{name}.{extension}")
+
+    @classmethod
+    def _launch(cls, name: str) -> dict:
+        """Launches the shared server `name` and returns its rendezvous state."""
+        port_file_path = _SharedServer._path(name, "port")
+        if os.path.exists(port_file_path):
+            os.remove(port_file_path)
+        process = PocketICServer._spawn(port_file_path)
+        cls._processes[process.pid] = process
+        return {
+            "server_pid": process.pid,
+            "url": PocketICServer._get_url(port_file_path),
+        }
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _locked(name: str) -> Iterator[dict]:
+        """Holds the lock of the rendezvous file and yields its state, which is written
+        back unless the block raises."""
+        lock_path = _SharedServer._path(name, "lock")
+        state_path = _SharedServer._path(name, "json")
+        with open(lock_path, "a", encoding="utf-8") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(state_path, "r", encoding="utf-8") as f:
+                        state = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    state = {}
+                yield state
+                with open(state_path, "w", encoding="utf-8") as f:
+                    json.dump(state, f)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    """Returns whether a process with the ID exists; it may be a zombie."""
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class RequestMetrics:
+    """Counts the requests sent to a PocketIC server and how long they were delayed."""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        # requests the server accepted, but did not complete right away (status 202)
+        self.accepted = 0
+        # requests retried because the instance was busy (status 409)
+        self.busy = 0
+        # polls of accepted operations
+        self.polls = 0
+        self.timeouts = 0
+        self.waiting_seconds = 0.0
+
+    def __repr__(self) -> str:
+        return f"RequestMetrics(requests={self.requests}, accepted={self.accepted}, busy={self.busy}, polls={self.polls}, timeouts={self.timeouts}, waiting_seconds={self.waiting_seconds:.3f})"
+
+
+class _Backoff:
+    """Exponentially growing delays, starting at `initial` seconds and capped at `maximum`."""
+
+    def __init__(self, initial: float = 0.01, maximum: float = 1.0) -> None:
+        self._delay = initial
+        self._maximum = maximum
+
+    def next(self) -> float:
+        """Returns the next delay in seconds."""
+        delay = self._delay
+        self._delay = min(self._delay * 2, self._maximum)
+        return delay
+
+
+class _InstanceRegistry:
+    """Keeps track of the instances created by this process, across all `PocketICServer`
+    objects, and owns the thread on which instances are deleted in the background."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._servers: Dict[str, PocketICServer] = {}
+        self._instances: Dict[str, Dict[int, Optional[weakref.ref]]] = {}
+        self._pending: set = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def add(self, server: PocketICServer, instance_id: int, owner: Optional[object]):
+        """Records an instance created on `server`, owned by the `PocketIC` object
+        `owner`, if any."""
+        owner_ref = weakref.ref(owner) if owner is not None else None
+        with self._lock:
+            self._servers.setdefault(server.url, server)
+            self._instances.setdefault(server.url, {})[instance_id] = owner_ref
+
+    def remove(self, url: str, instance_id: int):
+        """Forgets an instance that was deleted."""
+        with self._lock:
+            self._instances.get(url, {}).pop(instance_id, None)
+
+    def instances(self, url: str) -> list:
+        """Returns the IDs of the instances on the server at `url`, with a weak reference
+        to their owner or `None`."""
+        with self._lock:
+            return list(self._instances.get(url, {}).items())
+
+    def submit_deletion(self, server: PocketICServer, instance_id: int) -> Future:
+        """Deletes an instance on the background thread; the future completes when the
+        instance is deleted."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="pocket_ic_deletion"
+                )
+            future = self._executor.submit(server.delete_instance, instance_id)
+            self._pending.add(future)
+        future.add_done_callback(self._deletion_done)
+        return future
+
+    def _deletion_done(self, future: Future):
+        """Forgets a completed deletion."""
+        with self._lock:
+            self._pending.discard(future)
+
+    def wait_for_deletions(self):
+        """Waits until all deletions submitted so far have completed."""
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending)
+
+    def sweep(self):
+        """Deletes all instances that are still alive. Registered to run at exit."""
+        self.wait_for_deletions()
+        with self._lock:
+            servers = list(self._servers.values())
+        for server in servers:
+            try:
+                server.reclaim_instances(include_live=True)
+            except (requests.RequestException, ConnectionError, TimeoutError):
+                # The server is already gone, and so are its instances.
+                pass
+
+
+_registry = _InstanceRegistry()
+# Exit handlers run in reverse order: reclaim the instances before leaving shared servers.
+atexit.register(_SharedServer.leave_all)
+atexit.register(_registry.sweep)
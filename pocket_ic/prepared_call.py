@@ -0,0 +1,146 @@
+"""
+This module contains `PreparedCall`, a canister call with all fixed parts of the request
+encoded ahead of time. Use `PocketIC.prepare` to create one.
+"""
+
+from __future__ import annotations
+
+import base64
+from typing import TYPE_CHECKING, Any, List, Optional
+from pocket_ic._lazy import lazy_import
+
+if TYPE_CHECKING:
+    import ic
+    import leb128
+    from pocket_ic.pocket_ic import PocketIC
+else:
+    ic = lazy_import("ic")
+    leb128 = lazy_import("leb128")
+
+
+def candid_header(arg_types: List[Any]) -> bytes:
+    """Encodes the part of a Candid message that only depends on the argument types: the
+    magic number, the type table and the argument types.
+
+    Args:
+        arg_types (List[Any]): the Candid types of the arguments
+
+    Returns:
+        bytes: the header, to be followed by the encoded argument values
+    """
+    table = ic.candid.TypeTable()
+    for arg_type in arg_types:
+        arg_type.buildTypeTable(table)
+    types = b"".join(arg_type.encodeType(table) for arg_type in arg_types)
+    return (
+        ic.candid.prefix.encode()
+        + table.encode()
+        + leb128.u.encode(len(arg_types))
+        + types
+    )
+
+
+class PreparedCall:
+    """
+    A call to a fixed canister method with fixed argument and return types, sender and
+    effective principal. The Candid type table and, for queries, the request body except
+    for the payload are built once, so every call only encodes the argument values.
+
+    Calling the object with the argument values makes the call and returns the decoded
+    result, like `query_raw` and `update_raw` do, or the raw reply if no return types
+    were given.
+
+    Example:
+        transfer = pic.prepare(ledger_id, "icrc1_transfer", [transfer_arg], [transfer_result])
+        for i in range(1_000_000):
+            transfer({"to": ..., "amount": i, ...})
+    """
+
+    def __init__(
+        self,
+        pic: PocketIC,
+        canister_id: Optional[ic.Principal],
+        method: str,
+        arg_types: List[Any],
+        ret_types: Optional[List[Any]] = None,
+        sender: Optional[ic.Principal] = None,
+        query: bool = False,
+        effective_principal: Optional[dict] = None,
+    ) -> None:
+        self.pic = pic
+        self.canister_id = canister_id
+        self.method = method
+        self.arg_types = arg_types
+        self.ret_types = ret_types
+        self.query = query
+        self._header = candid_header(arg_types)
+        canister_id = canister_id if canister_id else ic.Principal.management_canister()
+        sender = sender if sender else pic.sender
+        self._sender = sender
+        self._effective_principal = effective_principal
+        self._body = {
+            "sender": base64.b64encode(sender.bytes).decode(),
+            "effective_principal": (
+                effective_principal if effective_principal else "None"
+            ),
+            "canister_id": base64.b64encode(canister_id.bytes).decode(),
+            "method": method,
+        }
+        self._instance_id = None
+        self._url = ""
+
+    def __repr__(self) -> str:
+        kind = "query" if self.query else "update"
+        return f"PreparedCall({kind} {self.canister_id} {self.method})"
+
+    def encode(self, *args) -> bytes:
+        """Encodes the argument values into a Candid message.
+
+        Raises:
+            ValueError: if the number of arguments does not match the argument types
+            TypeError: if an argument does not match its type
+        """
+        if len(args) != len(self.arg_types):
+            raise ValueError(
+                f"{self.method} expects {len(self.arg_types)} arguments, got {len(args)}"
+            )
+        values = []
+        for arg_type, arg in zip(self.arg_types, args):
+            if not arg_type.covariant(arg):
+                raise TypeError(f"Invalid {arg_type.display()} argument: {arg}")
+            values.append(arg_type.encodeValue(arg))
+        return self._header + b"".join(values)
+
+    def __call__(self, *args) -> Any:
+        """Makes the call with the given argument values.
+
+        Returns:
+            the decoded result, or the raw reply if no return types were given
+        """
+        payload = self.encode(*args)
+        result = self.pic.profiled(
+            self.canister_id, self.method, lambda: self._call(payload)
+        )
+        if self.ret_types is None:
+            return result
+        return self.pic.decode_reply(result, self.ret_types)
+
+    def _call(self, payload: bytes):
+        if not self.query:
+            # An update call takes several requests to execute, so a prebuilt body
+            # saves little.
+            message_id = self.pic.submit_call(
+                self.canister_id,
+                self.method,
+                payload,
+                self._effective_principal,
+                self._sender,
+            )
+            return self.pic.await_call(message_id)
+        # The instance ID changes when the instance is checkpointed.
+        if self._instance_id != self.pic.instance_id:
+            self._url = self.pic.server.instance_url("read/query", self.pic.instance_id)
+            self._instance_id = self.pic.instance_id
+        body = dict(self._body)
+        body["payload"] = base64.b64encode(payload).decode()
+        return self.pic.reply(self.pic.server.post(self._url, body))
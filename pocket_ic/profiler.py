@@ -0,0 +1,120 @@
+"""
+This module contains `CyclesProfiler`, which attributes cycles consumption to the
+canister methods called on a PocketIC instance.
+"""
+
+import atexit
+import json
+import sys
+import threading
+from collections import defaultdict
+from typing import Dict, List, Tuple, Union
+from pocket_ic._stats import percentile
+
+
+class MethodCycles:
+    """The cycles statistics of one method of one canister."""
+
+    def __init__(self, canister_id: str, method: str, samples: List[int]) -> None:
+        self.canister_id = canister_id
+        self.method = method
+        self.calls = len(samples)
+        self.total = sum(samples)
+        self.mean = self.total / self.calls if self.calls else 0
+        self.min = min(samples, default=0)
+        self.max = max(samples, default=0)
+        self.p50 = percentile(samples, 50)
+        self.p90 = percentile(samples, 90)
+        self.p99 = percentile(samples, 99)
+
+    def __repr__(self) -> str:
+        return f"MethodCycles(canister_id={self.canister_id!r}, method={self.method!r}, calls={self.calls}, p50={self.p50}, max={self.max})"
+
+
+class CyclesProfiler:
+    """
+    Collects the cycles consumed by every profiled call, keyed by canister and method.
+
+    Enable it on one or more instances with `PocketIC.enable_cycles_profiling`; every
+    `update_call`, `query_call` and `install_code` then records the difference of the
+    canister's cycles balance before and after the call. Calls to the management canister
+    other than `install_code` are not profiled.
+
+    To make cost regressions fail a test run, compare the results against budgets with
+    `check_budgets`. With `report_at_exit=True`, a report is printed to stderr when the
+    interpreter exits, i.e. at the end of the test session.
+    """
+
+    def __init__(self, report_at_exit: bool = False) -> None:
+        self._samples: Dict[Tuple[str, str], List[int]] = defaultdict(list)
+        self._lock = threading.Lock()
+        if report_at_exit:
+            atexit.register(lambda: print(self.report(), file=sys.stderr))
+
+    def record(self, canister_id: str, method: str, cycles: int) -> None:
+        """Records that a call to `method` of `canister_id` consumed `cycles` cycles."""
+        with self._lock:
+            self._samples[(str(canister_id), method)].append(cycles)
+
+    def reset(self) -> None:
+        """Discards all recorded samples."""
+        with self._lock:
+            self._samples.clear()
+
+    def stats(self) -> List[MethodCycles]:
+        """Returns the statistics of all profiled methods, most expensive first.
+
+        Returns:
+            List[MethodCycles]: the statistics, ordered by total cycles consumed
+        """
+        with self._lock:
+            samples = {key: list(values) for key, values in self._samples.items()}
+        stats = [MethodCycles(c, m, values) for (c, m), values in samples.items()]
+        return sorted(stats, key=lambda s: s.total, reverse=True)
+
+    def report(self) -> str:
+        """Returns a human-readable table of the profiled methods."""
+        header = f"{'canister':<29} {'method':<32} {'calls':>7} {'total':>16} {'p50':>14} {'p90':>14} {'p99':>14} {'max':>14}"
+        lines = ["Cycles profile", header, "-" * len(header)]
+        for s in self.stats():
+            lines.append(
+                f"{s.canister_id:<29} {s.method:<32} {s.calls:>7} {s.total:>16} {s.p50:>14} {s.p90:>14} {s.p99:>14} {s.max:>14}"
+            )
+        return "\n".join(lines)
+
+    def save(self, path: str) -> None:
+        """Writes the statistics to a JSON file, e.g. to be archived by CI.
+
+        Args:
+            path (str): the path of the file
+        """
+        stats = [vars(s) for s in self.stats()]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(stats, f, indent=2)
+
+    def check_budgets(
+        self, budgets: Dict[Union[str, Tuple[str, str]], int], p: float = 50
+    ) -> None:
+        """Checks the cycles consumption of methods against budgets.
+
+        Args:
+            budgets (dict): maps method names, or `(canister_id, method)` tuples, to the
+                maximum number of cycles a call may consume
+            p (float, optional): the percentile to compare against the budget, defaults to 50
+
+        Raises:
+            AssertionError: listing all methods whose cycles consumption exceeds its budget
+        """
+        violations = []
+        for s in self.stats():
+            budget = budgets.get((s.canister_id, s.method), budgets.get(s.method))
+            if budget is None:
+                continue
+            with self._lock:
+                actual = percentile(self._samples[(s.canister_id, s.method)], p)
+            if actual > budget:
+                violations.append(
+                    f"{s.canister_id} {s.method}: p{p:g} {actual} cycles exceeds the budget of {budget}"
+                )
+        if violations:
+            raise AssertionError("Cycles budget exceeded:\n" + "\n".join(violations))
@@ -0,0 +1,84 @@
+"""
+This module contains `QueryCache`, which serves repeated query calls to a PocketIC
+instance locally until the state of the instance changes. Use
+`PocketIC.enable_query_cache` to enable it.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+
+class QueryCache:
+    """
+    A least-recently-used cache of query results of one PocketIC instance.
+
+    Results are keyed by canister, method, payload and sender. The whole cache is
+    invalidated whenever the state of the instance may change, i.e. by every request to
+    an `update/` endpoint of the instance: ticks, update calls, code installs, setting the
+    time or stable memory, and adding cycles. A query that was sent before an
+    invalidation is not cached when its result arrives afterwards, so results are never
+    older than the last state change.
+    """
+
+    def __init__(self, max_entries: int = 1024) -> None:
+        """
+        Args:
+            max_entries (int, optional): the number of results to keep, defaults to 1024
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self) -> str:
+        return (
+            f"QueryCache(entries={len(self)}, hits={self.hits}, misses={self.misses}, "
+            f"invalidations={self.invalidations})"
+        )
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of lookups served from the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key: Hashable) -> Tuple[Optional[Any], int]:
+        """Looks up a result.
+
+        Returns:
+            Tuple[Optional[Any], int]: the result or `None`, and the generation of the
+                cache, to be passed to `put`
+        """
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return result, self._generation
+
+    def put(self, key: Hashable, result: Any, generation: int) -> None:
+        """Stores a result obtained after the lookup that returned `generation`, unless
+        the cache has been invalidated since."""
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """Discards all results."""
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._entries.clear()
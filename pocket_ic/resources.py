@@ -0,0 +1,238 @@
+"""
+This module contains `ResourceSampler`, which samples the memory, CPU time and thread
+count of a PocketIC server process from `/proc` and attributes the changes to scopes,
+such as tests or instance lifetimes. Use `PocketICServer.enable_resource_sampling` to
+sample the server launched by the current process.
+"""
+
+import atexit
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+
+class ResourceSample:
+    """The resource usage of a process at one point in time."""
+
+    def __init__(
+        self, timestamp: float, rss_bytes: int, cpu_seconds: float, threads: int
+    ) -> None:
+        self.timestamp = timestamp
+        self.rss_bytes = rss_bytes
+        self.cpu_seconds = cpu_seconds
+        self.threads = threads
+
+    def __repr__(self) -> str:
+        return f"ResourceSample(rss_bytes={self.rss_bytes}, cpu_seconds={self.cpu_seconds:.2f}, threads={self.threads})"
+
+
+def read_sample(pid: int) -> ResourceSample:
+    """Reads the resource usage of a process from `/proc/<pid>/stat`.
+
+    Args:
+        pid (int): the process ID
+
+    Raises:
+        OSError: if the process does not exist or has exited, or `/proc` is not available
+
+    Returns:
+        ResourceSample: the current resource usage
+    """
+    with open(f"/proc/{pid}/stat", encoding="utf-8") as stat_file:
+        stat = stat_file.read()
+    # The command name in parentheses may contain spaces; the fields after it start
+    # with the state, field 3 in proc(5).
+    fields = stat[stat.rindex(")") + 2 :].split()
+    if fields[0] in ("Z", "X"):
+        raise ProcessLookupError(f"Process {pid} has exited")
+    ticks = os.sysconf("SC_CLK_TCK")
+    return ResourceSample(
+        time.monotonic(),
+        rss_bytes=int(fields[21]) * os.sysconf("SC_PAGE_SIZE"),
+        cpu_seconds=(int(fields[11]) + int(fields[12])) / ticks,
+        threads=int(fields[17]),
+    )
+
+
+class ScopeUsage:
+    """The resource usage of a process during a scope, e.g. a test."""
+
+    def __init__(self, name: str, start: ResourceSample) -> None:
+        self.name = name
+        self.start = start
+        self.end: Optional[ResourceSample] = None
+        self.peak_rss_bytes = start.rss_bytes
+
+    @property
+    def rss_growth(self) -> int:
+        """The growth of the resident memory from the start to the end of the scope."""
+        return self.end.rss_bytes - self.start.rss_bytes if self.end else 0
+
+    @property
+    def cpu_seconds(self) -> float:
+        """The CPU time spent by the process during the scope."""
+        return self.end.cpu_seconds - self.start.cpu_seconds if self.end else 0.0
+
+    @property
+    def thread_growth(self) -> int:
+        """The change of the thread count from the start to the end of the scope."""
+        return self.end.threads - self.start.threads if self.end else 0
+
+    def __repr__(self) -> str:
+        return f"ScopeUsage(name={self.name!r}, rss_growth={self.rss_growth}, cpu_seconds={self.cpu_seconds:.2f})"
+
+
+class ResourceSampler:
+    """
+    Samples the resource usage of a process every `interval` seconds on a background
+    thread, and attributes it to scopes.
+
+    A scope is opened with `begin` and closed with `end`, or used as a context manager
+    with `scope`; scopes may overlap. Each scope records the usage at its start and end
+    and the peak memory sampled while it was open. `top_growth` and `report` list the
+    scopes with the largest memory growth, e.g. to find the tests that leak memory on
+    the server. With `report_at_exit=True`, the report is printed to stderr when the
+    interpreter exits, i.e. at the end of the test session.
+    """
+
+    def __init__(
+        self, pid: int, interval: float = 1.0, report_at_exit: bool = False
+    ) -> None:
+        """
+        Args:
+            pid (int): the ID of the process to sample
+            interval (float, optional): the seconds between samples, defaults to 1
+            report_at_exit (bool, optional): whether to print the report at exit,
+                defaults to `False`
+        """
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[ResourceSample] = []
+        self.error: Optional[OSError] = None
+        self._open: List[ScopeUsage] = []
+        self._closed: List[ScopeUsage] = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if report_at_exit:
+            atexit.register(lambda: print(self.report(), file=sys.stderr))
+
+    def start(self) -> None:
+        """Starts sampling in the background. Calling this method while sampling has no
+        effect."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="pocket-ic-resource-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops sampling in the background."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def sample(self) -> ResourceSample:
+        """Takes a sample now and records it.
+
+        Raises:
+            OSError: if the process cannot be sampled, e.g. because it has exited
+        """
+        sample = read_sample(self.pid)
+        with self._lock:
+            self.samples.append(sample)
+            for usage in self._open:
+                usage.peak_rss_bytes = max(usage.peak_rss_bytes, sample.rss_bytes)
+        return sample
+
+    def begin(self, name: str) -> ScopeUsage:
+        """Opens a scope.
+
+        Args:
+            name (str): the name of the scope, e.g. the ID of a test
+
+        Returns:
+            ScopeUsage: the scope, to be passed to `end`
+        """
+        usage = ScopeUsage(name, self.sample())
+        with self._lock:
+            self._open.append(usage)
+        return usage
+
+    def end(self, usage: ScopeUsage) -> None:
+        """Closes a scope opened with `begin`. If the process has exited, the scope ends
+        with the last sample taken."""
+        try:
+            sample = self.sample()
+        except OSError:
+            sample = self.samples[-1]
+        with self._lock:
+            if usage not in self._open:
+                return
+            self._open.remove(usage)
+            usage.end = sample
+            self._closed.append(usage)
+
+    @contextmanager
+    def scope(self, name: str) -> Iterator[ScopeUsage]:
+        """Opens a scope for the `with` block; see `begin`."""
+        usage = self.begin(name)
+        try:
+            yield usage
+        finally:
+            self.end(usage)
+
+    def top_growth(self, n: int = 10) -> List[ScopeUsage]:
+        """Returns the closed scopes with the largest memory growth, largest first.
+
+        Args:
+            n (int, optional): the number of scopes, defaults to 10
+        """
+        with self._lock:
+            closed = list(self._closed)
+        return sorted(closed, key=lambda usage: usage.rss_growth, reverse=True)[:n]
+
+    def report(self, n: int = 10) -> str:
+        """Returns a human-readable summary of the samples and the scopes with the largest
+        memory growth."""
+        with self._lock:
+            samples = list(self.samples)
+        lines = [f"Resource usage of process {self.pid}"]
+        if self.error is not None:
+            lines.append(f"sampling stopped: {self.error}")
+        if samples:
+            first, last = samples[0], samples[-1]
+            peak = max(sample.rss_bytes for sample in samples)
+            lines.append(
+                f"rss {_mib(first.rss_bytes)} -> {_mib(last.rss_bytes)} (peak {_mib(peak)}), "
+                f"cpu {last.cpu_seconds - first.cpu_seconds:.2f}s, "
+                f"threads {first.threads} -> {last.threads}, {len(samples)} samples"
+            )
+        header = f"{'scope':<60} {'rss growth':>12} {'peak rss':>12} {'cpu':>9} {'threads':>8}"
+        lines += [header, "-" * len(header)]
+        for usage in self.top_growth(n):
+            lines.append(
+                f"{usage.name[-60:]:<60} {_mib(usage.rss_growth):>12} {_mib(usage.peak_rss_bytes):>12} "
+                f"{usage.cpu_seconds:>8.2f}s {usage.thread_growth:>+8}"
+            )
+        return "\n".join(lines)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.sample()
+            except OSError as e:
+                # The process has exited; keep the samples taken so far.
+                self.error = e
+                return
+            self._stopped.wait(self.interval)
+
+
+def _mib(size: int) -> str:
+    return f"{size / (1 << 20):.1f} MiB"
@@ -0,0 +1,153 @@
+"""
+This module contains `StableMemorySnapshot` and `StableMemoryDiff`, which represent the
+stable memory of a canister as hashed pages, so that changes can be detected and
+reverted page by page.
+"""
+
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+WASM_PAGE_SIZE = 64 * 1024
+
+
+def _hash(page: bytes) -> bytes:
+    return hashlib.blake2b(page, digest_size=16).digest()
+
+
+class StableMemoryDiff:
+    """The pages in which two versions of a stable memory differ."""
+
+    def __init__(
+        self, changed_pages: List[int], page_size: int, old_size: int, new_size: int
+    ) -> None:
+        self.changed_pages = changed_pages
+        self.page_size = page_size
+        self.old_size = old_size
+        self.new_size = new_size
+
+    def __bool__(self) -> bool:
+        return bool(self.changed_pages) or self.old_size != self.new_size
+
+    def __repr__(self) -> str:
+        return f"StableMemoryDiff(changed_pages={self.changed_pages}, old_size={self.old_size}, new_size={self.new_size})"
+
+    def regions(self) -> List[Tuple[int, int]]:
+        """Returns the changed byte ranges as `(offset, length)` tuples, with adjacent
+        pages merged into one range."""
+        regions: List[Tuple[int, int]] = []
+        for page in self.changed_pages:
+            offset = page * self.page_size
+            if regions and regions[-1][0] + regions[-1][1] == offset:
+                regions[-1] = (regions[-1][0], regions[-1][1] + self.page_size)
+            else:
+                regions.append((offset, self.page_size))
+        return regions
+
+
+class StableMemorySnapshot:
+    """
+    A snapshot of a canister's stable memory, stored as one hash per page of `page_size`
+    bytes.
+
+    To be able to restore a snapshot, its pages must be kept (`keep_pages=True`). Pages
+    that only contain zeros are never stored. If a `base` snapshot is given, only the pages
+    that differ from the base are stored and all other pages are looked up in the base, so
+    a series of snapshots of a mostly unchanged memory stays small.
+    """
+
+    def __init__(
+        self,
+        data: bytes,
+        page_size: int = WASM_PAGE_SIZE,
+        keep_pages: bool = False,
+        base: Optional["StableMemorySnapshot"] = None,
+    ) -> None:
+        """Creates a snapshot of the given stable memory contents.
+
+        Args:
+            data (bytes): the stable memory
+            page_size (int, optional): the page size in bytes, defaults to the wasm page size
+            keep_pages (bool, optional): whether to store the page contents, defaults to `False`
+            base (Optional[StableMemorySnapshot], optional): a snapshot with pages, to store
+                only the pages that differ from it, defaults to `None`
+
+        Raises:
+            ValueError: if the base snapshot has a different page size or no pages
+        """
+        if base is not None and (base.page_size != page_size or not base.has_pages):
+            raise ValueError(
+                "The base snapshot must have the same page size and pages."
+            )
+        self.page_size = page_size
+        self.size = len(data)
+        self.has_pages = keep_pages
+        self.base = base if keep_pages else None
+        self.hashes: List[bytes] = []
+        self._pages: Dict[int, bytes] = {}
+        zero_hash = _hash(bytes(page_size))
+        view = memoryview(data)
+        for index, offset in enumerate(range(0, len(data), page_size)):
+            page = bytes(view[offset : offset + page_size])
+            page_hash = _hash(page)
+            self.hashes.append(page_hash)
+            if not keep_pages or page_hash == zero_hash:
+                continue
+            if base is not None and base._hash_at(index) == page_hash:
+                continue
+            self._pages[index] = page
+
+    def _hash_at(self, index: int) -> Optional[bytes]:
+        return self.hashes[index] if index < len(self.hashes) else None
+
+    def page(self, index: int) -> bytes:
+        """Returns the contents of a page.
+
+        Raises:
+            ValueError: if the snapshot does not keep its pages
+        """
+        if not self.has_pages:
+            raise ValueError("The snapshot was taken without keeping its pages.")
+        if index in self._pages:
+            return self._pages[index]
+        if self.base is not None and self.base._hash_at(index) == self.hashes[index]:
+            return self.base.page(index)
+        offset = index * self.page_size
+        return bytes(min(self.page_size, self.size - offset))
+
+    def stored_bytes(self) -> int:
+        """Returns the number of bytes of page contents stored by this snapshot itself."""
+        return sum(len(page) for page in self._pages.values())
+
+    def diff(self, other: "StableMemorySnapshot") -> StableMemoryDiff:
+        """Returns the pages in which `other` differs from this snapshot.
+
+        Raises:
+            ValueError: if the snapshots have different page sizes
+        """
+        if other.page_size != self.page_size:
+            raise ValueError("Cannot compare snapshots with different page sizes.")
+        changed = [
+            index
+            for index in range(max(len(self.hashes), len(other.hashes)))
+            if self._hash_at(index) != other._hash_at(index)
+        ]
+        return StableMemoryDiff(changed, self.page_size, self.size, other.size)
+
+    def patch(self, data: bytes, diff: Optional[StableMemoryDiff] = None) -> bytes:
+        """Returns `data` with the pages that differ from this snapshot replaced by the
+        snapshot's pages, truncated or extended to the snapshot's size.
+
+        Args:
+            data (bytes): the current stable memory
+            diff (Optional[StableMemoryDiff], optional): the diff between this snapshot and
+                `data`, if already known, defaults to `None`
+        """
+        if diff is None:
+            diff = self.diff(StableMemorySnapshot(data, self.page_size))
+        patched = bytearray(data[: self.size].ljust(self.size, b"\x00"))
+        for index in diff.changed_pages:
+            if index < len(self.hashes):
+                offset = index * self.page_size
+                page = self.page(index)
+                patched[offset : offset + len(page)] = page
+        return bytes(patched)
@@ -1,6 +1,6 @@
 """
-This module contains `SubnetConfig` and `SubnetKind`, which are used to configure the
-subnets of a PocketIC instance.
+This module contains `SubnetConfig`, `SubnetKind` and `InstructionConfig`, which are used
+to configure the subnets of a PocketIC instance.
 """
 
 from enum import Enum
@@ -20,6 +20,17 @@ class SubnetKind(Enum):
     VERIFIED_APPLICATION = "VerifiedApplication"
 
 
+class InstructionConfig(Enum):
+    """The instruction limits of a subnet.
+
+    `BENCHMARKING` raises the instruction limits far above the production limits, so that
+    heavy canister workloads can be measured without hitting them.
+    """
+
+    PRODUCTION = "Production"
+    BENCHMARKING = "Benchmarking"
+
+
 class SubnetConfig:
     """The configuration of subnets for a PocketIC instance.
 
@@ -27,6 +38,10 @@ class SubnetConfig:
         Use `state_dir=<empty_dir>` to store the state of the subnets in a given directory.
         This directory can be used later with `state_dir=<dir>` to load a previous state.
         Note that the provided path must be accessible for the PocketIC server process.
+
+    `instruction_config`:
+        The instruction limits of the subnets created by the constructor. Use `add_subnet`
+        to configure the instruction limits of individual subnets.
     """
 
     def __init__(
@@ -40,8 +55,9 @@ class SubnetConfig:
         system=0,
         verified_application=0,
         state_dir: str | None = None,
+        instruction_config: InstructionConfig = InstructionConfig.PRODUCTION,
     ) -> None:
-        new = {"state_config": "New", "instruction_config": "Production"}
+        new = {"state_config": "New", "instruction_config": instruction_config.value}
         self.application = [new] * application
         self.bitcoin = new if bitcoin else None
         self.fiduciary = new if fiduciary else None
@@ -76,7 +92,30 @@ class SubnetConfig:
                 "At least one subnet or a non-empty state directory must be configured."
             )
 
-    def add_subnet_with_state(self, subnet_type: SubnetKind, state_dir_path: str):
+    def add_subnet(
+        self,
+        subnet_type: SubnetKind,
+        instruction_config: InstructionConfig = InstructionConfig.PRODUCTION,
+    ):
+        """Add a single new subnet with the given instruction limits. For the subnet kinds
+        that can only exist once, this replaces the previously configured subnet.
+
+        Args:
+            subnet_type (SubnetKind): the kind of the subnet
+            instruction_config (InstructionConfig, optional): the instruction limits of the
+                subnet, defaults to `InstructionConfig.PRODUCTION`
+        """
+        self._add(
+            subnet_type,
+            {"state_config": "New", "instruction_config": instruction_config.value},
+        )
+
+    def add_subnet_with_state(
+        self,
+        subnet_type: SubnetKind,
+        state_dir_path: str,
+        instruction_config: InstructionConfig = InstructionConfig.PRODUCTION,
+    ):
         """Add a single subnet with state loaded form the given state directory.
         Note that the provided path must be accessible for the PocketIC server process.
 
@@ -96,26 +135,28 @@ class SubnetConfig:
 
         new_from_path = {
             "state_config": {"FromPath": state_dir_path},
-            "instruction_config": "Production",
+            "instruction_config": instruction_config.value,
         }
+        self._add(subnet_type, new_from_path)
 
+    def _add(self, subnet_type: SubnetKind, spec: dict):
         match subnet_type:
             case SubnetKind.APPLICATION:
-                self.application.append(new_from_path)
+                self.application.append(spec)
             case SubnetKind.BITCOIN:
-                self.bitcoin = new_from_path
+                self.bitcoin = spec
             case SubnetKind.FIDUCIARY:
-                self.fiduciary = new_from_path
+                self.fiduciary = spec
             case SubnetKind.II:
-                self.ii = new_from_path
+                self.ii = spec
             case SubnetKind.NNS:
-                self.nns = new_from_path
+                self.nns = spec
             case SubnetKind.SNS:
-                self.sns = new_from_path
+                self.sns = spec
             case SubnetKind.SYSTEM:
-                self.system.append(new_from_path)
+                self.system.append(spec)
             case SubnetKind.VERIFIED_APPLICATION:
-                self.verified_application.append(new_from_path)
+                self.verified_application.append(spec)
 
     def _json(self) -> dict:
         return {
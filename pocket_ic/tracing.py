@@ -0,0 +1,185 @@
+"""
+This module contains an opt-in tracer that records the activity of `PocketIC` objects
+as Chrome trace events, which can be opened in chrome://tracing or https://ui.perfetto.dev.
+
+Start tracing with `start_tracing()` and write the trace with `stop_tracing(path)`, or set
+the POCKET_IC_TRACE environment variable to a file path to trace the whole process and
+write the trace at exit. Every HTTP request to the server is recorded as a span, and so
+are the main `PocketIC` calls, `update_call`, `query_call`, `install_code` and `tick`,
+with the requests, polls, Candid encoding and decoding, and compression they perform
+nested inside. Spans carry the instance ID, canister and method where applicable, and the
+number of rounds ticked while they were open.
+"""
+
+import atexit
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+
+class Tracer:
+    """Collects spans as Chrome trace events."""
+
+    def __init__(self) -> None:
+        self._events: List[dict] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._threads: Dict[int, str] = {}
+        self._pid = os.getpid()
+
+    def _open_spans(self) -> list:
+        spans = getattr(self._local, "spans", None)
+        if spans is None:
+            spans = self._local.spans = []
+        return spans
+
+    @contextmanager
+    def span(self, name: str, category: str = "api", **args) -> Iterator[dict]:
+        """Records a span around the `with` block. The yielded dict holds the arguments of
+        the span and can be extended inside the block."""
+        thread = threading.current_thread()
+        spans = self._open_spans()
+        spans.append(args)
+        start = time.perf_counter_ns()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter_ns()
+            spans.pop()
+            event = {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start / 1000,
+                "dur": (end - start) / 1000,
+                "pid": self._pid,
+                "tid": thread.ident,
+                "args": args,
+            }
+            with self._lock:
+                self._events.append(event)
+                self._threads.setdefault(thread.ident, thread.name)
+
+    def count(self, key: str, amount: int = 1) -> None:
+        """Adds `amount` to the counter `key` of all spans open on the current thread."""
+        for args in self._open_spans():
+            args[key] = args.get(key, 0) + amount
+
+    def to_json(self) -> dict:
+        """Returns the trace in the Chrome trace event format."""
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        metadata = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": self._pid,
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for tid, name in threads.items()
+        ]
+        return {"traceEvents": metadata + events, "displayTimeUnit": "ms"}
+
+    def save(self, path: str) -> None:
+        """Writes the trace to a JSON file.
+
+        Args:
+            path (str): the path of the file
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f)
+
+
+class _Active:
+    """Holds the tracer that records spans, or `None` while tracing is disabled."""
+
+    tracer: Optional[Tracer] = None
+
+
+_active = _Active()
+
+
+def start_tracing(tracer: Optional[Tracer] = None) -> Tracer:
+    """Starts recording spans.
+
+    Args:
+        tracer (Optional[Tracer], optional): the tracer to record to, defaults to a new one
+
+    Returns:
+        Tracer: the active tracer
+    """
+    _active.tracer = tracer if tracer else Tracer()
+    return _active.tracer
+
+
+def stop_tracing(path: Optional[str] = None) -> Optional[Tracer]:
+    """Stops recording spans.
+
+    Args:
+        path (Optional[str], optional): the file to write the trace to, defaults to `None`
+
+    Returns:
+        Optional[Tracer]: the tracer that was active, if any
+    """
+    tracer, _active.tracer = _active.tracer, None
+    if tracer is not None and path:
+        tracer.save(path)
+    return tracer
+
+
+def active_tracer() -> Optional[Tracer]:
+    """Returns the active tracer, or `None` if tracing is disabled."""
+    return _active.tracer
+
+
+@contextmanager
+def span(name: str, category: str = "api", **args) -> Iterator[dict]:
+    """Records a span with the active tracer, if any; see `Tracer.span`."""
+    tracer = _active.tracer
+    if tracer is None:
+        yield args
+        return
+    with tracer.span(name, category, **args) as span_args:
+        yield span_args
+
+
+def count(key: str, amount: int = 1) -> None:
+    """Adds to a counter of the open spans with the active tracer, if any."""
+    tracer = _active.tracer
+    if tracer is not None:
+        tracer.count(key, amount)
+
+
+def traced(func: Callable) -> Callable:
+    """Decorates a `PocketIC` method to record a span for every call while tracing, with
+    the instance ID and the `canister_id` and `method` arguments of the call."""
+    signature = inspect.signature(func)
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        tracer = _active.tracer
+        if tracer is None:
+            return func(self, *args, **kwargs)
+        bound = signature.bind(self, *args, **kwargs).arguments
+        span_args = {"instance_id": getattr(self, "instance_id", None)}
+        if bound.get("canister_id") is not None:
+            span_args["canister_id"] = str(bound["canister_id"])
+        if "method" in bound:
+            span_args["method"] = bound["method"]
+        with tracer.span(name, **span_args):
+            return func(self, *args, **kwargs)
+
+    return wrapper
+
+
+if os.environ.get("POCKET_IC_TRACE"):
+    start_tracing()
+    atexit.register(stop_tracing, os.environ["POCKET_IC_TRACE"])
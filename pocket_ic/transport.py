@@ -0,0 +1,331 @@
+"""
+This module contains the HTTP transports that a `PocketICServer` sends its requests
+with: `RequestsTransport`, the default, and `HttpxTransport`, which can use HTTP/2.
+Both keep a pool of keep-alive connections and retry requests that fail at the
+connection level according to a `RetryPolicy`.
+"""
+
+import time
+from abc import ABC, abstractmethod
+from typing import Any, FrozenSet, Iterable, Optional, Protocol
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+
+class Response(Protocol):
+    """The part of an HTTP response that `PocketICServer` uses."""
+
+    status_code: int
+    text: str
+
+    def json(self) -> Any:
+        """Returns the body decoded as JSON.
+
+        Raises:
+            ValueError: if the body is not valid JSON
+        """
+
+
+class RetryPolicy:
+    """
+    Which requests to send again when they fail at the connection level, e.g. because
+    the server closed a keep-alive connection or is restarting.
+
+    A request that failed before it was sent, e.g. when connecting, is always retried.
+    A request that may have reached the server is only retried if its method is in
+    `methods`, because the server may already have executed it. By default these are the
+    idempotent HTTP methods, which excludes the POST requests that change the state of
+    an instance. Responses with an error status are never retried by the transport.
+    """
+
+    IDEMPOTENT_METHODS: FrozenSet[str] = frozenset(
+        {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+    )
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        backoff: float = 0.05,
+        methods: Iterable[str] = IDEMPOTENT_METHODS,
+    ) -> None:
+        """
+        Args:
+            attempts (int, optional): the number of times a request is sent at most;
+                1 disables retries, defaults to 3
+            backoff (float, optional): the seconds to wait before the first retry, doubled
+                for every further retry, defaults to 0.05
+            methods (Iterable[str], optional): the methods that are retried after the
+                request may have been sent, defaults to `IDEMPOTENT_METHODS`
+
+        Raises:
+            ValueError: if `attempts` is less than 1
+        """
+        if attempts < 1:
+            raise ValueError("A request must be attempted at least once.")
+        self.attempts = attempts
+        self.backoff = backoff
+        self.methods = frozenset(method.upper() for method in methods)
+
+    def __repr__(self) -> str:
+        return f"RetryPolicy(attempts={self.attempts}, backoff={self.backoff}, methods={sorted(self.methods)})"
+
+    def allows(self, method: str, attempt: int, sent: bool) -> bool:
+        """Returns whether to retry a request whose `attempt`-th attempt failed."""
+        return attempt < self.attempts and (not sent or method in self.methods)
+
+    def delay(self, attempt: int) -> float:
+        """Returns the seconds to wait after the `attempt`-th attempt failed."""
+        return self.backoff * 2 ** (attempt - 1)
+
+
+class Transport(ABC):
+    """
+    Sends HTTP requests to PocketIC servers over a pool of keep-alive connections.
+
+    Subclasses implement `_send`, `_sent` and optionally `_translate` for their HTTP
+    library; this class retries failed requests according to the retry policy. One
+    transport can be shared by several servers and threads.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 16,
+        connect_timeout: Optional[float] = 10.0,
+        read_timeout: Optional[float] = 120.0,
+        retry_policy: Optional[RetryPolicy] = None,
+        max_servers: int = 64,
+    ) -> None:
+        """
+        Args:
+            pool_size (int, optional): the number of connections kept open per server,
+                i.e. the number of threads that can send requests concurrently without
+                opening new connections, defaults to 16
+            connect_timeout (Optional[float], optional): the seconds to wait for a
+                connection, or `None` to wait forever, defaults to 10
+            read_timeout (Optional[float], optional): the seconds to wait for the server
+                to respond, or `None` to wait forever, defaults to 120. Requests that take
+                long are answered early by the server and polled by `PocketICServer`.
+            retry_policy (Optional[RetryPolicy], optional): which failed requests to
+                retry, defaults to `RetryPolicy()`
+            max_servers (int, optional): the number of servers, e.g. of a
+                `PocketICServerCluster` sharing the transport, for which connections are
+                kept open, defaults to 64
+        """
+        self.pool_size = pool_size
+        self.max_servers = max_servers
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retry_policy = retry_policy if retry_policy else RetryPolicy()
+        self.retries = 0
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        json: Optional[Any] = None,
+        data: Optional[bytes] = None,
+        headers: Optional[dict] = None,
+    ) -> Response:
+        """Sends a request, retrying it if it fails at the connection level and the retry
+        policy allows it.
+
+        A request that failed before it left, i.e. for which `_sent` returns `False`, e.g.
+        because the connection was refused, is retried for any method. A request that may
+        have reached the server is only retried if its method is in the policy's
+        `methods`. POST requests are not by default, so a POST that fails because the
+        server closed a stale keep-alive connection is never retried: the server may have
+        executed it before closing the connection. Responses are never retried, whatever
+        their status code. At most `retry_policy.attempts` attempts are made, waiting
+        `retry_policy.delay` seconds between them.
+
+        Args:
+            method (str): the HTTP method
+            url (str): the URL
+            json (Optional[Any], optional): a body to send as JSON, defaults to `None`
+            data (Optional[bytes], optional): a raw body, defaults to `None`
+            headers (Optional[dict], optional): additional headers, defaults to `None`
+
+        Raises:
+            OSError: if the request failed at the connection level or timed out, see the
+                subclasses for the exact types
+
+        Returns:
+            Response: the response, with any status code
+        """
+        method = method.upper()
+        attempt = 1
+        while True:
+            try:
+                return self._send(method, url, json, data, headers)
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                sent = self._sent(error)
+                if sent is None:
+                    raise
+                if not self.retry_policy.allows(method, attempt, sent):
+                    translated = self._translate(error)
+                    if translated is error:
+                        raise
+                    raise translated from error
+                self.retries += 1
+                time.sleep(self.retry_policy.delay(attempt))
+                attempt += 1
+
+    def close(self) -> None:
+        """Closes all pooled connections."""
+
+    @abstractmethod
+    def _send(
+        self,
+        method: str,
+        url: str,
+        json: Optional[Any],
+        data: Optional[bytes],
+        headers: Optional[dict],
+    ) -> Response:
+        """Sends a request once."""
+
+    @abstractmethod
+    def _sent(self, error: Exception) -> Optional[bool]:
+        """Returns `None` if `error` is not a connection-level failure, and otherwise
+        whether the request may have reached the server."""
+
+    def _translate(self, error: Exception) -> Exception:
+        """Returns the exception to raise for a connection-level failure."""
+        return error
+
+
+class RequestsTransport(Transport):
+    """
+    A transport based on a `requests.Session`. The errors it raises are those of
+    `requests`, which derive from `OSError`.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 16,
+        connect_timeout: Optional[float] = 10.0,
+        read_timeout: Optional[float] = 120.0,
+        retry_policy: Optional[RetryPolicy] = None,
+        max_servers: int = 64,
+    ) -> None:
+        """See `Transport`."""
+        super().__init__(
+            pool_size, connect_timeout, read_timeout, retry_policy, max_servers
+        )
+        self.session = requests.Session()
+        # Retries are done by `Transport.request`, so that both transports behave alike.
+        adapter = HTTPAdapter(
+            pool_connections=max_servers, pool_maxsize=pool_size, max_retries=0
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __repr__(self) -> str:
+        return f"RequestsTransport(pool_size={self.pool_size}, retry_policy={self.retry_policy})"
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _send(self, method, url, json, data, headers) -> Response:
+        return self.session.request(
+            method,
+            url,
+            json=json,
+            data=data,
+            headers=headers,
+            timeout=(self.connect_timeout, self.read_timeout),
+        )
+
+    def _sent(self, error: Exception) -> Optional[bool]:
+        if isinstance(error, requests.ConnectTimeout):
+            return False
+        if isinstance(error, requests.ConnectionError):
+            reason = getattr(error.args[0], "reason", None) if error.args else None
+            return not isinstance(reason, NewConnectionError)
+        if isinstance(error, requests.Timeout):
+            return True
+        return None
+
+
+class HttpxTransport(Transport):
+    """
+    A transport based on an `httpx.Client`, optionally using HTTP/2. With HTTP/2, all
+    threads multiplex their requests over a single connection per server. The errors it
+    raises are the built-in `ConnectionError` and `TimeoutError`.
+
+    HTTP/2 requires httpx with HTTP/2 support, e.g. `pip install pocket_ic[http2]`. Since PocketIC
+    servers usually listen without TLS, HTTP/2 is then used with prior knowledge, which
+    the server must support; HTTP/1.1 is not offered.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 16,
+        connect_timeout: Optional[float] = 10.0,
+        read_timeout: Optional[float] = 120.0,
+        retry_policy: Optional[RetryPolicy] = None,
+        max_servers: int = 64,
+        http2: bool = False,
+    ) -> None:
+        """See `Transport`.
+
+        Args:
+            http2 (bool, optional): whether to use HTTP/2, defaults to `False`
+
+        Raises:
+            ImportError: if httpx, or h2 for HTTP/2, is not installed
+        """
+        super().__init__(
+            pool_size, connect_timeout, read_timeout, retry_policy, max_servers
+        )
+        try:
+            # httpx is an optional dependency, only imported when the transport is used.
+            import httpx  # pylint: disable=import-outside-toplevel
+        except ImportError as error:
+            raise ImportError(
+                "HttpxTransport requires httpx, install it with `pip install pocket_ic[http2]`."
+            ) from error
+        self._httpx = httpx
+        self.http2 = http2
+        try:
+            self.client = httpx.Client(
+                http1=not http2,
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=None,
+                    max_keepalive_connections=pool_size * max_servers,
+                ),
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            )
+        except ImportError as error:
+            raise ImportError(
+                "HTTP/2 requires h2, install it with `pip install pocket_ic[http2]`."
+            ) from error
+
+    def __repr__(self) -> str:
+        return f"HttpxTransport(pool_size={self.pool_size}, http2={self.http2}, retry_policy={self.retry_policy})"
+
+    def close(self) -> None:
+        self.client.close()
+
+    def _send(self, method, url, json, data, headers) -> Response:
+        return self.client.request(
+            method, url, json=json, content=data, headers=headers
+        )
+
+    def _sent(self, error: Exception) -> Optional[bool]:
+        httpx = self._httpx
+        if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)):
+            return False
+        if isinstance(error, httpx.PoolTimeout):
+            return False
+        if isinstance(error, httpx.TransportError):
+            return True
+        return None
+
+    def _translate(self, error: Exception) -> Exception:
+        if isinstance(error, self._httpx.TimeoutException):
+            return TimeoutError(f"PocketIC server did not respond in time: {error}")
+        return ConnectionError(f"Could not reach the PocketIC server: {error}")
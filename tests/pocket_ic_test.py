@@ -2,20 +2,97 @@
 
 import sys
 import os
+import subprocess
 import tempfile
 import unittest
+import unittest.mock
 import ic
 import gzip
 import json
 import shutil
+import socket
+import requests
 
 # The test needs to have the module in its sys path, so we traverse
 # up until we find the pocket_ic package.
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from pocket_ic import PocketIC, SubnetKind, SubnetConfig
+from pocket_ic import (
+    PocketIC,
+    PocketICServer,
+    PocketICServerCluster,
+    SubnetKind,
+    SubnetConfig,
+    InstructionConfig,
+    InstallMode,
+    UpgradeOptions,
+)
+from pocket_ic.auto_progress import AutoProgress
+from pocket_ic.benchmark import (
+    INSTRUCTIONS_PER_INGRESS_BYTE,
+    benchmark_method,
+    benchmark_upgrade,
+    estimate_instructions,
+)
+from pocket_ic.compression import PayloadCompressor
+from pocket_ic.fuzz import CandidValueGenerator, Fuzzer, ResetMode
+from pocket_ic.lazy_result import LazyCandidResult
+from pocket_ic.load import Call, LoadGenerator
+from pocket_ic.prepared_call import PreparedCall, candid_header
+from pocket_ic.profiler import CyclesProfiler
+from pocket_ic.query_cache import QueryCache
+from pocket_ic.resources import ResourceSampler
+from pocket_ic.stable_memory import StableMemorySnapshot
+from pocket_ic.tracing import Tracer, start_tracing, stop_tracing
+from pocket_ic.transport import (
+    HttpxTransport,
+    RequestsTransport,
+    RetryPolicy,
+    Transport,
+)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COUNTER_WASM = os.path.join(ROOT_DIR, "examples", "counter_canister", "counter.wasm")
+LEDGER_DID = os.path.join(ROOT_DIR, "examples", "ledger_canister", "ledger.did")
+LEDGER_WASM = os.path.join(
+    ROOT_DIR, "examples", "ledger_canister", "ledger_canister.wasm"
+)
+
+
+# Upper bound for `import pocket_ic` plus resolving its public names, in seconds.
+IMPORT_TIME_BUDGET = 0.5
 
 
 class PocketICTests(unittest.TestCase):
+    def _install_counter(self, pic=None):
+        # Installs the counter canister with 20T cycles on `pic`, or on a new instance.
+        pic = pic if pic is not None else PocketIC()
+        canister_id = pic.create_canister()
+        pic.add_cycles(canister_id, 20_000_000_000_000)
+        with open(COUNTER_WASM, "rb") as wasm_file:
+            pic.install_code(canister_id, wasm_file.read(), [])
+        return pic, canister_id
+
+    def test_import_is_lazy_and_within_budget(self):
+        # Run in a fresh interpreter, so modules imported by this test file don't interfere.
+        code = """
+import sys, time
+start = time.perf_counter()
+import pocket_ic
+pocket_ic.PocketIC, pocket_ic.PocketICServer, pocket_ic.SubnetConfig
+elapsed = time.perf_counter() - start
+heavy = [m for m in ("ic.candid", "ic.canister", "antlr4", "ecdsa", "cbor2") if m in sys.modules]
+print(elapsed, ",".join(heavy))
+"""
+        out = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=ROOT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        self.assertEqual(out[1:], [])
+        self.assertLess(float(out[0]), IMPORT_TIME_BUDGET)
+
     def test_create_canister_with_id(self):
         pic = PocketIC(SubnetConfig(nns=True))
         canister_id = ic.Principal.from_str("rwlgt-iiaaa-aaaaa-aaaaa-cai")
@@ -79,6 +156,26 @@ class PocketICTests(unittest.TestCase):
         self.assertEqual(pic.get_subnet(nns_canister).bytes, nns_subnet.bytes)
         self.assertEqual(pic.get_subnet(app_canister).bytes, app_subnet.bytes)
 
+    def test_install_chunked_code(self):
+        pic = PocketIC()
+        canister_id = pic.create_canister()
+        pic.add_cycles(canister_id, 20_000_000_000_000)
+        with open(COUNTER_WASM, "rb") as wasm_file:
+            wasm = wasm_file.read()
+
+        hashes = pic.upload_chunks(canister_id, wasm[:128], chunk_size=64)
+        self.assertEqual(sorted(pic.stored_chunks(canister_id)), sorted(hashes))
+
+        # the first two chunks are already stored; the module is read from the file
+        pic.install_chunked_code(canister_id, COUNTER_WASM, [], chunk_size=64)
+        self.assertEqual(len(pic.stored_chunks(canister_id)), 4)
+        pic.update_call(canister_id, "write", ic.encode([]))
+        counter = pic.query_call(canister_id, "read", ic.encode([]))
+        self.assertEqual(counter, [1, 0, 0, 0])
+
+        with self.assertRaises(ValueError):
+            pic.upload_chunks(canister_id, wasm, chunk_size=2 * 1024 * 1024)
+
     def test_set_get_stable_memory_no_compression(self):
         pic = PocketIC()
         canister_id = pic.create_canister()
@@ -103,6 +200,480 @@ class PocketICTests(unittest.TestCase):
         memory = pic.get_stable_memory(canister_id)[: len(text)]
         self.assertEqual(memory, text)
 
+    def test_set_get_stable_memory_auto_compression(self):
+        pic = PocketIC()
+        canister_id = pic.create_canister()
+        pic.add_cycles(canister_id, 20_000_000_000_000)
+        pic.install_code(canister_id, b"\x00\x61\x73\x6d\x01\x00\x00\x00", [])
+
+        data = b"compressible " * 100_000
+        pic.set_stable_memory(canister_id, data)
+        memory = pic.get_stable_memory(canister_id)[: len(data)]
+        self.assertEqual(memory, data)
+
+    def test_payload_compressor(self):
+        compressor = PayloadCompressor(threshold=1024)
+
+        small = b"a" * 100
+        self.assertEqual(compressor.compress(small).result(), (small, None))
+
+        large = b"a" * 100_000
+        future = compressor.compress(large)
+        payload, compression = future.result()
+        self.assertEqual(compression, "gzip")
+        self.assertEqual(gzip.decompress(payload), large)
+        # the same payload is served from the cache
+        self.assertIs(compressor.compress(large), future)
+        # already compressed payloads are passed through
+        self.assertEqual(compressor.compress(payload).result(), (payload, None))
+        # incompressible payloads are sent as is
+        noise = os.urandom(100_000)
+        self.assertEqual(compressor.compress(noise).result(), (noise, None))
+
+    def test_candid_value_generator(self):
+        with open(LEDGER_DID, encoding="utf-8") as candid_file:
+            canister = ic.Canister(None, "aaaaa-aa", candid_file.read())
+        generator = CandidValueGenerator(seed=7, max_size=4)
+        for func in canister.actor["methods"].values():
+            for _ in range(10):
+                args = generator.arguments(func.argTypes)
+                payload = ic.encode(
+                    [{"type": t, "value": v} for t, v in zip(func.argTypes, args)]
+                )
+                self.assertEqual(len(ic.decode(payload, func.argTypes)), len(args))
+
+        # the same seed generates the same values
+        transfer = canister.actor["methods"]["icrc1_transfer"].argTypes
+        self.assertEqual(
+            CandidValueGenerator(seed=1).arguments(transfer),
+            CandidValueGenerator(seed=1).arguments(transfer),
+        )
+
+        types = ic.candid.Types
+        tree = types.Rec()
+        tree.fill(types.Vec(tree))
+        self.assertTrue(generator.supports(tree))
+        self.assertIsInstance(generator.value(types.Tuple(types.Nat, types.Text)), list)
+        self.assertFalse(generator.supports(types.Opt(types.Empty)))
+        with self.assertRaises(ValueError):
+            generator.value(types.Empty)
+
+        # methods whose arguments cannot be generated are skipped, or rejected if named
+        candid = "service : { f : (nat) -> (); g : (func () -> ()) -> (); }"
+        canister = ic.Canister(None, "aaaaa-aa", candid)
+        self.assertEqual(Fuzzer(None, canister).methods, ["f"])
+        with self.assertRaises(ValueError):
+            Fuzzer(None, canister, methods=["g"])
+
+    def test_fuzzer(self):
+        pic, canister_id = self._install_counter()
+        candid = "service : { write : () -> (); read : () -> (nat32) query; }"
+        canister = ic.Canister(pic, canister_id, candid)
+
+        resets = []
+        fuzzer = Fuzzer(pic, canister, batch_size=10, reset=resets.append, seed=3)
+        report = fuzzer.run(50)
+        self.assertEqual(len(report.cases), 50)
+        self.assertEqual(len(resets), 4)
+        self.assertEqual(report.failures, [])
+        self.assertGreater(report.cases_per_second, 0)
+        self.assertIn("50 cases", str(report))
+
+        with self.assertRaises(ValueError):
+            Fuzzer(pic, canister, methods=["does_not_exist"])
+
+    def test_canister_snapshots(self):
+        pic, canister_id = self._install_counter()
+        pic.update_call(canister_id, "write", ic.encode([]))
+
+        snapshot = pic.take_canister_snapshot(canister_id)
+        self.assertEqual(pic.list_canister_snapshots(canister_id), [snapshot])
+        pic.update_call(canister_id, "write", ic.encode([]))
+        pic.update_call(canister_id, "write", ic.encode([]))
+        pic.restore_canister(canister_id, snapshot)
+        counter = pic.query_call(canister_id, "read", ic.encode([]))
+        self.assertEqual(counter, [1, 0, 0, 0])
+
+        pic.restore_canister(canister_id, snapshot, stop=True)
+        self.assertEqual(pic.query_call(canister_id, "read", ic.encode([])), counter)
+        pic.delete_canister_snapshot(canister_id, snapshot)
+        self.assertEqual(pic.list_canister_snapshots(canister_id), [])
+
+        # every batch of the fuzzer starts from the same snapshot
+        candid = "service : { write : () -> (); }"
+        canister = ic.Canister(pic, canister_id, candid)
+        fuzzer = Fuzzer(pic, canister, batch_size=5, reset=ResetMode.CANISTER_SNAPSHOT)
+        report = fuzzer.run(15)
+        self.assertEqual(report.resets, 2)
+        counter = pic.query_call(canister_id, "read", ic.encode([]))
+        self.assertEqual(counter, [6, 0, 0, 0])
+        fuzzer.delete_snapshot()
+        self.assertEqual(pic.list_canister_snapshots(canister_id), [])
+
+    def test_auto_progress(self):
+        pic, canister_id = self._install_counter()
+
+        with self.assertRaises(RuntimeError):
+            pic.update_call_async(canister_id, "write", ic.encode([]))
+
+        driver = pic.start_auto_progress(interval=0.001)
+        futures = [
+            pic.update_call_async(canister_id, "write", ic.encode([]))
+            for _ in range(10)
+        ]
+        missing = pic.update_call_async(canister_id, "does_not_exist", ic.encode([]))
+        for future in futures:
+            future.result(timeout=30)
+        with self.assertRaises(ValueError):
+            missing.result(timeout=30)
+
+        pic.stop_auto_progress()
+        self.assertFalse(driver.running)
+        count = pic.query_call(canister_id, "read", ic.encode([]))
+        self.assertEqual(count, [10, 0, 0, 0])
+
+    def test_auto_progress_status_errors(self):
+        class Instance:
+            # an instance on which the status of the call "bad" cannot be read
+            def tick(self):
+                pass
+
+            def call_result(self, message_id):
+                if message_id == "bad":
+                    raise ConnectionError("unknown message")
+                return message_id
+
+        driver = AutoProgress(Instance(), interval=0.001)
+        driver.start()
+        good, bad = driver.watch("good"), driver.watch("bad")
+        self.assertEqual(good.result(timeout=5), "good")
+        with self.assertRaises(ConnectionError):
+            bad.result(timeout=5)
+        # the driver survives and resolves later calls
+        self.assertEqual(driver.watch("later").result(timeout=5), "later")
+        self.assertTrue(driver.running)
+        driver.stop()
+
+    def test_load_generator(self):
+        pic, canister_id = self._install_counter()
+
+        write = Call(canister_id, "write", ic.encode([]), weight=3)
+        missing = Call(canister_id, "does_not_exist", ic.encode([]))
+        senders = [ic.Principal(bytes([i])) for i in range(1, 5)]
+        generator = LoadGenerator(
+            pic, [write, missing], senders=senders, concurrency=20, seed=42
+        )
+        report = generator.run(100)
+
+        self.assertEqual(report.submitted, 100)
+        self.assertEqual(report.completed + report.rejected, 100)
+        self.assertGreater(report.rejected, 0)
+        self.assertEqual(report.timed_out, 0)
+        self.assertGreaterEqual(report.rounds, 5)
+        self.assertGreaterEqual(report.latency_percentile(50), 1)
+        count = pic.query_call(canister_id, "read", ic.encode([]))
+        self.assertEqual(int.from_bytes(bytes(count), "little"), report.completed)
+
+    def test_cycles_profiling(self):
+        pic = PocketIC()
+        profiler = pic.enable_cycles_profiling()
+        pic, canister_id = self._install_counter(pic)
+        for _ in range(3):
+            pic.update_call(canister_id, "write", ic.encode([]))
+        pic.query_call(canister_id, "read", ic.encode([]))
+
+        stats = {s.method: s for s in profiler.stats()}
+        self.assertEqual(set(stats), {"install_code", "write", "read"})
+        self.assertEqual(stats["write"].calls, 3)
+        self.assertGreater(stats["write"].p50, 0)
+        self.assertIn("write", profiler.report())
+
+        profiler.check_budgets({"write": 10**12})
+        with self.assertRaises(AssertionError):
+            profiler.check_budgets({(str(canister_id), "write"): 1})
+
+    def test_cycles_profiler_budgets(self):
+        profiler = CyclesProfiler()
+        for cycles in [100, 200, 300, 10_000]:
+            profiler.record("rwlgt-iiaaa-aaaaa-aaaaa-cai", "transfer", cycles)
+        (stats,) = profiler.stats()
+        self.assertEqual(
+            (stats.calls, stats.total, stats.p50, stats.max), (4, 10_600, 200, 10_000)
+        )
+
+        profiler.check_budgets({"transfer": 250})
+        profiler.check_budgets({"other": 1})
+        with self.assertRaises(AssertionError) as ex:
+            profiler.check_budgets({"transfer": 250}, p=99)
+        self.assertIn("transfer", ex.exception.args[0])
+
+    def test_install_modes(self):
+        pic = PocketIC()
+        canister_id = pic.create_canister()
+        pic.add_cycles(canister_id, 20_000_000_000_000)
+        with open(COUNTER_WASM, "rb") as wasm_file:
+            wasm = wasm_file.read()
+        pic.install_code(canister_id, wasm, [])
+        pic.set_stable_memory(canister_id, b"state" * 1000)
+
+        # upgrades keep the stable memory, reinstalls clear it
+        pic.install_code(canister_id, wasm, [], InstallMode.UPGRADE)
+        pic.install_code(
+            canister_id,
+            wasm,
+            [],
+            InstallMode.UPGRADE,
+            UpgradeOptions(skip_pre_upgrade=True),
+        )
+        self.assertTrue(pic.get_stable_memory(canister_id).startswith(b"state" * 1000))
+        pic.install_code(canister_id, wasm, [], InstallMode.REINSTALL)
+        self.assertNotIn(b"state", pic.get_stable_memory(canister_id))
+
+        with self.assertRaises(ValueError):
+            pic.install_code(
+                canister_id, wasm, [], InstallMode.INSTALL, UpgradeOptions()
+            )
+
+    def test_benchmark_upgrade(self):
+        pic = PocketIC()
+        canister_id = pic.create_canister()
+        pic.add_cycles(canister_id, 20_000_000_000_000)
+        with open(COUNTER_WASM, "rb") as wasm_file:
+            wasm = wasm_file.read()
+        pic.install_code(canister_id, wasm, [])
+
+        result = benchmark_upgrade(
+            pic, canister_id, wasm, [], stable_memory_sizes=[0, 1 << 20]
+        )
+        self.assertEqual([c.stable_memory_size for c in result.costs], [0, 1 << 20])
+        self.assertTrue(all(c.cycles > 0 for c in result.costs))
+        self.assertTrue(all(c.pre_upgrade_cycles >= 0 for c in result.costs))
+        self.assertEqual(len(result.as_dict()["upgrades"]), 2)
+        self.assertEqual(pic.list_canister_snapshots(canister_id), [])
+
+    def test_estimate_instructions(self):
+        fixed = 5_000_000 + 1_200_000 + 2_000 * 10
+        self.assertEqual(estimate_instructions(fixed + 4_000, 10), 10_000)
+        # fees scale with the size of the subnet
+        cycles = (fixed + 4_000) * 2
+        self.assertEqual(estimate_instructions(cycles, 10, subnet_size=26), 10_000)
+        self.assertEqual(estimate_instructions(0), 0)
+        # every ingress byte not accounted for inflates the estimate
+        self.assertEqual(
+            estimate_instructions(10**9, 10) - estimate_instructions(10**9, 11),
+            INSTRUCTIONS_PER_INGRESS_BYTE,
+        )
+
+    def test_benchmark_method(self):
+        tmp_dir = tempfile.mkdtemp()
+        config = SubnetConfig(
+            application=1,
+            instruction_config=InstructionConfig.BENCHMARKING,
+            state_dir=tmp_dir,
+        )
+        pic = PocketIC(config)
+        pic, canister_id = self._install_counter(pic)
+
+        result = benchmark_method(
+            pic, canister_id, "write", ic.encode([]), repetitions=3
+        )
+        self.assertEqual(len(result.costs), 3)
+        self.assertTrue(all(cost.cycles > 0 for cost in result.costs))
+        self.assertEqual(result.as_dict()["calls"], 3)
+        subnet_size = pic.get_subnet_size(pic.get_subnet(canister_id))
+        self.assertEqual(result.subnet_size, subnet_size)
+
+        # every call starts from the checkpointed state
+        checkpoint = pic.checkpoint()
+        result = benchmark_method(
+            pic,
+            canister_id,
+            "write",
+            ic.encode([]),
+            repetitions=2,
+            checkpoint=checkpoint,
+        )
+        self.assertEqual(len(result.costs), 2)
+        counter = pic.query_call(canister_id, "read", ic.encode([]))
+        self.assertEqual(counter, [3, 0, 0, 0])
+
+        pic.close().result()
+        checkpoint.delete()
+        shutil.rmtree(tmp_dir)
+
+    def test_lazy_candid_result(self):
+        raw = ic.encode(
+            [{"type": ic.candid.Types.Vec(ic.candid.Types.Nat), "value": [1, 2, 3]}]
+        )
+        result = LazyCandidResult(raw)
+        self.assertEqual(result.raw, raw)
+        self.assertEqual(result, LazyCandidResult(raw))
+        self.assertEqual(hash(result), hash(LazyCandidResult(raw)))
+        self.assertFalse(result.is_decoded)
+
+        self.assertEqual(result[0], [1, 2, 3])
+        self.assertTrue(result.is_decoded)
+        self.assertEqual(len(result), 1)
+        self.assertEqual(list(result), [[1, 2, 3]])
+        self.assertEqual(result, [[1, 2, 3]])
+        self.assertEqual(result.decode()[0]["value"], [1, 2, 3])
+
+    def test_lazy_decoding_through_canister(self):
+        pic = PocketIC(SubnetConfig(nns=True))
+        account = {"owner": ic.Principal(b"A").to_str(), "subaccount": []}
+        init_args = {
+            "Init": {
+                "decimals": [],
+                "token_symbol": "MYTOKEN",
+                "transfer_fee": 0,
+                "metadata": [],
+                "minting_account": {"owner": "2vxsx-fae", "subaccount": []},
+                "initial_balances": [(account, 666)],
+                "maximum_number_of_accounts": [],
+                "accounts_overflow_trim_quantity": [],
+                "fee_collector_account": [],
+                "archive_options": {
+                    "num_blocks_to_archive": 1,
+                    "max_transactions_per_response": [],
+                    "trigger_threshold": 1,
+                    "max_message_size_bytes": [],
+                    "cycles_for_archive_creation": [],
+                    "node_max_memory_size_bytes": [],
+                    "controller_id": "2vxsx-fae",
+                },
+                "max_memo_length": [],
+                "token_name": "My Token",
+                "feature_flags": [],
+            }
+        }
+        with open(LEDGER_DID, "r", encoding="utf-8") as candid_file:
+            candid = candid_file.read()
+        with open(LEDGER_WASM, "rb") as wasm_file:
+            ledger = pic.create_and_install_canister_with_candid(
+                candid, wasm_file.read(), init_args
+            )
+
+        pic.lazy_decoding = True
+        name = ledger.icrc1_name()
+        self.assertIsInstance(name, LazyCandidResult)
+        self.assertEqual(name[0], "My Token")
+        self.assertEqual(name, ["My Token"])
+        pic.set_sender(ic.Principal(b"A"))
+        res = ledger.icrc1_transfer(
+            {
+                "from_subaccount": [],
+                "to": {"owner": ic.Principal(b"B").to_str(), "subaccount": []},
+                "amount": 42,
+                "fee": [],
+                "memo": [],
+                "created_at_time": [],
+            }
+        )
+        self.assertTrue("Ok" in res[0])
+
+    def test_stable_memory_snapshot_diff(self):
+        page = 1024
+        data = b"a" * page + bytes(2 * page) + b"b" * page
+        snapshot = StableMemorySnapshot(data, page_size=page, keep_pages=True)
+        # zero pages are not stored
+        self.assertEqual(snapshot.stored_bytes(), 2 * page)
+
+        changed = bytearray(data)
+        changed[page + 1] = 1
+        changed[2 * page + 1] = 1
+        changed += b"c" * 10
+        later = StableMemorySnapshot(
+            bytes(changed), page_size=page, keep_pages=True, base=snapshot
+        )
+        diff = snapshot.diff(later)
+        self.assertEqual(diff.changed_pages, [1, 2, 4])
+        self.assertEqual(diff.regions(), [(page, 2 * page), (4 * page, page)])
+        # only the pages that differ from the base are stored
+        self.assertEqual(later.stored_bytes(), 2 * page + 10)
+        self.assertEqual(later.page(0), b"a" * page)
+
+        self.assertEqual(snapshot.patch(bytes(changed)), data)
+        self.assertEqual(later.patch(data), bytes(changed))
+        self.assertFalse(snapshot.diff(StableMemorySnapshot(data, page_size=page)))
+
+    def test_stable_memory_snapshot_restore(self):
+        pic = PocketIC()
+        canister_id = pic.create_canister()
+        pic.add_cycles(canister_id, 20_000_000_000_000)
+        pic.install_code(canister_id, b"\x00\x61\x73\x6d\x01\x00\x00\x00", [])
+        pic.set_stable_memory(canister_id, b"initial state" * 10_000)
+        snapshot = pic.snapshot_stable_memory(canister_id)
+
+        self.assertFalse(pic.diff_stable_memory(canister_id, snapshot))
+        self.assertFalse(pic.restore_stable_memory(canister_id, snapshot))
+
+        pic.set_stable_memory(canister_id, b"changed")
+        diff = pic.diff_stable_memory(canister_id, snapshot)
+        self.assertIn(0, diff.changed_pages)
+
+        pic.restore_stable_memory(canister_id, snapshot)
+        self.assertFalse(pic.diff_stable_memory(canister_id, snapshot))
+
+    def test_prepared_calls(self):
+        pic, canister_id = self._install_counter()
+
+        write = pic.prepare(canister_id, "write", [])
+        read = pic.prepare(canister_id, "read", [], query=True)
+        for expected in range(1, 4):
+            self.assertEqual(write(), [expected, 0, 0, 0])
+        self.assertEqual(read(), [3, 0, 0, 0])
+        with self.assertRaises(ValueError):
+            write(1)
+
+    def test_query_cache(self):
+        cache = QueryCache(max_entries=2)
+        _, generation = cache.get("a")
+        cache.put("a", 1, generation)
+        cache.put("b", 2, generation)
+        self.assertEqual(cache.get("a"), (1, generation))
+        # "b" is the least recently used entry
+        cache.put("c", 3, generation)
+        self.assertEqual(cache.get("b"), (None, generation))
+        cache.invalidate()
+        # results fetched before the invalidation are dropped
+        cache.put("a", 1, generation)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual((cache.hits, cache.misses, cache.invalidations), (1, 2, 1))
+
+    def test_cached_queries(self):
+        pic, canister_id = self._install_counter()
+        cache = pic.enable_query_cache()
+
+        first = pic.query_call(canister_id, "read", ic.encode([]))
+        self.assertEqual(pic.query_call(canister_id, "read", ic.encode([])), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        pic.update_call(canister_id, "write", ic.encode([]))
+        self.assertNotEqual(pic.query_call(canister_id, "read", ic.encode([])), first)
+        self.assertEqual(cache.misses, 2)
+        pic.prepare(canister_id, "write", [])()
+        pic.query_call(canister_id, "read", ic.encode([]))
+        pic.tick()
+        pic.query_call(canister_id, "read", ic.encode([]))
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+    def test_prepared_call_encoding(self):
+        types = ic.candid.Types
+        arg_types = [
+            types.Record({"a": types.Nat, "b": types.Vec(types.Text)}),
+            types.Opt(types.Principal),
+        ]
+        # the request is only sent when the call is made, so no instance is needed
+        call = PreparedCall(
+            None, None, "method", arg_types, sender=ic.Principal.anonymous()
+        )
+        args = [{"a": 5, "b": ["x", "y"]}, []]
+        expected = ic.encode([{"type": t, "value": v} for t, v in zip(arg_types, args)])
+        self.assertTrue(expected.startswith(candid_header(arg_types)))
+        self.assertEqual(call.encode(*args), expected)
+        with self.assertRaises(TypeError):
+            call.encode({"a": 5, "b": [1]}, [])
+
     def test_time(self):
         pic = PocketIC()
         pic.set_time(1704067199999999999)
@@ -121,12 +692,209 @@ class PocketICTests(unittest.TestCase):
         server = pic.server
         initial_num = server.list_instances().count("Deleted")
         del pic
+        server.wait_for_deletions()
         self.assertEqual(server.list_instances().count("Deleted"), initial_num + 1)
 
+    def test_context_manager_and_close(self):
+        with PocketIC() as pic:
+            server = pic.server
+            instance_id = pic.instance_id
+            pic.tick()
+        server.wait_for_deletions()
+        self.assertEqual(server.list_instances()[instance_id], "Deleted")
+
+        pic = PocketIC()
+        future = pic.close()
+        self.assertIs(pic.close(), future)
+        future.result()
+        self.assertEqual(pic.server.list_instances()[pic.instance_id], "Deleted")
+
+    def test_reclaim_instances(self):
+        pic = PocketIC()
+        server = pic.server
+        live_id = pic.instance_id
+        # the owner is dropped right away, so the new instance is orphaned
+        config = SubnetConfig(application=1)
+        orphan_id = server.new_instance(config._json(), owner=SubnetConfig())
+        self.assertEqual(server.reclaim_instances(), [orphan_id])
+        self.assertEqual(server.list_instances()[orphan_id], "Deleted")
+        self.assertNotEqual(server.list_instances()[live_id], "Deleted")
+
+    def test_server_cluster(self):
+        cluster = PocketICServerCluster(size=2)
+        self.assertNotEqual(cluster.servers[0].url, cluster.servers[1].url)
+        pics = [PocketIC(server=cluster) for _ in range(4)]
+        self.assertEqual(cluster.load(), [2, 2])
+        self.assertEqual(len({pic.instance_id for pic in pics}), 4)
+
+        for i, pic in enumerate(pics):
+            canister_id = pic.create_canister()
+            pic.add_cycles(canister_id, 20_000_000_000_000)
+            pic.install_code(canister_id, b"\x00\x61\x73\x6d\x01\x00\x00\x00", [])
+            # blobs are uploaded to the server hosting the instance
+            pic.set_stable_memory(canister_id, f"instance {i}".encode())
+            memory = pic.get_stable_memory(canister_id)
+            self.assertTrue(memory.startswith(f"instance {i}".encode()))
+
+        for pic in pics:
+            pic.close().result()
+        self.assertEqual(cluster.load(), [0, 0])
+        statuses = cluster.list_instances()
+        self.assertTrue(all(statuses[pic.instance_id] == "Deleted" for pic in pics))
+
+    def test_shared_server(self):
+        name = f"test_{os.getpid()}"
+        server = PocketICServer(shared=name)
+        # a sibling process discovers the same server
+        code = f"from pocket_ic import PocketICServer; print(PocketICServer(shared={name!r}).url)"
+        out = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=ROOT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        self.assertEqual(out.stdout.strip(), server.url)
+        # the sibling has left, but the server is still running for this process
+        with PocketIC(server=server) as pic:
+            pic.tick()
+
+    def test_shared_server_env_with_url(self):
+        urls = ["http://127.0.0.1:1", "http://127.0.0.1:2"]
+        with unittest.mock.patch.dict(os.environ, {"POCKET_IC_SHARED_SERVER": "suite"}):
+            # attaching by URL ignores the environment variable
+            server = PocketICServer(url=urls[0])
+            cluster = PocketICServerCluster(urls=urls)
+        self.assertEqual(server.url, urls[0])
+        self.assertIsNone(server.pid)
+        self.assertEqual([server.url for server in cluster.servers], urls)
+        with self.assertRaises(ValueError):
+            PocketICServer(url=urls[0], shared="suite")
+
     def test_tick(self):
         pic = PocketIC()
         self.assertEqual(pic.tick(), None)
 
+    def test_request_metrics(self):
+        pic = PocketIC()
+        metrics = pic.server.metrics
+        requests_before = metrics.requests
+        pic.tick()
+        pic.get_time()
+        self.assertEqual(metrics.requests, requests_before + 2)
+        self.assertEqual(metrics.timeouts, 0)
+
+    def test_retry_policy(self):
+        policy = RetryPolicy(attempts=3)
+        self.assertTrue(policy.allows("POST", 1, sent=False))
+        self.assertFalse(policy.allows("POST", 1, sent=True))
+        self.assertTrue(policy.allows("GET", 2, sent=True))
+        self.assertFalse(policy.allows("GET", 3, sent=True))
+        self.assertEqual([policy.delay(n) for n in (1, 2, 3)], [0.05, 0.1, 0.2])
+        with self.assertRaises(ValueError):
+            RetryPolicy(attempts=0)
+
+    def test_transport_retries(self):
+        # nothing listens on the port of a closed socket
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            url = f"http://127.0.0.1:{sock.getsockname()[1]}/instances"
+        policy = RetryPolicy(attempts=3, backoff=0)
+        requests_transport = RequestsTransport(retry_policy=policy)
+        with self.assertRaises(requests.ConnectionError):
+            requests_transport.request("POST", url, json={})
+        self.assertEqual(requests_transport.retries, 2)
+        httpx_transport = HttpxTransport(retry_policy=policy)
+        with self.assertRaises(ConnectionError):
+            httpx_transport.request("POST", url, data=b"blob")
+        self.assertEqual(httpx_transport.retries, 2)
+        with self.assertRaises(TypeError):
+            Transport()  # pylint: disable=abstract-class-instantiated
+
+    def test_httpx_transport(self):
+        server = PocketICServer(transport=HttpxTransport(pool_size=4))
+        pic = PocketIC(server=server)
+        pic.tick()
+        self.assertEqual(server.transport.retries, 0)
+
+    def test_resource_sampler(self):
+        sampler = ResourceSampler(os.getpid(), interval=0.01)
+        with sampler.scope("allocates") as usage:
+            data = bytearray(32 << 20)
+        with sampler.scope("idle"):
+            pass
+        del data
+        self.assertGreaterEqual(usage.rss_growth, 16 << 20)
+        self.assertGreaterEqual(usage.peak_rss_bytes, usage.start.rss_bytes)
+        self.assertEqual([u.name for u in sampler.top_growth(1)], ["allocates"])
+        self.assertIn("allocates", sampler.report())
+
+    def test_resource_sampler_exited_process(self):
+        process = subprocess.Popen([sys.executable, "-c", ""])
+        # wait for the process to exit without reaping it, i.e. it is a zombie
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        with self.assertRaises(OSError):
+            ResourceSampler(process.pid).begin("exited")
+        process.wait()
+
+    def test_server_resource_sampling(self):
+        server = PocketICServer()
+        self.assertIsNotNone(server.pid)
+        sampler = server.enable_resource_sampling(interval=0.05)
+        try:
+            with sampler.scope("test"):
+                # instances on other server objects of the same process are sampled too
+                pic = PocketIC()
+                pic.tick()
+                pic.close().result()
+            names = [usage.name for usage in sampler.top_growth()]
+            self.assertIn("test", names)
+            self.assertIn(f"instance {pic.instance_id}", names)
+            self.assertGreater(sampler.samples[-1].rss_bytes, 0)
+            self.assertGreater(sampler.samples[-1].threads, 0)
+        finally:
+            server.disable_resource_sampling()
+        self.assertIsNone(server.sampler)
+        with self.assertRaises(ValueError):
+            PocketICServer(url=server.url).enable_resource_sampling()
+
+    def test_tracer(self):
+        tracer = Tracer()
+        with tracer.span("outer", method="write") as outer:
+            with tracer.span("inner", "http"):
+                tracer.count("rounds")
+            tracer.count("rounds")
+            outer["extra"] = 1
+        events = [e for e in tracer.to_json()["traceEvents"] if e["ph"] == "X"]
+        inner, outer = events
+        self.assertEqual(inner["args"], {"rounds": 1})
+        self.assertEqual(outer["args"], {"method": "write", "rounds": 2, "extra": 1})
+        self.assertLessEqual(outer["ts"], inner["ts"])
+        self.assertGreaterEqual(outer["ts"] + outer["dur"], inner["ts"] + inner["dur"])
+
+    def test_tracing(self):
+        pic, canister_id = self._install_counter()
+
+        start_tracing()
+        pic.update_call(canister_id, "write", ic.encode([]))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "trace.json")
+            stop_tracing(path)
+            with open(path, encoding="utf-8") as trace_file:
+                events = json.load(trace_file)["traceEvents"]
+
+        spans = {e["name"]: e for e in events if e["ph"] == "X"}
+        update = spans["update_call"]
+        self.assertEqual(update["args"]["instance_id"], pic.instance_id)
+        self.assertEqual(update["args"]["canister_id"], str(canister_id))
+        self.assertEqual(update["args"]["method"], "write")
+        self.assertGreaterEqual(update["args"]["rounds"], 1)
+        self.assertTrue(any(e["cat"] == "http" for e in spans.values()))
+
+        # nothing is recorded once tracing is stopped
+        pic.tick()
+        self.assertIsNone(stop_tracing())
+
     def test_get_root_key(self):
         pic = PocketIC()
         self.assertTrue(pic.get_root_key() is None)
@@ -190,8 +958,8 @@ class PocketICTests(unittest.TestCase):
         stable_mem = pic.get_stable_memory(canister_id)
         self.assertTrue(stable_mem.startswith(b"Hello world!"))
 
-        # delete the PocketIC instance
-        del pic
+        # delete the PocketIC instance, which writes its state
+        pic.close().result()
 
         # create a new PocketIC instance with the same state, subnets and canister states stay
         config2 = SubnetConfig(
@@ -232,6 +1000,39 @@ class PocketICTests(unittest.TestCase):
         # clean up
         shutil.rmtree(tmp_dir)
 
+    def test_checkpoint_and_fork(self):
+        tmp_dir = tempfile.mkdtemp()
+        pic = PocketIC(SubnetConfig(application=1, state_dir=tmp_dir))
+        canister_id = pic.create_canister()
+        pic.add_cycles(canister_id, 20_000_000_000_000)
+        pic.install_code(canister_id, b"\x00\x61\x73\x6d\x01\x00\x00\x00", [])
+        pic.set_stable_memory(canister_id, b"checkpointed")
+
+        checkpoint = pic.checkpoint()
+        # the original instance continues from the same state
+        self.assertTrue(pic.get_stable_memory(canister_id).startswith(b"checkpointed"))
+        pic.set_stable_memory(canister_id, b"diverged")
+
+        # forks start from the checkpoint and are independent of each other
+        fork1 = PocketIC.fork(checkpoint)
+        fork2 = PocketIC.fork(checkpoint)
+        fork1.set_stable_memory(canister_id, b"fork one")
+        self.assertTrue(fork1.get_stable_memory(canister_id).startswith(b"fork one"))
+        self.assertTrue(
+            fork2.get_stable_memory(canister_id).startswith(b"checkpointed")
+        )
+        self.assertTrue(pic.get_stable_memory(canister_id).startswith(b"diverged"))
+
+        for instance in [pic, fork1, fork2]:
+            instance.close().result()
+        checkpoint.delete()
+        shutil.rmtree(tmp_dir)
+
+    def test_checkpoint_requires_state_dir(self):
+        with PocketIC() as pic:
+            with self.assertRaises(ValueError):
+                pic.checkpoint()
+
 
 if __name__ == "__main__":
     unittest.main()